@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+
+##########################################################################
+# benchmark.py - Laufzeitmessung für tcsrechnung.py                      #
+#                                                                        #
+# This program is free software: you can redistribute it and/or modify   #
+# it under the terms of the GNU General Public License as published by   #
+# the Free Software Foundation, either version 3 of the License, or      #
+# (at your option) any later version.                                    #
+#                                                                        #
+# This program is distributed in the hope that it will be useful,        #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of         #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the          #
+# GNU General Public License for more details.                           #
+#                                                                        #
+# You should have received a copy of the GNU General Public License      #
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.  #
+##########################################################################
+
+import sys
+import os
+import io
+import copy
+import contextlib
+import datetime
+import json
+import platform
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+import argparse
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+)
+
+import tcsrechnung  # noqa: E402
+import testdaten  # noqa: E402
+
+PHASEN = ["parse", "metadaten", "laden", "rechnung", "mail", "ausgabe"]
+STANDARD_ANZAHL = [1000, 10000, 100000]
+# Relative slowdown of a phase against the baseline that is reported
+TOLERANZ = 0.10
+
+
+def _verbreitere(rechnung: ET.Element, kinder: int, trainings: int) -> None:
+    # Repeat children and trainings of an invoice to create large letters
+    vorlagen = rechnung.findall("kind")
+    if vorlagen:
+        for kind in vorlagen:
+            rechnung.remove(kind)
+        for i in range(kinder):
+            kind = copy.deepcopy(vorlagen[i % len(vorlagen)])
+            name = kind.find("name")
+            if name is not None:
+                name.text = f"{name.text} {i + 1}"
+            rechnung.append(kind)
+    for kind in rechnung.findall("kind"):
+        training_vorlagen = kind.findall("training")
+        if not training_vorlagen:
+            continue
+        for training in training_vorlagen:
+            kind.remove(training)
+        for i in range(trainings):
+            vorlage = training_vorlagen[i % len(training_vorlagen)]
+            kind.append(copy.deepcopy(vorlage))
+
+
+def vervielfache(
+    eingabedatei: str,
+    anzahl: int,
+    kinder: int | None = None,
+    trainings: int | None = None,
+) -> bytes:
+    # Repeat the invoices of the input file until it holds anzahl invoices
+    root = ET.parse(eingabedatei).getroot()
+    vorlagen = root.findall("rechnung")
+    for rechnung in vorlagen:
+        root.remove(rechnung)
+        if kinder is not None or trainings is not None:
+            _verbreitere(
+                rechnung,
+                kinder if kinder is not None else len(rechnung.findall("kind")),
+                trainings if trainings is not None else 1,
+            )
+    for i in range(anzahl):
+        root.append(copy.deepcopy(vorlagen[i % len(vorlagen)]))
+    return ET.tostring(root)
+
+
+def messe(xml: bytes, ausgabeordner: str) -> dict[str, float]:
+    # Duration of each phase in seconds for one pass over all invoices
+    zeiten: dict[str, float] = {}
+
+    start = time.perf_counter()
+    root = ET.fromstring(xml)
+    zeiten["parse"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        meta = tcsrechnung.Metadaten(root)
+    zeiten["metadaten"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    rechnungen = [tcsrechnung.Rechnung.aus_xml(r) for r in root.iter("rechnung")]
+    zeiten["laden"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    texte = [
+        tcsrechnung.erstelle_rechnung(rechnung, nr, meta)
+        for nr, rechnung in enumerate(rechnungen, 1)
+    ]
+    zeiten["rechnung"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    mails: list[str | None] = []
+    for nr, rechnung in enumerate(rechnungen, 1):
+        try:
+            mails.append(tcsrechnung.erstelle_mail(rechnung, meta, f"{nr}.tex"))
+        except tcsrechnung.TCSRechnungError:
+            mails.append(None)
+    zeiten["mail"] = time.perf_counter() - start
+
+    # Same sinks as tcsrechnung.run(): one combined file, one file per invoice
+    # and the mail lists
+    start = time.perf_counter()
+    senken: list[tcsrechnung.Senke] = [
+        tcsrechnung.TexSenke(os.path.join(ausgabeordner, "rechnungen.tex")),
+        tcsrechnung.EinzelTexSenke(ausgabeordner),
+        tcsrechnung.MailSenke(ausgabeordner),
+    ]
+    with tcsrechnung.Senken(senken) as ausgabe:
+        for nr, (rechnung, text, mail) in enumerate(zip(rechnungen, texte, mails), 1):
+            ergebnis = tcsrechnung.Ergebnis(
+                nr, rechnung.name, rechnung.email, [], text, mail, 0.0
+            )
+            ausgabe.eintragen(
+                tcsrechnung.Datensatz(ergebnis, str(nr), text, True, None, None)
+            )
+    zeiten["ausgabe"] = time.perf_counter() - start
+    return zeiten
+
+
+def messe_groesse(xml: bytes, anzahl: int, wiederholungen: int) -> dict[str, float]:
+    # Best of several passes, in µs per invoice
+    beste = {phase: float("inf") for phase in PHASEN}
+    for _ in range(wiederholungen):
+        with tempfile.TemporaryDirectory() as ausgabeordner:
+            for phase, dauer in messe(xml, ausgabeordner).items():
+                beste[phase] = min(beste[phase], dauer)
+    ergebnis = {phase: dauer / anzahl * 1e6 for phase, dauer in beste.items()}
+    ergebnis["gesamt"] = sum(ergebnis.values())
+    return ergebnis
+
+
+def drucke(ergebnisse: dict[str, dict[str, float]]) -> None:
+    spalten = PHASEN + ["gesamt"]
+    print("Rechnungen " + "".join(f"{s:>10}" for s in spalten) + "   (µs pro Rechnung)")
+    for anzahl, werte in ergebnisse.items():
+        print(f"{anzahl:>10} " + "".join(f"{werte[s]:10.1f}" for s in spalten))
+
+    # Per-invoice cost should not grow with the number of invoices
+    groessen = list(ergebnisse)
+    if len(groessen) > 1:
+        faktor = ergebnisse[groessen[-1]]["gesamt"] / ergebnisse[groessen[0]]["gesamt"]
+        print(f"Skalierung {groessen[0]} -> {groessen[-1]}: {faktor:.2f}x pro Rechnung")
+
+
+def vergleiche(
+    ergebnisse: dict[str, dict[str, float]], basis: dict[str, dict[str, float]]
+) -> bool:
+    # Returns False if any phase got slower than TOLERANZ against the baseline
+    ok = True
+    for anzahl, werte in ergebnisse.items():
+        if anzahl not in basis:
+            continue
+        for phase, wert in werte.items():
+            alt = basis[anzahl].get(phase)
+            if not alt:
+                continue
+            aenderung = wert / alt - 1.0
+            markierung = ""
+            if aenderung > TOLERANZ:
+                markierung = "  <-- langsamer"
+                ok = False
+            print(
+                f"{anzahl:>10} {phase:>10}: {alt:10.1f} -> {wert:10.1f} µs"
+                f" ({aenderung:+.1%}){markierung}"
+            )
+    return ok
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        prog="benchmark", description="Laufzeitmessung für tcsrechnung"
+    )
+    parser.add_argument(
+        "eingabedatei",
+        nargs="?",
+        help=(
+            "Eingabedatei (xml Format), deren Rechnungen vervielfacht werden. Ohne"
+            " Angabe werden synthetische Daten erzeugt."
+        ),
+    )
+    parser.add_argument(
+        "-n",
+        "--anzahl",
+        type=int,
+        nargs="+",
+        default=STANDARD_ANZAHL,
+        help="Anzahl der Rechnungen, mehrere Werte möglich",
+    )
+    parser.add_argument(
+        "-r", "--wiederholungen", type=int, default=3, help="Anzahl der Messungen"
+    )
+    parser.add_argument(
+        "-k",
+        "--kinder",
+        type=testdaten.bereich,
+        help="Kinder pro Rechnung, Zahl oder Bereich wie 1-3",
+    )
+    parser.add_argument(
+        "-t",
+        "--trainings",
+        type=testdaten.bereich,
+        help="Trainings pro Kind, Zahl oder Bereich wie 1-2",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Startwert für Zufall")
+    parser.add_argument("--speichern", help="Schreibe Ergebnisse als JSON")
+    parser.add_argument(
+        "--vergleiche", help="Vergleiche mit Ergebnissen aus einer JSON Datei"
+    )
+    args = parser.parse_args()
+
+    if args.eingabedatei is not None:
+        for bereich in [args.kinder, args.trainings]:
+            if bereich is not None and bereich[0] != bereich[1]:
+                parser.error("Bereiche sind nur für synthetische Daten möglich")
+
+    ergebnisse: dict[str, dict[str, float]] = {}
+    for anzahl in args.anzahl:
+        if args.eingabedatei is not None:
+            xml = vervielfache(
+                args.eingabedatei,
+                anzahl,
+                args.kinder[0] if args.kinder is not None else None,
+                args.trainings[0] if args.trainings is not None else None,
+            )
+        else:
+            xml = ET.tostring(
+                testdaten.erzeuge_daten(
+                    anzahl,
+                    kinder=args.kinder or (1, 3),
+                    trainings=args.trainings or (1, 2),
+                    seed=args.seed,
+                )
+            )
+        ergebnisse[str(anzahl)] = messe_groesse(xml, anzahl, args.wiederholungen)
+    drucke(ergebnisse)
+
+    if args.speichern is not None:
+        with open(args.speichern, "w") as f:
+            json.dump(
+                {
+                    "datum": datetime.datetime.now().isoformat(timespec="seconds"),
+                    "python": platform.python_version(),
+                    "rechner": platform.node(),
+                    "eingabedatei": args.eingabedatei,
+                    "ergebnisse": ergebnisse,
+                },
+                f,
+                indent=1,
+            )
+
+    if args.vergleiche is not None:
+        with open(args.vergleiche) as f:
+            basis = json.load(f)["ergebnisse"]
+        if not vergleiche(ergebnisse, basis):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+
+##########################################################################
+# latexbenchmark.py - Laufzeitmessung für die LaTeX Übersetzung          #
+#                                                                        #
+# This program is free software: you can redistribute it and/or modify   #
+# it under the terms of the GNU General Public License as published by   #
+# the Free Software Foundation, either version 3 of the License, or      #
+# (at your option) any later version.                                    #
+#                                                                        #
+# This program is distributed in the hope that it will be useful,        #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of         #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the          #
+# GNU General Public License for more details.                           #
+#                                                                        #
+# You should have received a copy of the GNU General Public License      #
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.  #
+##########################################################################
+
+import sys
+import os
+import io
+import contextlib
+import datetime
+import glob
+import json
+import platform
+import re
+import subprocess
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+import argparse
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+)
+
+import tcsrechnung  # noqa: E402
+import tcscompile  # noqa: E402
+import testdaten  # noqa: E402
+
+STANDARD_TRAININGS = [1, 5, 10, 20, 40]
+# latexmk reports every engine run, also with -silent
+DURCHLAUF_RE = re.compile(r"Run number \d+ of rule '(?:pdf)?latex'")
+
+
+def pdftex_version() -> str:
+    try:
+        result = subprocess.run(
+            [tcscompile.PDFTEX, "--version"],
+            stdout=subprocess.PIPE,
+            text=True,
+            check=False,
+        )
+    except OSError:
+        return "unbekannt"
+    return result.stdout.split("\n", 1)[0]
+
+
+def erzeuge_tex(arbeitsordner: str, anzahl: int, trainings: int, seed: int) -> float:
+    # Writes the tex files for anzahl invoices with one child and the given
+    # number of trainings each, returns the duration of tcsrechnung
+    eingabe = os.path.join(arbeitsordner, "daten.xml")
+    root = testdaten.erzeuge_daten(
+        anzahl, kinder=(1, 1), trainings=(trainings, trainings), seed=seed
+    )
+    ET.ElementTree(root).write(eingabe, encoding="utf-8")
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        tcsrechnung.run(
+            [
+                "-o",
+                os.path.join(arbeitsordner, "tex"),
+                "-m",
+                os.path.join(arbeitsordner, "mails"),
+                eingabe,
+            ]
+        )
+    return time.perf_counter() - start
+
+
+def messe_datei(
+    texfile: str, builddir: str, fmt: tuple[str, str] | None
+) -> dict[str, float | int | str]:
+    name = os.path.splitext(os.path.basename(texfile))[0]
+    with open(texfile) as f:
+        posten = f.read().count("\\Posten{")
+
+    start = time.perf_counter()
+    result = tcscompile.kompiliere_datei(texfile, builddir, fmt)
+    dauer = time.perf_counter() - start
+    if result.returncode != 0:
+        log = "\n".join(result.stdout.splitlines()[-tcscompile.FEHLER_ZEILEN :])
+        raise tcsrechnung.TCSRechnungError(
+            f"{name} konnte nicht übersetzt werden:\n{log}"
+        )
+
+    # The last entry of the page manifest is the total number of pages
+    seiten = tcscompile.lese_seiten(os.path.join(builddir, name, name + ".seiten"))
+    anzahl_seiten = seiten[-1][2] if seiten else 0
+    return {
+        "name": name,
+        "posten": posten,
+        "sekunden": dauer,
+        "durchlaeufe": len(DURCHLAUF_RE.findall(result.stdout)),
+        "seiten": anzahl_seiten,
+    }
+
+
+def messe_stufe(
+    anzahl: int,
+    trainings: int,
+    fmt: tuple[str, str] | None,
+    gesamt: bool,
+    seed: int,
+) -> dict[str, object]:
+    with tempfile.TemporaryDirectory() as arbeitsordner:
+        tex_sekunden = erzeuge_tex(arbeitsordner, anzahl, trainings, seed)
+        texfiles = sorted(glob.glob(os.path.join(arbeitsordner, "tex", "*.tex")))
+        builddir = os.path.join(arbeitsordner, "tmp")
+
+        # Single invoices one after another, so the timings do not compete
+        einzeln = [
+            messe_datei(f, builddir, fmt)
+            for f in texfiles
+            if not os.path.basename(f).startswith("rechnungen_")
+        ]
+        stufe: dict[str, object] = {
+            "trainings": trainings,
+            "rechnungen": anzahl,
+            "tex_sekunden": tex_sekunden,
+            "einzeln": einzeln,
+        }
+        sekunden = sum(float(e["sekunden"]) for e in einzeln)
+        seiten = sum(int(e["seiten"]) for e in einzeln)
+        stufe["sekunden_pro_rechnung"] = sekunden / max(1, len(einzeln))
+        stufe["sekunden_pro_seite"] = sekunden / max(1, seiten)
+        stufe["durchlaeufe_pro_rechnung"] = sum(
+            int(e["durchlaeufe"]) for e in einzeln
+        ) / max(1, len(einzeln))
+
+        if gesamt:
+            gesamtdatei = [
+                f for f in texfiles if os.path.basename(f).startswith("rechnungen_")
+            ]
+            stufe["gesamt"] = messe_datei(gesamtdatei[0], builddir, fmt)
+    return stufe
+
+
+def drucke(stufen: list[dict[str, object]]) -> None:
+    print(
+        f"{'Trainings':>10}{'Posten':>8}{'Seiten':>8}{'Läufe':>8}"
+        f"{'s/Rechnung':>12}{'s/Seite':>10}{'Gesamt s':>10}"
+    )
+    for stufe in stufen:
+        einzeln = stufe["einzeln"]
+        assert isinstance(einzeln, list)
+        posten = sum(e["posten"] for e in einzeln) / max(1, len(einzeln))
+        seiten = sum(e["seiten"] for e in einzeln) / max(1, len(einzeln))
+        gesamt = stufe.get("gesamt")
+        gesamt_str = f"{gesamt['sekunden']:10.2f}" if isinstance(gesamt, dict) else ""
+        print(
+            f"{stufe['trainings']:>10}{posten:8.1f}{seiten:8.1f}"
+            f"{stufe['durchlaeufe_pro_rechnung']:8.1f}"
+            f"{stufe['sekunden_pro_rechnung']:12.2f}"
+            f"{stufe['sekunden_pro_seite']:10.2f}{gesamt_str}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        prog="latexbenchmark",
+        description="Laufzeitmessung für XML → tex → PDF mit wachsender Postenzahl",
+    )
+    parser.add_argument(
+        "-t",
+        "--trainings",
+        type=int,
+        nargs="+",
+        default=STANDARD_TRAININGS,
+        help="Trainings pro Rechnung, je Wert wird eine Stufe gemessen",
+    )
+    parser.add_argument(
+        "-n", "--anzahl", type=int, default=5, help="Anzahl der Rechnungen pro Stufe"
+    )
+    parser.add_argument(
+        "--noformat",
+        action="store_true",
+        help="Verwende kein vorkompiliertes Format für die Präambel",
+    )
+    parser.add_argument(
+        "--cache",
+        default=tcscompile.standard_cache(),
+        help="Ordner für vorkompilierte Formate",
+    )
+    parser.add_argument(
+        "--gesamt",
+        action="store_true",
+        help="Übersetze zusätzlich die Gesamtdatei jeder Stufe",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Startwert für Zufall")
+    parser.add_argument("-o", "--bericht", help="Schreibe Ergebnisse als JSON")
+    args = parser.parse_args()
+
+    fmt = None
+    format_sekunden = None
+    if not args.noformat:
+        start = time.perf_counter()
+        fmt = (os.path.abspath(args.cache), tcscompile.erstelle_format(args.cache))
+        format_sekunden = time.perf_counter() - start
+
+    stufen = [
+        messe_stufe(args.anzahl, trainings, fmt, args.gesamt, args.seed)
+        for trainings in args.trainings
+    ]
+    drucke(stufen)
+
+    if args.bericht is not None:
+        with open(args.bericht, "w") as f:
+            json.dump(
+                {
+                    "datum": datetime.datetime.now().isoformat(timespec="seconds"),
+                    "python": platform.python_version(),
+                    "rechner": platform.node(),
+                    "pdftex": pdftex_version(),
+                    "format": fmt[1] if fmt is not None else None,
+                    "format_sekunden": format_sekunden,
+                    "stufen": stufen,
+                },
+                f,
+                indent=1,
+            )
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except tcsrechnung.TCSRechnungError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+
+##########################################################################
+# testdaten.py - Erzeugt synthetische Eingabedateien für tcsrechnung.py  #
+#                                                                        #
+# This program is free software: you can redistribute it and/or modify   #
+# it under the terms of the GNU General Public License as published by   #
+# the Free Software Foundation, either version 3 of the License, or      #
+# (at your option) any later version.                                    #
+#                                                                        #
+# This program is distributed in the hope that it will be useful,        #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of         #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the          #
+# GNU General Public License for more details.                           #
+#                                                                        #
+# You should have received a copy of the GNU General Public License      #
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.  #
+##########################################################################
+
+import sys
+import os
+import random
+import xml.etree.ElementTree as ET
+import argparse
+
+# Hourly rates per duration, index i is the rate for i+1 participants
+STDKOSTEN = {60: [48, 52, 54, 56, 60], 40: [36, 40, 42, 48]}
+WOCHENTAGE = ["Montag", "Dienstag", "Mittwoch", "Donnerstag", "Freitag", "Samstag"]
+NACHNAMEN = [
+    "Berger",
+    "Schmid",
+    "Wagner",
+    "Keller",
+    "Hofmann",
+    "Fischer",
+    "Weber",
+    "Maier",
+    "Schäfer",
+    "Koch",
+]
+VORNAMEN = ["Leon", "Emma", "Paul", "Mia", "Jonas", "Lena", "Felix", "Sophie"]
+ANREDEN = ["Familie", "Familie", "Frau", "Herr"]
+
+
+def bereich(text: str) -> tuple[int, int]:
+    # "3" or "1-3"
+    teile = text.split("-", 1)
+    try:
+        von, bis = int(teile[0]), int(teile[-1])
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Ungültiger Bereich: {text}")
+    if von < 0 or von > bis:
+        raise argparse.ArgumentTypeError(f"Ungültiger Bereich: {text}")
+    return von, bis
+
+
+def _kopfdaten(root: ET.Element, jahr: int) -> None:
+    ET.SubElement(root, "von").text = "Oktober"
+    ET.SubElement(root, "bis").text = "Dezember"
+    ET.SubElement(root, "jahr").text = str(jahr)
+    for dauer, preise in STDKOSTEN.items():
+        block = ET.SubElement(root, f"stdkosten{dauer}")
+        for teilnehmerzahl, preis in enumerate(preise, 1):
+            ET.SubElement(block, f"p{teilnehmerzahl}").text = str(preis)
+    ET.SubElement(root, "beginn_halle").text = f"01-10-{jahr}"
+    ET.SubElement(root, "hallenkosten").text = "14"
+    ET.SubElement(root, "rechnungsnummer").text = "0"
+
+
+def _training(
+    kind: ET.Element,
+    rng: random.Random,
+    foerderanteil: float,
+    foerderbetraege: int,
+    hallenanteil: float,
+) -> None:
+    training = ET.SubElement(kind, "training")
+    dauer = rng.choice(list(STDKOSTEN))
+    teilnehmerzahl = rng.randint(1, len(STDKOSTEN[dauer]))
+    stdlohn = STDKOSTEN[dauer][teilnehmerzahl - 1]
+
+    ET.SubElement(training, "tag").text = rng.choice(WOCHENTAGE)
+    if rng.random() < foerderanteil:
+        ET.SubElement(training, "foerderung").text = "ja"
+        # Multiples of the hourly rate, otherwise the funding is rejected
+        for _ in range(rng.randint(1, foerderbetraege)):
+            betrag = stdlohn * rng.randint(1, 4)
+            ET.SubElement(training, "foerderbetrag_gruppe").text = str(betrag)
+        foerderkinder = rng.randint(1, teilnehmerzahl)
+        ET.SubElement(training, "foerderkinder").text = str(foerderkinder)
+    else:
+        ET.SubElement(training, "foerderung").text = "nein"
+    ET.SubElement(training, "teilnehmerzahl").text = str(teilnehmerzahl)
+    ET.SubElement(training, "dauer").text = str(dauer)
+    if rng.random() < hallenanteil:
+        ET.SubElement(training, "halleneinheiten").text = str(rng.randint(1, 13))
+
+
+def erzeuge_daten(
+    anzahl: int,
+    kinder: tuple[int, int] = (1, 3),
+    trainings: tuple[int, int] = (1, 2),
+    foerderanteil: float = 0.5,
+    foerderbetraege: int = 3,
+    hallenanteil: float = 0.1,
+    mailanteil: float = 0.9,
+    jahr: int = 2024,
+    seed: int = 0,
+) -> ET.Element:
+    rng = random.Random(seed)
+    root = ET.Element("data")
+    _kopfdaten(root, jahr)
+    for i in range(anzahl):
+        nachname = rng.choice(NACHNAMEN)
+        rechnung = ET.SubElement(root, "rechnung")
+        ET.SubElement(rechnung, "name").text = (
+            f"{rng.choice(ANREDEN)} {nachname} {i + 1}"
+        )
+        ET.SubElement(rechnung, "strasse").text = f"Teststraße {i % 200 + 1}"
+        ET.SubElement(rechnung, "ort").text = "70771 Leinfelden-Echterdingen"
+        if rng.random() < mailanteil:
+            ET.SubElement(rechnung, "email").text = (
+                f"{nachname.lower()}.{i + 1}@example.com"
+            )
+        for _ in range(rng.randint(*kinder)):
+            kind = ET.SubElement(rechnung, "kind")
+            ET.SubElement(kind, "name").text = rng.choice(VORNAMEN)
+            for _ in range(rng.randint(*trainings)):
+                _training(kind, rng, foerderanteil, foerderbetraege, hallenanteil)
+    return root
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        prog="testdaten", description="Erzeuge synthetische Eingabedatei"
+    )
+    parser.add_argument("ausgabedatei", help="Ausgabedatei (xml Format)")
+    parser.add_argument(
+        "-n", "--anzahl", type=int, default=1000, help="Anzahl der Rechnungen"
+    )
+    parser.add_argument(
+        "-k",
+        "--kinder",
+        type=bereich,
+        default=(1, 3),
+        help="Kinder pro Rechnung, Zahl oder Bereich wie 1-3",
+    )
+    parser.add_argument(
+        "-t",
+        "--trainings",
+        type=bereich,
+        default=(1, 2),
+        help="Trainings pro Kind, Zahl oder Bereich wie 1-2",
+    )
+    parser.add_argument(
+        "--foerderung",
+        type=float,
+        default=0.5,
+        help="Anteil der Trainings mit <foerderung>=ja",
+    )
+    parser.add_argument(
+        "--foerderbetraege",
+        type=int,
+        default=3,
+        help="Maximale Anzahl <foerderbetrag_gruppe> pro Training",
+    )
+    parser.add_argument(
+        "--halleneinheiten",
+        type=float,
+        default=0.1,
+        help="Anteil der Trainings mit <halleneinheiten>",
+    )
+    parser.add_argument(
+        "--email", type=float, default=0.9, help="Anteil der Rechnungen mit <email>"
+    )
+    parser.add_argument("--jahr", type=int, default=2024, help="Abrechnungsjahr")
+    parser.add_argument("--seed", type=int, default=0, help="Startwert für Zufall")
+    args = parser.parse_args()
+
+    if os.path.exists(args.ausgabedatei):
+        print(f"Ausgabedatei existiert bereits: {args.ausgabedatei}", file=sys.stderr)
+        sys.exit(1)
+
+    root = erzeuge_daten(
+        args.anzahl,
+        args.kinder,
+        args.trainings,
+        args.foerderung,
+        args.foerderbetraege,
+        args.halleneinheiten,
+        args.email,
+        args.jahr,
+        args.seed,
+    )
+    tree = ET.ElementTree(root)
+    ET.indent(tree, space="  ")
+    with open(args.ausgabedatei, "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0"?>\n')
+        tree.write(f, encoding="unicode", xml_declaration=False)
+
+
+if __name__ == "__main__":
+    main()
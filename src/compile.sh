@@ -26,11 +26,6 @@ rm -rf "$texdir" "$pdfdir" "$builddir" "$maildir"
 
 tcsrechnung -o "$texdir" -m "$maildir" "$xmlfile" "$@"
 
-for i in "$texdir"/*.tex; do
-  latexmk -silent -interaction=nonstopmode -pdf -outdir="$builddir" "$i"
-done
-
-mkdir "$pdfdir"
-mv "$builddir"/*.pdf "$pdfdir"
+tcscompile -p "$pdfdir" -b "$builddir" "$texdir"
 
 rm -r "$texdir" "$builddir"
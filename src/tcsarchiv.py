@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+
+##########################################################################
+# tcsarchiv.py - Suche und Nachdruck im Archiv der TCS Rechnungen        #
+#                                                                        #
+# This program is free software: you can redistribute it and/or modify   #
+# it under the terms of the GNU General Public License as published by   #
+# the Free Software Foundation, either version 3 of the License, or      #
+# (at your option) any later version.                                    #
+#                                                                        #
+# This program is distributed in the hope that it will be useful,        #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of         #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the          #
+# GNU General Public License for more details.                           #
+#                                                                        #
+# You should have received a copy of the GNU General Public License      #
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.  #
+##########################################################################
+
+import sys
+import os
+import sqlite3
+import argparse
+
+from tcsrechnung import (
+    DOKUMENT_ANFANG,
+    DOKUMENT_ENDE,
+    TCSRechnungError,
+    _format_betrag,
+)
+
+# Search criteria and the condition on table rechnungen for each of them, every
+# condition is answered by an index
+BEDINGUNGEN = {
+    "nummer": "nummer = ?",
+    "name": "name = ?",
+    "email": "email = ?",
+    "kind": "id IN (SELECT rechnung FROM kinder WHERE name = ?)",
+    "jahr": "jahr = ?",
+    "zeitraum": "zeitraum = ?",
+}
+
+
+def oeffne(datei: str) -> sqlite3.Connection:
+    if not os.path.exists(datei):
+        raise TCSRechnungError(f"Archiv {datei} existiert nicht")
+    verbindung = sqlite3.connect(f"file:{datei}?mode=ro", uri=True)
+    verbindung.row_factory = sqlite3.Row
+    return verbindung
+
+
+def suche(
+    verbindung: sqlite3.Connection, alle: bool = False, **kriterien: object
+) -> list[sqlite3.Row]:
+    # Invoices matching all given criteria, names and emails ignore case.  With
+    # alle also the versions superseded by a later run of the same period.
+    bedingungen = [] if alle else ["aktuell = 1"]
+    werte = []
+    for kriterium, wert in kriterien.items():
+        if wert is None:
+            continue
+        bedingungen.append(BEDINGUNGEN[kriterium])
+        werte.append(wert)
+    abfrage = (
+        "SELECT id, zeitraum, nummer, revision, aktuell, name, email, netto_cent,"
+        " mwst_voll_cent, mwst_erm_cent, brutto_cent FROM rechnungen"
+    )
+    if bedingungen:
+        abfrage += " WHERE " + " AND ".join(bedingungen)
+    return verbindung.execute(
+        abfrage + " ORDER BY zeitraum, nummer, revision", werte
+    ).fetchall()
+
+
+def posten(verbindung: sqlite3.Connection, rechnung: int) -> list[sqlite3.Row]:
+    return verbindung.execute(
+        "SELECT * FROM posten WHERE rechnung = ? ORDER BY position", (rechnung,)
+    ).fetchall()
+
+
+def lade_tex(
+    verbindung: sqlite3.Connection,
+    nummer: str,
+    zeitraum: str | None = None,
+    revision: int | None = None,
+) -> str:
+    # Complete tex file of an archived invoice for a reprint, the current version
+    # unless a revision is given
+    abfrage = "SELECT zeitraum, tex FROM rechnungen WHERE nummer = ?"
+    werte: list[object] = [nummer]
+    if zeitraum is not None:
+        abfrage += " AND zeitraum = ?"
+        werte.append(zeitraum)
+    if revision is None:
+        abfrage += " AND aktuell = 1"
+    else:
+        abfrage += " AND revision = ?"
+        werte.append(revision)
+    treffer = verbindung.execute(abfrage + " ORDER BY zeitraum", werte).fetchall()
+    if not treffer:
+        raise TCSRechnungError(f"Rechnung {nummer} nicht im Archiv")
+    if len(treffer) > 1:
+        raise TCSRechnungError(
+            f"Rechnung {nummer} in mehreren Zeiträumen ("
+            + ", ".join(zeile["zeitraum"] for zeile in treffer)
+            + "), Zeitraum mit --zeitraum angeben"
+        )
+    tex: str = treffer[0]["tex"]
+    return DOKUMENT_ANFANG + tex + DOKUMENT_ENDE
+
+
+def drucke(
+    verbindung: sqlite3.Connection, treffer: list[sqlite3.Row], mit_posten: bool
+) -> None:
+    print("Zeitraum;Nummer;Revision;Name;Email;Netto;MwSt 19%;MwSt 7%;Brutto")
+    for zeile in treffer:
+        # Superseded versions are marked with a * after the revision
+        revision = str(zeile["revision"]) + ("" if zeile["aktuell"] else "*")
+        print(
+            ";".join(
+                [zeile["zeitraum"], zeile["nummer"], revision, zeile["name"]]
+                + [zeile["email"] or ""]
+                + [
+                    _format_betrag(zeile[spalte])
+                    for spalte in [
+                        "netto_cent",
+                        "mwst_voll_cent",
+                        "mwst_erm_cent",
+                        "brutto_cent",
+                    ]
+                ]
+            )
+        )
+        if mit_posten:
+            for p in posten(verbindung, zeile["id"]):
+                print(
+                    f"  {p['kostentyp']}: {p['tag']}, {p['einheiten']} x"
+                    f" {p['dauer']} Minuten, Gruppe {p['teilnehmerzahl']},"
+                    f" {_format_betrag(p['gesamt_cent'])}"
+                )
+    brutto = sum(zeile["brutto_cent"] for zeile in treffer)
+    print(f"{len(treffer)} Rechnungen, Summe brutto {_format_betrag(brutto)}")
+
+
+def run(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="tcsarchiv",
+        description=(
+            "Suche und Nachdruck archivierter Rechnungen aus tcsrechnung --archiv"
+        ),
+    )
+    parser.add_argument("archiv", help="Archiv (SQLite Datei)")
+    befehle = parser.add_subparsers(dest="befehl", required=True)
+
+    suche_parser = befehle.add_parser("suche", help="Rechnungen mit Summen auflisten")
+    suche_parser.add_argument("--nummer", help="Rechnungsnummer, z.B. 24_0003")
+    suche_parser.add_argument("--name", help="Name des Empfängers")
+    suche_parser.add_argument("--email", help="Email des Empfängers")
+    suche_parser.add_argument("--kind", help="Name eines Kindes")
+    suche_parser.add_argument("--jahr", type=int, help="Abrechnungsjahr <jahr>")
+    suche_parser.add_argument("--zeitraum", help="Zeitraum, z.B. 2024_10-12")
+    suche_parser.add_argument(
+        "--posten", action="store_true", help="Gib auch die Posten aus"
+    )
+    suche_parser.add_argument(
+        "--alle",
+        action="store_true",
+        help="Zeige auch durch einen späteren Lauf ersetzte Versionen",
+    )
+
+    tex_parser = befehle.add_parser("tex", help="tex Datei einer Rechnung ausgeben")
+    tex_parser.add_argument("nummer", help="Rechnungsnummer, z.B. 24_0003")
+    tex_parser.add_argument("--zeitraum", help="Zeitraum, z.B. 2024_10-12")
+    tex_parser.add_argument(
+        "--revision", type=int, help="Ersetzte Version statt der aktuellen"
+    )
+    tex_parser.add_argument("-o", "--output", help="Ausgabedatei statt stdout")
+    args = parser.parse_args(argv)
+
+    verbindung = oeffne(args.archiv)
+    try:
+        if args.befehl == "suche":
+            treffer = suche(
+                verbindung,
+                nummer=args.nummer,
+                name=args.name,
+                email=args.email,
+                kind=args.kind,
+                jahr=args.jahr,
+                zeitraum=args.zeitraum,
+                alle=args.alle,
+            )
+            drucke(verbindung, treffer, args.posten)
+            return
+        tex = lade_tex(verbindung, args.nummer, args.zeitraum, args.revision)
+        if args.output is None:
+            sys.stdout.write(tex)
+        else:
+            with open(args.output, "w") as f:
+                f.write(tex)
+    finally:
+        verbindung.close()
+
+
+if __name__ == "__main__":
+    try:
+        run()
+    except TCSRechnungError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+
+##########################################################################
+# tcscompile.py - Parallele PDF Erzeugung der TCS Rechnungen             #
+#                                                                        #
+# This program is free software: you can redistribute it and/or modify   #
+# it under the terms of the GNU General Public License as published by   #
+# the Free Software Foundation, either version 3 of the License, or      #
+# (at your option) any later version.                                    #
+#                                                                        #
+# This program is distributed in the hope that it will be useful,        #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of         #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the          #
+# GNU General Public License for more details.                           #
+#                                                                        #
+# You should have received a copy of the GNU General Public License      #
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.  #
+##########################################################################
+
+import sys
+import os
+import glob
+import hashlib
+import shutil
+import subprocess
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from tcsrechnung import TCSRechnungError
+
+LATEXMK = ["latexmk", "-silent", "-interaction=nonstopmode", "-pdf"]
+PDFTEX = "pdftex"
+KPSEWHICH = "kpsewhich"
+QPDF = "qpdf"
+
+# Files read by the preamble of every invoice.  They are dumped into a precompiled
+# format once, which is reused as long as none of them changes.
+FORMAT_DATEIEN = ["tcsrechnung.cls", "personal-config.tex"]
+
+# Number of log lines shown for a failed invoice
+FEHLER_ZEILEN = 20
+
+
+def anzahl_prozessoren() -> int:
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def standard_cache() -> str:
+    cache = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(cache, "tcsrechnung")
+
+
+def finde_texdatei(name: str) -> str:
+    try:
+        result = subprocess.run(
+            [KPSEWHICH, name], stdout=subprocess.PIPE, text=True, check=False
+        )
+    except OSError as e:
+        raise TCSRechnungError(f"{KPSEWHICH} konnte nicht ausgeführt werden: {e}")
+    pfad = result.stdout.strip()
+    if result.returncode != 0 or not pfad:
+        raise TCSRechnungError(f"{name} wurde von LaTeX nicht gefunden")
+    return pfad
+
+
+def format_hash() -> str:
+    h = hashlib.sha256()
+    # A format can only be loaded by the engine version that dumped it
+    try:
+        version = subprocess.run(
+            [PDFTEX, "--version"], stdout=subprocess.PIPE, text=True, check=False
+        )
+    except OSError as e:
+        raise TCSRechnungError(f"{PDFTEX} konnte nicht ausgeführt werden: {e}")
+    h.update(version.stdout.split("\n", 1)[0].encode())
+    for name in FORMAT_DATEIEN:
+        with open(finde_texdatei(name), "rb") as f:
+            h.update(name.encode() + b"\0" + f.read())
+    return h.hexdigest()[:16]
+
+
+def erstelle_format(cachedir: str) -> str:
+    name = "tcsrechnung-" + format_hash()
+    if os.path.exists(os.path.join(cachedir, name + ".fmt")):
+        return name
+
+    os.makedirs(cachedir, exist_ok=True)
+    # Dump under a temporary name so concurrent runs never see a partial format
+    jobname = f"{name}-{os.getpid()}"
+    praeambel = os.path.join(cachedir, jobname + ".tex")
+    with open(praeambel, "w") as f:
+        f.write("\\documentclass{tcsrechnung}\n")
+        f.write("\\begin{document}\n")
+        f.write("\\end{document}\n")
+    result = subprocess.run(
+        [
+            PDFTEX,
+            "-ini",
+            "-interaction=nonstopmode",
+            "-jobname=" + jobname,
+            "-output-directory=" + cachedir,
+            "&pdflatex",
+            "mylatexformat.ltx",
+            praeambel,
+        ],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+    )
+    fmtfile = os.path.join(cachedir, jobname + ".fmt")
+    if result.returncode != 0 or not os.path.exists(fmtfile):
+        log = "\n".join(result.stdout.splitlines()[-FEHLER_ZEILEN:])
+        raise TCSRechnungError(f"Format konnte nicht erstellt werden:\n{log}")
+    os.replace(fmtfile, os.path.join(cachedir, name + ".fmt"))
+    for endung in [".tex", ".log"]:
+        if os.path.exists(os.path.join(cachedir, jobname + endung)):
+            os.remove(os.path.join(cachedir, jobname + endung))
+    return name
+
+
+def kompiliere_datei(
+    texfile: str, builddir: str, fmt: tuple[str, str] | None = None
+) -> subprocess.CompletedProcess[str]:
+    # Every job gets its own build directory so auxiliary files do not collide
+    name = os.path.splitext(os.path.basename(texfile))[0]
+    outdir = os.path.join(builddir, name)
+    os.makedirs(outdir, exist_ok=True)
+    cmd = LATEXMK + ["-outdir=" + outdir]
+    env = None
+    if fmt is not None:
+        cachedir, fmtname = fmt
+        cmd.append(f"-pdflatex=pdflatex -fmt={fmtname} %O %S")
+        env = dict(os.environ)
+        env["TEXFORMATS"] = cachedir + os.pathsep + env.get("TEXFORMATS", "")
+    return subprocess.run(
+        cmd + [texfile],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        env=env,
+    )
+
+
+def kompiliere(
+    texfiles: list[str],
+    pdfdir: str,
+    builddir: str,
+    jobs: int,
+    fmt: tuple[str, str] | None = None,
+) -> dict[str, str]:
+    os.makedirs(pdfdir, exist_ok=True)
+    fehler: dict[str, str] = {}
+
+    # Start with the largest files (e.g. the combined invoice file) so they do
+    # not end up as the last job on an otherwise idle pool
+    texfiles = sorted(texfiles, key=os.path.getsize, reverse=True)
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        futures = {pool.submit(kompiliere_datei, f, builddir, fmt): f for f in texfiles}
+        for fertig, future in enumerate(as_completed(futures), 1):
+            texfile = futures[future]
+            name = os.path.splitext(os.path.basename(texfile))[0]
+            pdffile = os.path.join(builddir, name, name + ".pdf")
+            try:
+                result = future.result()
+            except OSError as e:
+                fehler[name] = str(e)
+                continue
+            if result.returncode != 0 or not os.path.exists(pdffile):
+                log = result.stdout.splitlines()[-FEHLER_ZEILEN:]
+                fehler[name] = "\n".join(log)
+            else:
+                shutil.move(pdffile, os.path.join(pdfdir, name + ".pdf"))
+            print(f"[{fertig}/{len(texfiles)}] {name}", file=sys.stderr)
+    return fehler
+
+
+def veraltet(texfiles: list[str], pdfdir: str) -> list[str]:
+    # Invoices whose PDF is missing or older than the tex file
+    ergebnis = []
+    for texfile in texfiles:
+        name = os.path.splitext(os.path.basename(texfile))[0]
+        pdffile = os.path.join(pdfdir, name + ".pdf")
+        if not os.path.exists(pdffile):
+            ergebnis.append(texfile)
+        elif os.path.getmtime(pdffile) < os.path.getmtime(texfile):
+            ergebnis.append(texfile)
+    return ergebnis
+
+
+def lese_seiten(seitenfile: str) -> list[tuple[str, int, int]]:
+    # Every line of the manifest written by tcsrechnung.cls holds the invoice
+    # number and the last page of the letter.  Letters always start on a new
+    # page, so the first page follows from the previous entry.
+    seiten: list[tuple[str, int, int]] = []
+    erste = 1
+    with open(seitenfile) as f:
+        for zeile in f:
+            if not zeile.strip():
+                continue
+            rechnungsnr, _, letzte_str = zeile.strip().rpartition(";")
+            try:
+                letzte = int(letzte_str)
+            except ValueError:
+                raise TCSRechnungError(f"Ungültige Zeile in {seitenfile}: {zeile}")
+            if letzte < erste:
+                raise TCSRechnungError(
+                    f"Rechnung {rechnungsnr} in {seitenfile} hat keine Seiten"
+                )
+            seiten.append((rechnungsnr.replace("/", "_"), erste, letzte))
+            erste = letzte + 1
+    return seiten
+
+
+def teile_pdf(
+    pdffile: str, seiten: list[tuple[str, int, int]], pdfdir: str, jobs: int
+) -> dict[str, str]:
+    fehler: dict[str, str] = {}
+
+    def teile(name: str, erste: int, letzte: int) -> subprocess.CompletedProcess[str]:
+        return subprocess.run(
+            [
+                QPDF,
+                "--empty",
+                "--pages",
+                pdffile,
+                f"{erste}-{letzte}",
+                "--",
+                os.path.join(pdfdir, name + ".pdf"),
+            ],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+        )
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        futures = {pool.submit(teile, *s): s[0] for s in seiten}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                result = future.result()
+            except OSError as e:
+                fehler[name] = str(e)
+                continue
+            if result.returncode != 0:
+                fehler[name] = result.stdout.strip()
+    return fehler
+
+
+def kompiliere_und_teile(
+    texfiles: list[str],
+    pdfdir: str,
+    builddir: str,
+    jobs: int,
+    fmt: tuple[str, str] | None = None,
+) -> dict[str, str]:
+    # Only the combined files are compiled, the single invoices are cut from them
+    gesamt = [f for f in texfiles if os.path.basename(f).startswith("rechnungen_")]
+    if not gesamt:
+        raise TCSRechnungError("Keine Gesamtdatei rechnungen_*.tex gefunden")
+
+    fehler = kompiliere(gesamt, pdfdir, builddir, jobs, fmt)
+    for texfile in gesamt:
+        name = os.path.splitext(os.path.basename(texfile))[0]
+        if name in fehler:
+            continue
+        seiten = lese_seiten(os.path.join(builddir, name, name + ".seiten"))
+        fehler.update(
+            teile_pdf(os.path.join(pdfdir, name + ".pdf"), seiten, pdfdir, jobs)
+        )
+    return fehler
+
+
+def run(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="tcscompile", description="Erstelle PDF Dateien aus TCS Rechnungen"
+    )
+    parser.add_argument("texdir", help="Ordner mit Rechnungen im tex Format")
+    parser.add_argument(
+        "-p", "--pdf", default="pdf", help="Ausgabeordner für PDF Dateien"
+    )
+    parser.add_argument(
+        "-b", "--build", default="tmp", help="Ordner für temporäre LaTeX Dateien"
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=anzahl_prozessoren(),
+        help="Anzahl paralleler LaTeX Läufe (Standard: Anzahl der Prozessoren)",
+    )
+    parser.add_argument(
+        "--noformat",
+        action="store_true",
+        help="Verwende kein vorkompiliertes Format für die Präambel",
+    )
+    parser.add_argument(
+        "--cache",
+        default=standard_cache(),
+        help="Ordner für vorkompilierte Formate",
+    )
+    parser.add_argument(
+        "--split",
+        action="store_true",
+        help="Übersetze nur die Gesamtdatei und teile sie in einzelne Rechnungen auf",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Übersetze nur Rechnungen, deren PDF fehlt oder älter ist",
+    )
+    args = parser.parse_args(argv)
+
+    texfiles = glob.glob(os.path.join(args.texdir, "*.tex"))
+    if not texfiles:
+        raise TCSRechnungError(f"Keine tex Dateien in {args.texdir} gefunden")
+    if args.incremental:
+        texfiles = veraltet(texfiles, args.pdf)
+        if not texfiles:
+            return
+
+    fmt = None
+    if not args.noformat:
+        fmt = (os.path.abspath(args.cache), erstelle_format(args.cache))
+
+    if args.split:
+        fehler = kompiliere_und_teile(texfiles, args.pdf, args.build, args.jobs, fmt)
+    else:
+        fehler = kompiliere(texfiles, args.pdf, args.build, args.jobs, fmt)
+    if fehler:
+        for name, log in sorted(fehler.items()):
+            print(f"Fehler beim Erstellen von {name}.pdf:\n{log}\n", file=sys.stderr)
+        raise TCSRechnungError(
+            f"{len(fehler)} von {len(texfiles)} Rechnungen konnten nicht erstellt"
+            " werden"
+        )
+
+
+if __name__ == "__main__":
+    try:
+        run()
+    except TCSRechnungError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
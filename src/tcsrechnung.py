@@ -22,10 +22,57 @@ import os
 import xml.etree.ElementTree as ET
 import datetime
 import calendar
+import abc
 import argparse
+import collections
+import contextlib
+import cProfile
+import fcntl
+import filecmp
+import functools
+import glob
+import hashlib
+import heapq
+import itertools
+import json
+import queue
+import re
+import shutil
+import sqlite3
+import threading
+import time
+import tracemalloc
+import xml.sax.saxutils
+from collections.abc import Callable, Iterable, Iterator, Sequence
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import TYPE_CHECKING, NamedTuple, TextIO
+
+if TYPE_CHECKING:
+    import numpy as np
+else:
+    try:
+        import numpy as np
+    except ImportError:  # only needed for --vektor
+        np = None
+
+# All amounts are integer cents, VAT rates are whole percent
+MWST_VOLL_PROZENT = 19
+MWST_ERM_PROZENT = 7
+
+# Number of invoices sent to a worker process at once with --jobs
+PAKETGROESSE = 32
+
+# Number of slowest invoices listed by --timings
+LANGSAMSTE = 10
 
-MWST_VOLL = 0.19
-MWST_ERM = 0.07
+# Number of rendered line items kept for identical trainings
+POSTEN_CACHE_GROESSE = 4096
+
+# Direct debits per pain.008 file of --sepa
+SEPA_BUCHUNGEN = 1000
+
+# Packets of PAKETGROESSE invoices queued for each sink with --threads
+SENKEN_PUFFER = 4
 
 
 class TCSRechnungError(Exception):
@@ -92,40 +139,185 @@ def _get_int(parent: ET.Element, field_name: str) -> int:
         )
 
 
+def _runde(zaehler: int, nenner: int) -> int:
+    # The only rounding point for money: zaehler / nenner to whole cents with
+    # halves rounded away from zero
+    if zaehler >= 0:
+        return (2 * zaehler + nenner) // (2 * nenner)
+    return -((nenner - 2 * zaehler) // (2 * nenner))
+
+
+def _netto_cent(brutto_cent: int, prozent: int, nenner: int = 1) -> int:
+    # Net cents of brutto_cent / nenner including prozent VAT
+    return _runde(brutto_cent * 100, (100 + prozent) * nenner)
+
+
+CENT_STR = [",%02d" % cent for cent in range(100)]
+
+
+def _format_betrag(cent: int) -> str:
+    if cent < 0:
+        return "-" + _format_betrag(-cent)
+    return str(cent // 100) + CENT_STR[cent % 100]
+
+
+# One template per LaTeX macro of tcsrechnung.cls and per output line
+DOKUMENT_ANFANG = "\\documentclass{tcsrechnung}\n\\begin{document}\n"
+DOKUMENT_ENDE = "\\end{document}\n"
+EMPFAENGER = "\\Empfaenger{%s}{%s}{%s}\n"
+REFERENZ = "\\Referenz{%d/%04d}{%s}{%s %d}{%s}\n"
+KOSTENTYP = "\\Kostentyp{%s}\n"
+POSTEN = "\\Posten{%s}{%d}{%s}{%d}{%d}{%s}{%s}{%s}\n"
+SUMME_WINTER = "\\SummeWinter{%s}{%s}{%s}{%s}\n"
+SUMME_SOMMER = "\\SummeSommer{%s}{%s}{%s}\n"
+SCHLUSS = "\\Schluss{%s}{%s %d}{%d}\n\n"
+MAILZEILE = "%s;%s;%s;%s;%s;%d;%s\n"
+
+
+# Price of one training session for a given duration and group size, brutto in
+# euro as given in the input and the net price per hour in cents
+class Tarif(NamedTuple):
+    brutto: int
+    netto_std_cent: int
+    netto_std_str: str
+
+
+STDKOSTEN_RE = re.compile(r"stdkosten(\d+)")
+TEILNEHMER_RE = re.compile(r"p(\d+)")
+
+
+def _feld_text(felder: dict[str, str | None], field_name: str, block: str) -> str:
+    if field_name not in felder:
+        raise TCSRechnungError(f"Element <{field_name}> in Block <{block}> fehlt")
+    text = felder[field_name]
+    if text is None:
+        raise TCSRechnungError(
+            f"Element <{field_name}> in Block <{block}> fehlt oder ist leer"
+        )
+    return text
+
+
+def _feld_int(felder: dict[str, str | None], field_name: str, block: str) -> int:
+    text = _feld_text(felder, field_name, block)
+    try:
+        return int(text)
+    except ValueError:
+        raise TCSRechnungError(
+            f"Element <{field_name}>='{text}' in Block <{block}> ist keine gültige Zahl"
+        )
+
+
+def _feld_datum(
+    felder: dict[str, str | None], field_name: str, block: str
+) -> datetime.date:
+    text = _feld_text(felder, field_name, block)
+    try:
+        return datetime.datetime.strptime(text, "%d-%m-%Y").date()
+    except ValueError:
+        raise TCSRechnungError(
+            f"<{field_name}>='{text}' in Block <{block}> hat ungültiges Format"
+            " (erwartet: DD-MM-YYYY)"
+        )
+
+
+IBAN_RE = re.compile(r"[A-Z]{2}[0-9]{2}[A-Z0-9]{11,30}")
+BIC_RE = re.compile(r"[A-Z]{6}[A-Z0-9]{2}(?:[A-Z0-9]{3})?")
+GLAEUBIGER_ID_RE = re.compile(r"[A-Z]{2}[0-9]{2}[A-Z0-9]{3}[A-Z0-9]{1,28}")
+# Characters allowed in SEPA references
+MANDATSREFERENZ_RE = re.compile(r"[A-Za-z0-9+?/:().,' -]{1,35}")
+
+
+def _mod97(zeichen: str) -> bool:
+    # ISO 7064 MOD 97-10 check of IBAN and creditor identifier, letters count as
+    # 10 to 35
+    return int("".join(str(int(z, 36)) for z in zeichen)) % 97 == 1
+
+
+def _feld_iban(felder: dict[str, str | None], field_name: str, block: str) -> str:
+    iban = _feld_text(felder, field_name, block).replace(" ", "").upper()
+    if IBAN_RE.fullmatch(iban) is None or not _mod97(iban[4:] + iban[:4]):
+        raise TCSRechnungError(
+            f"<{field_name}>='{felder[field_name]}' in Block <{block}> ist keine"
+            " gültige IBAN"
+        )
+    return iban
+
+
+def _feld_bic(felder: dict[str, str | None], block: str) -> str | None:
+    # Optional, within SEPA the IBAN is sufficient
+    if felder.get("bic") is None:
+        return None
+    bic = _feld_text(felder, "bic", block).replace(" ", "").upper()
+    if BIC_RE.fullmatch(bic) is None:
+        raise TCSRechnungError(
+            f"<bic>='{felder['bic']}' in Block <{block}> ist keine gültige BIC"
+        )
+    return bic
+
+
 class Metadaten:
     def __init__(self, root: ET.Element) -> None:
         self.jahr = _get_int(root, "jahr")
         self.jahr_cur = datetime.date.today().year
         self.von_monat = _get_text(root, "von")
         self.bis_monat = _get_text(root, "bis")
+        for name, monat in [("von", self.von_monat), ("bis", self.bis_monat)]:
+            if monat not in MONATE_DIC:
+                raise TCSRechnungError(f"Ungültiger Monat <{name}>={monat}")
 
-        self.stdlohn60 = []
-        for p in ["p1", "p2", "p3", "p4", "p5"]:
-            elem_stdkosten = _get_elem(root, "stdkosten60")
-            self.stdlohn60.append(_get_int(elem_stdkosten, p))
-
-        self.stdlohn40 = []
-        for p in ["p1", "p2", "p3", "p4"]:
-            elem_stdkosten = _get_elem(root, "stdkosten40")
-            self.stdlohn40.append(_get_int(elem_stdkosten, p))
-
-        self.stdlohn60n = [i / (1.0 + MWST_VOLL) for i in self.stdlohn60]
-        self.stdlohn40n = [i / (1.0 + MWST_VOLL) for i in self.stdlohn40]
+        self.tarife: dict[tuple[int, int], Tarif] = {}
+        self._init_tarife(root)
 
         self.stdhalle = _get_int(root, "hallenkosten")
-        self.stdhalle_netto = self.stdhalle / (1.0 + MWST_ERM)
+        self.stdhalle_cent = self.stdhalle * 100
+        self.stdhalle_netto_cent = _netto_cent(self.stdhalle_cent, MWST_ERM_PROZENT)
+        self.stdhalle_netto_str = _format_betrag(self.stdhalle_netto_cent)
 
         self.hallensaison = False
         self.wochentage_cnt = [0] * 7
         self._init_hallensaison(root)
 
+    def fingerprint(self) -> str:
+        return repr(sorted(vars(self).items()))
+
+    def _init_tarife(self, root: ET.Element) -> None:
+        # Every <stdkostenNN> block holds the price of an NN minute session with
+        # <pK> for a group of K participants
+        for elem_stdkosten in root:
+            if (match_dauer := STDKOSTEN_RE.fullmatch(elem_stdkosten.tag)) is None:
+                continue
+            dauer = int(match_dauer.group(1))
+            for elem_preis in elem_stdkosten:
+                match_tz = TEILNEHMER_RE.fullmatch(elem_preis.tag)
+                if match_tz is None:
+                    raise TCSRechnungError(
+                        f"Ungültiges Element <{elem_preis.tag}> in Block"
+                        f" <{elem_stdkosten.tag}>"
+                    )
+                brutto = _get_int(elem_stdkosten, elem_preis.tag)
+                netto_std_cent = _netto_cent(
+                    brutto * 100 * 60, MWST_VOLL_PROZENT, dauer
+                )
+                self.tarife[(dauer, int(match_tz.group(1)))] = Tarif(
+                    brutto, netto_std_cent, _format_betrag(netto_std_cent)
+                )
+        if not self.tarife:
+            raise TCSRechnungError("Element <stdkostenNN> in Block <data> fehlt")
+
+    def tarif(self, dauer: int, teilnehmerzahl: int) -> Tarif:
+        tarif = self.tarife.get((dauer, teilnehmerzahl))
+        if tarif is None:
+            if all(d != dauer for d, _ in self.tarife):
+                raise TCSRechnungError(f"Ungültige Trainingsdauer={dauer}")
+            raise TCSRechnungError(
+                f"Kein Stundensatz für teilnehmerzahl={teilnehmerzahl} bei"
+                f" dauer={dauer} in <stdkosten{dauer}>"
+            )
+        return tarif
+
     def _init_hallensaison(self, root: ET.Element) -> None:
-        von_datum = datetime.date(self.jahr, MONATE_DIC[self.von_monat], 1)
-        bis_datum = datetime.date(
-            self.jahr,
-            MONATE_DIC[self.bis_monat],
-            calendar.monthrange(self.jahr, MONATE_DIC[self.bis_monat])[1],
-        )
+        von_datum, bis_datum = zeitraum(self.jahr, self.von_monat, self.bis_monat)
+        self.bis_jahr = bis_datum.year
         beginn_halle_str = _get_text(root, "beginn_halle")
         try:
             beginn_halle = datetime.datetime.strptime(
@@ -136,77 +328,385 @@ class Metadaten:
                 f"<beginn_halle>='{beginn_halle_str}' hat ungültiges Format (erwartet:"
                 " DD-MM-YYYY)"
             )
-        ende_halle = beginn_halle + datetime.timedelta(30 * 7 - 1)
-        if (beginn_halle < bis_datum < ende_halle) or (
-            beginn_halle < von_datum < ende_halle
-        ):
+        self.hallensaison, wochentage_cnt = hallenkalender(
+            von_datum, bis_datum, beginn_halle
+        )
+        if self.hallensaison:
             print("Im Rechnungszeitraum ist Hallensaison.")
-            self.hallensaison = True
         else:
             print("Im Rechnungszeitraum ist keine Hallensaison.")
-            self.hallensaison = False
+        self.wochentage_cnt = list(wochentage_cnt)
+
+
+def zeitraum(
+    jahr: int, von_monat: str, bis_monat: str
+) -> tuple[datetime.date, datetime.date]:
+    # A period whose last month comes before its first month ends in the next
+    # year, e.g. November to Februar
+    bis_jahr = jahr + 1 if MONATE_DIC[bis_monat] < MONATE_DIC[von_monat] else jahr
+    von_datum = datetime.date(jahr, MONATE_DIC[von_monat], 1)
+    bis_datum = datetime.date(
+        bis_jahr,
+        MONATE_DIC[bis_monat],
+        calendar.monthrange(bis_jahr, MONATE_DIC[bis_monat])[1],
+    )
+    return von_datum, bis_datum
 
-        for i in range(7):
-            cur_datum = von_datum + datetime.timedelta(i)
-            cnt = 0
-            woche_delta = datetime.timedelta(7)
-            while cur_datum <= ende_halle and cur_datum <= bis_datum:
-                cnt += 1
-                cur_datum += woche_delta
-            self.wochentage_cnt[cur_datum.weekday()] = cnt
 
+def wochentage_zaehlen(von: datetime.date, bis: datetime.date) -> tuple[int, ...]:
+    # Number of Mondays, Tuesdays, ... from von to bis (both inclusive)
+    tage = (bis - von).days + 1
+    if tage <= 0:
+        return (0,) * 7
+    wochen, rest = divmod(tage, 7)
+    return tuple(wochen + ((tag - von.weekday()) % 7 < rest) for tag in range(7))
 
-def erstelle_posten(
-    training: ET.Element,
-    meta: Metadaten,
-    nettopreise: list[float],
-    bruttopreise: list[float],
-) -> str | None:
-    # Create invoice for training only for Förderkinder.  Non-Förderkinder pay the training directly.
-    is_foerderung = _get_text(training, "foerderung")
-    if is_foerderung == "nein":
-        elem_foerderbetrag = training.find("foerderbetrag_gruppe")
-        if elem_foerderbetrag is not None and elem_foerderbetrag.text is not None:
+
+@functools.lru_cache(maxsize=None)
+def hallenkalender(
+    von_datum: datetime.date, bis_datum: datetime.date, beginn_halle: datetime.date
+) -> tuple[bool, tuple[int, ...]]:
+    ende_halle = beginn_halle + datetime.timedelta(30 * 7 - 1)
+    hallensaison = (beginn_halle < bis_datum < ende_halle) or (
+        beginn_halle < von_datum < ende_halle
+    )
+    return hallensaison, wochentage_zaehlen(von_datum, min(bis_datum, ende_halle))
+
+
+# Reads the input file incrementally.  All header elements must precede the first
+# <rechnung>.  Each <rechnung> is removed from the tree after it was processed so
+# memory does not grow with the file size.
+class RechnungsStrom:
+    def __init__(self, eingabedatei: str) -> None:
+        self._events = ET.iterparse(eingabedatei, events=("start", "end"))
+        _, self.root = next(self._events)
+        self._tiefe = 1
+        self._erste = self._naechste_rechnung()
+
+    def _naechste_rechnung(self) -> ET.Element | None:
+        elem: ET.Element
+        for event, elem in self._events:
+            if event == "start":
+                self._tiefe += 1
+                continue
+            self._tiefe -= 1
+            if self._tiefe == 1 and elem.tag == "rechnung":
+                return elem
+        return None
+
+    def __iter__(self) -> Iterator[ET.Element]:
+        rechnung = self._erste
+        self._erste = None
+        while rechnung is not None:
+            yield rechnung
+            self.root.remove(rechnung)
+            rechnung = self._naechste_rechnung()
+
+
+def lade_eingabe(
+    eingabedatei: str, stream: bool = False
+) -> tuple[ET.Element, Iterator[ET.Element]]:
+    if stream:
+        strom = RechnungsStrom(eingabedatei)
+        return strom.root, iter(strom)
+    root = ET.parse(eingabedatei).getroot()
+    return root, iter(_get_all_elems(root, "rechnung"))
+
+
+class Training:
+    __slots__ = (
+        "tag",
+        "foerderung",
+        "gesamtfoerderung",
+        "foerderkinder",
+        "teilnehmerzahl",
+        "dauer",
+        "halleneinheiten",
+    )
+
+    def __init__(
+        self,
+        tag: str,
+        foerderung: bool,
+        gesamtfoerderung: int,
+        foerderkinder: int,
+        teilnehmerzahl: int,
+        dauer: int,
+        halleneinheiten: int | None,
+    ) -> None:
+        self.tag = tag
+        self.foerderung = foerderung
+        self.gesamtfoerderung = gesamtfoerderung
+        self.foerderkinder = foerderkinder
+        self.teilnehmerzahl = teilnehmerzahl
+        self.dauer = dauer
+        self.halleneinheiten = halleneinheiten
+
+    @classmethod
+    def aus_xml(cls, training: ET.Element) -> "Training":
+        # One pass over the children instead of one search per element.  Reversed
+        # so that the first occurrence of an element wins like with find().
+        felder = {elem.tag: elem.text for elem in reversed(training)}
+
+        tag = _feld_text(felder, "tag", "training")
+
+        # Non-Förderkinder pay the training directly, so no funding may be given
+        is_foerderung = _feld_text(felder, "foerderung", "training")
+        gesamtfoerderung = 0
+        foerderkinder = 0
+        if is_foerderung == "nein":
+            if felder.get("foerderbetrag_gruppe") is not None:
+                raise TCSRechnungError(
+                    "<foerderbetrag_gruppe> hat Wert"
+                    f" {felder['foerderbetrag_gruppe']}, aber"
+                    " darf keinen gültigen Wert haben wenn <foerderung>=nein"
+                )
+            if felder.get("foerderkinder") is not None:
+                raise TCSRechnungError(
+                    f"<foerderkinder> hat Wert {felder['foerderkinder']}, aber darf"
+                    " keinen gültigen Wert haben wenn <foerderung>=nein"
+                )
+        elif is_foerderung == "ja":
+            for elem in training.findall("foerderbetrag_gruppe"):
+                foerderbetrag = elem.text
+                if foerderbetrag is None:
+                    raise TCSRechnungError("<foerderbetrag_gruppe> ist leer")
+                try:
+                    gesamtfoerderung += int(foerderbetrag)
+                except ValueError:
+                    raise TCSRechnungError(
+                        f"<foerderbetrag_gruppe>='{foerderbetrag}' ist keine"
+                        " gültige Zahl"
+                    )
+        else:
             raise TCSRechnungError(
-                "<foerderbetrag_gruppe> hat Wert {elem_foerderbetrag.text}, aber darf"
-                " keinen gültigen Wert haben wenn <foerderung>=nein"
+                f"Ungültiger Eintrag <foerderung>={is_foerderung}.  Erlaubte Werte"
+                " sind 'ja' und 'nein'."
             )
-        elem_foerderkinder = training.find("foerderkinder")
-        if elem_foerderkinder is not None and elem_foerderkinder.text is not None:
+
+        dauer = _feld_int(felder, "dauer", "training")
+        teilnehmerzahl = _feld_int(felder, "teilnehmerzahl", "training")
+        if teilnehmerzahl < 1:
             raise TCSRechnungError(
-                "<foerderkinder> hat Wert {elem_foerderkinder.text}, aber darf keinen"
-                " gültigen Wert haben wenn <foerderung>=nein"
+                f"Ungültiger Eintrag <teilnehmerzahl>={teilnehmerzahl}, muss"
+                " mindestens 1 sein"
             )
-        return None
-    elif is_foerderung != "ja":
-        raise TCSRechnungError(
-            f"Ungültiger Eintrag <foerderung>={is_foerderung}.  Erlaubte Werte"
-            " sind 'ja' und 'nein'."
+        if is_foerderung == "ja":
+            foerderkinder = _feld_int(felder, "foerderkinder", "training")
+            if foerderkinder < 1:
+                raise TCSRechnungError(
+                    f"Ungültiger Eintrag <foerderkinder>={foerderkinder}, muss"
+                    " mindestens 1 sein"
+                )
+
+        halleneinheiten = None
+        if felder.get("halleneinheiten") is not None:
+            halleneinheiten = _feld_int(felder, "halleneinheiten", "training")
+        elif tag not in WOCHENTAGE_DIC:
+            # The hall units are counted per weekday unless given explicitly
+            raise TCSRechnungError(f"Ungültiger Wochentag <tag>={tag}")
+
+        return cls(
+            tag,
+            is_foerderung == "ja",
+            gesamtfoerderung,
+            foerderkinder,
+            teilnehmerzahl,
+            dauer,
+            halleneinheiten,
         )
 
-    gesamtfoerderung = 0
-    for foerderbetrag in _get_all_elems(training, "foerderbetrag_gruppe"):
-        if foerderbetrag.text is None:
-            raise TCSRechnungError(f"<{foerderbetrag.tag}> ist leer")
+
+class Kind:
+    __slots__ = ("name", "trainings")
+
+    def __init__(self, name: str, trainings: list[Training]) -> None:
+        self.name = name
+        self.trainings = trainings
+
+    @classmethod
+    def aus_xml(cls, kind: ET.Element) -> "Kind":
+        felder = {elem.tag: elem.text for elem in reversed(kind)}
+        name = _feld_text(felder, "name", "kind")
         try:
-            gesamtfoerderung += int(foerderbetrag.text)
-        except ValueError:
+            trainings = [Training.aus_xml(t) for t in kind.findall("training")]
+            return cls(name, trainings)
+        except TCSRechnungError as e:
+            raise TCSRechnungError(f"Kind '{name}': {str(e)}")
+
+
+# SEPA direct debit mandate of the recipient, from the optional elements <iban>,
+# <bic>, <mandatsreferenz>, <mandatsdatum> and <kontoinhaber> of <rechnung>
+class Mandat(NamedTuple):
+    iban: str
+    bic: str | None
+    referenz: str
+    datum: datetime.date
+    kontoinhaber: str
+
+    @classmethod
+    def aus_felder(cls, felder: dict[str, str | None]) -> "Mandat | None":
+        if all(
+            felder.get(feld) is None
+            for feld in ["iban", "bic", "mandatsreferenz", "mandatsdatum"]
+        ):
+            return None
+        iban = _feld_iban(felder, "iban", "rechnung")
+        bic = _feld_bic(felder, "rechnung")
+        referenz = _feld_text(felder, "mandatsreferenz", "rechnung")
+        if MANDATSREFERENZ_RE.fullmatch(referenz) is None:
             raise TCSRechnungError(
-                f"<{foerderbetrag.tag}>='{foerderbetrag.text}' ist keine gültige Zahl"
+                f"<mandatsreferenz>='{referenz}' ist länger als 35 Zeichen oder"
+                " enthält ungültige Zeichen"
             )
+        datum = _feld_datum(felder, "mandatsdatum", "rechnung")
+        kontoinhaber = felder.get("kontoinhaber") or _feld_text(
+            felder, "name", "rechnung"
+        )
+        return cls(iban, bic, referenz, datum, kontoinhaber)
+
+
+class Rechnung:
+    __slots__ = ("name", "strasse", "ort", "email", "kinder", "mandat")
+
+    def __init__(
+        self,
+        name: str,
+        strasse: str,
+        ort: str,
+        email: str | None,
+        kinder: list[Kind],
+        mandat: Mandat | None = None,
+    ) -> None:
+        self.name = name
+        self.strasse = strasse
+        self.ort = ort
+        self.email = email
+        self.kinder = kinder
+        self.mandat = mandat
+
+    @classmethod
+    def aus_xml(cls, rechnung: ET.Element) -> "Rechnung":
+        # All elements are read and validated here once, so rendering does not
+        # need to look at the XML tree again
+        felder = {elem.tag: elem.text for elem in reversed(rechnung)}
+
+        name = _feld_text(felder, "name", "rechnung")
+        try:
+            strasse = _feld_text(felder, "strasse", "rechnung")
+            ort = _feld_text(felder, "ort", "rechnung")
+            kinder = [Kind.aus_xml(kind) for kind in rechnung.findall("kind")]
+            mandat = Mandat.aus_felder(felder)
+        except TCSRechnungError as e:
+            raise TCSRechnungError(f"Fehler in Rechnung für '{name}': {str(e)}")
+        return cls(name, strasse, ort, felder.get("email"), kinder, mandat)
+
+
+# All trainings of all invoices by group, built in one pass before rendering
+# (not with --stream) and for --check.  The input has no group identity, so a
+# group is approximated by weekday, duration and group size, funded members
+# additionally by the funding of the group.  Identical groups cannot be told
+# apart, e.g. two single lessons on the same day, so the members of an entry must
+# form whole groups.  Members without an invoice in the file are not seen either,
+# so the results are only warnings.
+class Gruppenindex:
+    def __init__(self) -> None:
+        self.teilnehmer: dict[tuple[str, int, int], list[str]] = (
+            collections.defaultdict(list)
+        )
+        self.gefoerdert: dict[tuple[str, int, int, int], list[tuple[str, int]]] = (
+            collections.defaultdict(list)
+        )
+
+    def hinzufuegen(self, rechnung: Rechnung) -> None:
+        for kind in rechnung.kinder:
+            mitglied = f"{rechnung.name}: {kind.name}"
+            for t in kind.trainings:
+                self.teilnehmer[(t.tag, t.dauer, t.teilnehmerzahl)].append(mitglied)
+                if t.foerderung:
+                    self.gefoerdert[
+                        (t.tag, t.dauer, t.teilnehmerzahl, t.gesamtfoerderung)
+                    ].append((mitglied, t.foerderkinder))
+
+    def fehler(self) -> list[str]:
+        meldungen = []
+        for (tag, dauer, teilnehmerzahl), mitglieder in self.teilnehmer.items():
+            if len(mitglieder) % teilnehmerzahl != 0:
+                meldungen.append(
+                    f"Gruppe {tag} {dauer} Minuten: {len(mitglieder)} Teilnehmer,"
+                    f" aber teilnehmerzahl={teilnehmerzahl}"
+                    f" ({_namensliste(mitglieder)})"
+                )
+        for (
+            tag,
+            dauer,
+            teilnehmerzahl,
+            foerderung,
+        ), eintraege in self.gefoerdert.items():
+            angaben = sorted({foerderkinder for _, foerderkinder in eintraege})
+            if len(angaben) == 1 and len(eintraege) % angaben[0] == 0:
+                continue
+            meldungen.append(
+                f"Gruppe {tag} {dauer} Minuten, teilnehmerzahl={teilnehmerzahl},"
+                f" Förderung {foerderung}: {len(eintraege)} geförderte Teilnehmer,"
+                f" aber foerderkinder={', '.join(str(a) for a in angaben)}"
+                f" ({_namensliste([mitglied for mitglied, _ in eintraege])})"
+            )
+        return meldungen
+
+
+def _namensliste(mitglieder: list[str], anzahl: int = 10) -> str:
+    liste = ", ".join(mitglieder[:anzahl])
+    if len(mitglieder) > anzahl:
+        liste += f", ... ({len(mitglieder) - anzahl} weitere)"
+    return liste
 
-    dauer = _get_int(training, "dauer")
-    teilnehmerzahl = _get_int(training, "teilnehmerzahl")
-    if dauer == 60:
-        stdlohn = meta.stdlohn60[teilnehmerzahl - 1]
-        stdlohn_netto = meta.stdlohn60n[teilnehmerzahl - 1]
-    elif dauer == 40:
-        stdlohn = meta.stdlohn40[teilnehmerzahl - 1]
-        stdlohn_netto = meta.stdlohn40n[teilnehmerzahl - 1]
-    else:
-        raise TCSRechnungError(f"Ungültige Trainingsdauer={dauer}")
 
-    foerderkinder = _get_int(training, "foerderkinder")
+def pruefe_gruppen(rechnungen: Iterable[Rechnung]) -> list[str]:
+    index = Gruppenindex()
+    for rechnung in rechnungen:
+        index.hinzufuegen(rechnung)
+    return index.fehler()
+
+
+# One line item of a letter as printed, amounts in cents
+class Posten(NamedTuple):
+    kostentyp: str
+    tag: str
+    einheiten: int
+    stundenpreis_cent: int
+    teilnehmerzahl: int
+    dauer: int
+    preis_cent: int
+    foerderung_cent: int
+    gesamt_cent: int
+
+
+class Summen(NamedTuple):
+    netto_cent: int
+    mwst_voll_cent: int
+    mwst_erm_cent: int
+    brutto_cent: int
+
+
+def erstelle_posten(
+    training: Training,
+    meta: Metadaten,
+    nettopreise: list[int],
+    bruttopreise: list[int],
+    posten: list[Posten] | None = None,
+) -> str | None:
+    # Create invoice for training only for Förderkinder.  Non-Förderkinder pay the training directly.
+    if not training.foerderung:
+        return None
+
+    gesamtfoerderung = training.gesamtfoerderung
+    dauer = training.dauer
+    teilnehmerzahl = training.teilnehmerzahl
+    tarif = meta.tarif(dauer, teilnehmerzahl)
+    stdlohn = tarif.brutto
+
+    foerderkinder = training.foerderkinder
     if gesamtfoerderung * teilnehmerzahl % stdlohn * foerderkinder != 0:
         raise TCSRechnungError(
             f"Gesamtfoerderung={gesamtfoerderung} ist kein Vielfaches von"
@@ -214,211 +714,480 @@ def erstelle_posten(
         )
     einheiten = int(gesamtfoerderung / stdlohn)
 
-    foerderung_pp_netto = gesamtfoerderung / (foerderkinder * (1.0 + MWST_VOLL))
-    zahlbetrag_netto = 0.0
-    zahlbetrag_brutto = 0.0
+    foerderung_pp_netto = _netto_cent(
+        gesamtfoerderung * 100, MWST_VOLL_PROZENT, foerderkinder
+    )
+    zahlbetrag_netto = 0
+    zahlbetrag_brutto = 0
 
     nettopreise.append(zahlbetrag_netto)
     bruttopreise.append(zahlbetrag_brutto)
 
-    posten = (
-        "\\Posten{"
-        + _get_text(training, "tag")
-        + "}{"
-        + str(einheiten)
-        + "}{"
-        + "{:.2f}".format(stdlohn_netto * 60 / dauer).replace(".", ",")
-        + "}{"
-        + str(teilnehmerzahl)
-        + "}{"
-        + str(dauer)
-        + "}{"
-        + "{:.2f}".format(foerderung_pp_netto).replace(".", ",")
-        + "}{"
-        + "{:.2f}".format(foerderung_pp_netto).replace(".", ",")
-        + "}{"
-        + "{:.2f}".format(zahlbetrag_netto).replace(".", ",")
-        + "}\n"
-    )
-    return posten
+    return _posten_training(
+        training, tarif, einheiten, foerderung_pp_netto, zahlbetrag_netto, posten
+    )
+
+
+def _posten_training(
+    training: Training,
+    tarif: Tarif,
+    einheiten: int,
+    foerderung_pp_netto: int,
+    zahlbetrag_netto: int,
+    posten: list[Posten] | None = None,
+) -> str:
+    # The line and, if posten is given, the same line item in cents without its
+    # kostentyp, which schreibe_rechnung sets
+    if posten is not None:
+        posten.append(
+            Posten(
+                "",
+                training.tag,
+                einheiten,
+                tarif.netto_std_cent,
+                training.teilnehmerzahl,
+                training.dauer,
+                foerderung_pp_netto,
+                foerderung_pp_netto,
+                zahlbetrag_netto,
+            )
+        )
+    foerderung_str = _format_betrag(foerderung_pp_netto)
+    return POSTEN % (
+        training.tag,
+        einheiten,
+        tarif.netto_std_str,
+        training.teilnehmerzahl,
+        training.dauer,
+        foerderung_str,
+        foerderung_str,
+        _format_betrag(zahlbetrag_netto),
+    )
 
 
 def erstelle_hallenposten(
-    training: ET.Element,
+    training: Training,
     meta: Metadaten,
-    nettopreise: list[float],
-    bruttopreise: list[float],
+    nettopreise: list[int],
+    bruttopreise: list[int],
+    posten: list[Posten] | None = None,
 ) -> str:
-    wochentag = _get_text(training, "tag")
+    wochentag = training.tag
 
-    einheiten = 0
-    halleneinheiten = training.find("halleneinheiten")
-    if halleneinheiten is None or halleneinheiten.text is None:
+    if training.halleneinheiten is None:
         einheiten = meta.wochentage_cnt[WOCHENTAGE_DIC[wochentag]]
     else:
-        einheiten = _get_int(training, "halleneinheiten")
-
-    teilnehmerzahl = _get_int(training, "teilnehmerzahl")
-    dauer = _get_int(training, "dauer")
+        einheiten = training.halleneinheiten
 
-    gesamtpreis_netto = einheiten * meta.stdhalle_netto * dauer / (60 * teilnehmerzahl)
+    teilnehmerzahl = training.teilnehmerzahl
+    dauer = training.dauer
 
-    nettopreise.append(round(gesamtpreis_netto, 2))
-    bruttopreise.append(
-        round(einheiten * meta.stdhalle * dauer / (60 * teilnehmerzahl), 2)
+    # Share of the hall costs in cents, rounded once per line
+    gesamtpreis_brutto = einheiten * meta.stdhalle_cent * dauer
+    gesamtpreis_netto = _netto_cent(
+        gesamtpreis_brutto, MWST_ERM_PROZENT, 60 * teilnehmerzahl
     )
 
-    posten = (
-        "\\Posten{"
-        + wochentag
-        + "}{"
-        + str(einheiten)
-        + "}{"
-        + "{:.2f}".format(meta.stdhalle_netto).replace(".", ",")
-        + "}{"
-        + str(teilnehmerzahl)
-        + "}{"
-        + str(dauer)
-        + "}{"
-        + "{:.2f}".format(gesamtpreis_netto).replace(".", ",")
-        + "}{"
-        + "{:.2f}".format(0).replace(".", ",")
-        + "}{"
-        + "{:.2f}".format(gesamtpreis_netto).replace(".", ",")
-        + "}\n"
-    )
-    return posten
+    nettopreise.append(gesamtpreis_netto)
+    bruttopreise.append(_runde(gesamtpreis_brutto, 60 * teilnehmerzahl))
 
+    return _posten_halle(training, meta, einheiten, gesamtpreis_netto, posten)
 
-def erstelle_rechnung(
-    rechnung: ET.Element, rechnungsnummer: int, meta: Metadaten
+
+def _posten_halle(
+    training: Training,
+    meta: Metadaten,
+    einheiten: int,
+    gesamtpreis_netto: int,
+    posten: list[Posten] | None = None,
 ) -> str:
-    rechnung_name = _get_text(rechnung, "name")
-    try:
-        latex_out = (
-            "\\Empfaenger{"
-            + rechnung_name
-            + "}{"
-            + _get_text(rechnung, "strasse")
-            + "}{"
-            + _get_text(rechnung, "ort")
-            + "}\n"
+    if posten is not None:
+        posten.append(
+            Posten(
+                "",
+                training.tag,
+                einheiten,
+                meta.stdhalle_netto_cent,
+                training.teilnehmerzahl,
+                training.dauer,
+                gesamtpreis_netto,
+                0,
+                gesamtpreis_netto,
+            )
         )
+    gesamtpreis_str = _format_betrag(gesamtpreis_netto)
+    return POSTEN % (
+        training.tag,
+        einheiten,
+        meta.stdhalle_netto_str,
+        training.teilnehmerzahl,
+        training.dauer,
+        gesamtpreis_str,
+        "0,00",
+        gesamtpreis_str,
+    )
 
-        kinder = ""
-        kindercnt = 0
 
-        for kind in _get_all_elems(rechnung, "kind"):
-            kindercnt += 1
-            if kindercnt > 1:
-                kinder += ", "
-            kinder += _get_text(kind, "name")
-
-        latex_out += (
-            "\\Referenz{"
-            + str(meta.jahr_cur - 2000)
-            + "/{:04d}".format(rechnungsnummer)
-            + "}{"
-            + meta.von_monat
-            + "}{"
-            + meta.bis_monat
-            + " "
-            + str(meta.jahr)
-            + "}{"
-            + kinder
-            + "}\n"
+# Rendered line items with their amounts, shared by all invoices.  Siblings and
+# families in the same group have identical trainings, so most lines are only
+# rendered once.  Bounded, the oldest entries are dropped first.
+class PostenCache:
+    def __init__(self, groesse: int = POSTEN_CACHE_GROESSE) -> None:
+        self.groesse = groesse
+        self.eintraege: dict[
+            tuple[object, ...],
+            tuple[str | None, list[int], list[int], list[Posten]],
+        ] = {}
+        self.treffer = 0
+        self.fehlgriffe = 0
+
+    def posten(
+        self,
+        erstelle: Callable[
+            [Training, Metadaten, list[int], list[int], list[Posten]], str | None
+        ],
+        training: Training,
+        meta: Metadaten,
+        nettopreise: list[int],
+        bruttopreise: list[int],
+        posten: list[Posten] | None = None,
+    ) -> str | None:
+        # Same result as erstelle(training, meta, nettopreise, bruttopreise,
+        # posten).  The key holds meta itself, so entries of other metadata never
+        # match.
+        schluessel = (
+            erstelle,
+            meta,
+            training.tag,
+            training.foerderung,
+            training.gesamtfoerderung,
+            training.foerderkinder,
+            training.teilnehmerzahl,
+            training.dauer,
+            training.halleneinheiten,
         )
-    except TCSRechnungError as e:
-        raise TCSRechnungError(f"Fehler in Rechnung für '{rechnung_name}': {str(e)}")
+        eintrag = self.eintraege.get(schluessel)
+        if eintrag is None:
+            self.fehlgriffe += 1
+            netto: list[int] = []
+            brutto: list[int] = []
+            neue_posten: list[Posten] = []
+            eintrag = (
+                erstelle(training, meta, netto, brutto, neue_posten),
+                netto,
+                brutto,
+                neue_posten,
+            )
+            if len(self.eintraege) >= self.groesse:
+                del self.eintraege[next(iter(self.eintraege))]
+            self.eintraege[schluessel] = eintrag
+        else:
+            self.treffer += 1
+        nettopreise += eintrag[1]
+        bruttopreise += eintrag[2]
+        if posten is not None:
+            posten += eintrag[3]
+        return eintrag[0]
 
-    nettopreise16: list[float] = []
-    bruttopreise16: list[float] = []
-    nettopreise7: list[float] = []
-    bruttopreise7: list[float] = []
+    def trefferquote(self) -> float:
+        anfragen = self.treffer + self.fehlgriffe
+        return self.treffer / anfragen if anfragen else 0.0
 
-    for kind in _get_all_elems(rechnung, "kind"):
-        kind_name = _get_text(kind, "name")
+    def leeren(self) -> None:
+        self.eintraege.clear()
+        self.treffer = 0
+        self.fehlgriffe = 0
+
+
+POSTEN_CACHE = PostenCache()
+
+
+def schreibe_rechnung(
+    schreibe: Callable[[str], object],
+    rechnung: Rechnung,
+    rechnungsnummer: int,
+    meta: Metadaten,
+    preise: "Preise | None" = None,
+    posten: list[Posten] | None = None,
+) -> Summen:
+    # Emits the letter fragment by fragment, e.g. into list.append or file.write.
+    # Returns the totals in cents and appends the printed line items to posten.
+    schreibe(EMPFAENGER % (rechnung.name, rechnung.strasse, rechnung.ort))
+
+    kindercnt = len(rechnung.kinder)
+    kinder = ", ".join(kind.name for kind in rechnung.kinder)
+    schreibe(
+        REFERENZ
+        % (
+            meta.jahr_cur - 2000,
+            rechnungsnummer,
+            meta.von_monat,
+            meta.bis_monat,
+            meta.bis_jahr,
+            kinder,
+        )
+    )
+
+    nettopreise16: list[int] = []
+    bruttopreise16: list[int] = []
+    nettopreise7: list[int] = []
+    bruttopreise7: list[int] = []
+
+    # Index of the training in the precomputed amounts
+    i = 0
+    for kind in rechnung.kinder:
+        kind_name = kind.name
         posten_training = []
         posten_halle = []
+        # Line items of the child in cents, only collected if posten is given
+        kind_training: list[Posten] | None = None if posten is None else []
+        kind_halle: list[Posten] | None = None if posten is None else []
         try:
-            for training in _get_all_elems(kind, "training"):
+            for training in kind.trainings:
+                if preise is not None:
+                    # Förderkinder pay nothing for the training itself
+                    if training.foerderung:
+                        posten_training.append(
+                            _posten_training(
+                                training,
+                                meta.tarif(training.dauer, training.teilnehmerzahl),
+                                preise.foerdereinheiten[i],
+                                preise.foerderung_pp_netto[i],
+                                0,
+                                kind_training,
+                            )
+                        )
+                    posten_halle.append(
+                        _posten_halle(
+                            training,
+                            meta,
+                            preise.halleneinheiten[i],
+                            preise.hallenpreis_netto[i],
+                            kind_halle,
+                        )
+                    )
+                    i += 1
+                    continue
+
                 if (
-                    current_posten := erstelle_posten(
-                        training, meta, nettopreise16, bruttopreise16
+                    current_posten := POSTEN_CACHE.posten(
+                        erstelle_posten,
+                        training,
+                        meta,
+                        nettopreise16,
+                        bruttopreise16,
+                        kind_training,
                     )
                 ) is not None:
                     posten_training.append(current_posten)
 
-                posten_halle.append(
-                    erstelle_hallenposten(training, meta, nettopreise7, bruttopreise7)
+                hallenposten = POSTEN_CACHE.posten(
+                    erstelle_hallenposten,
+                    training,
+                    meta,
+                    nettopreise7,
+                    bruttopreise7,
+                    kind_halle,
                 )
+                assert hallenposten is not None
+                posten_halle.append(hallenposten)
         except TCSRechnungError as e:
             raise TCSRechnungError(
-                f"Fehler in Rechnung für '{rechnung_name}',"
+                f"Fehler in Rechnung für '{rechnung.name}',"
                 f" Kind '{kind_name}': {str(e)}"
             )
 
         if posten_training:
             if kindercnt > 1:
-                latex_out += "\\Kostentyp{Trainingskosten (" + kind_name + ")}\n"
+                kostentyp = "Trainingskosten (" + kind_name + ")"
             else:
-                latex_out += "\\Kostentyp{Trainingskosten}\n"
-            for posten in posten_training:
-                latex_out += posten
+                kostentyp = "Trainingskosten"
+            schreibe(KOSTENTYP % kostentyp)
+            schreibe("".join(posten_training))
+            if posten is not None and kind_training is not None:
+                posten += [p._replace(kostentyp=kostentyp) for p in kind_training]
 
         if meta.hallensaison:
             if kindercnt > 1:
-                latex_out += "\\Kostentyp{Hallenkosten (" + kind_name + ")}\n"
+                kostentyp = "Hallenkosten (" + kind_name + ")"
             else:
-                latex_out += "\\Kostentyp{Hallenkosten}\n"
-            for posten in posten_halle:
-                latex_out += posten
-
-    sumnp16 = sum(nettopreise16)
-    sumbp16 = sum(bruttopreise16)
-    sumnp7 = sum(nettopreise7)
-    sumbp7 = sum(bruttopreise7)
+                kostentyp = "Hallenkosten"
+            schreibe(KOSTENTYP % kostentyp)
+            schreibe("".join(posten_halle))
+            if posten is not None and kind_halle is not None:
+                posten += [p._replace(kostentyp=kostentyp) for p in kind_halle]
+
+    if preise is not None:
+        sumnp16, sumbp16, sumnp7, sumbp7 = preise.summen
+    else:
+        sumnp16 = sum(nettopreise16)
+        sumbp16 = sum(bruttopreise16)
+        sumnp7 = sum(nettopreise7)
+        sumbp7 = sum(bruttopreise7)
 
     if meta.hallensaison:
-        latex_out += (
-            "\\SummeWinter{"
-            + "{:.2f}".format(sumnp16 + sumnp7).replace(".", ",")
-            + "}{"
-            + "{:.2f}".format(sumbp16 - sumnp16).replace(".", ",")
-            + "}{"
-            + "{:.2f}".format(sumbp7 - sumnp7).replace(".", ",")
-            + "}{"
-            + "{:.2f}".format(sumbp16 + sumbp7).replace(".", ",")
-            + "}\n"
+        summen = Summen(
+            sumnp16 + sumnp7, sumbp16 - sumnp16, sumbp7 - sumnp7, sumbp16 + sumbp7
         )
+        schreibe(SUMME_WINTER % tuple(_format_betrag(betrag) for betrag in summen))
     else:
-        latex_out += (
-            "\\SummeSommer{"
-            + "{:.2f}".format(sumnp16).replace(".", ",")
-            + "}{"
-            + "{:.2f}".format(sumbp16 - sumnp16).replace(".", ",")
-            + "}{"
-            + "{:.2f}".format(sumbp16).replace(".", ",")
-            + "}\n"
-        )
-
-    latex_out += (
-        "\\Schluss{"
-        + meta.von_monat
-        + "}{"
-        + meta.bis_monat
-        + " "
-        + str(meta.jahr)
-        + "}{"
-        + str(meta.jahr + 1)
-        + "}\n\n"
-    )
-    return latex_out
-
-
-def erstelle_mail(rechnung: ET.Element, meta: Metadaten, texfile: str) -> str:
-    email_out = _get_text(rechnung, "email")
-    name = _get_text(rechnung, "name")
+        summen = Summen(sumnp16, sumbp16 - sumnp16, 0, sumbp16)
+        schreibe(
+            SUMME_SOMMER
+            % (
+                _format_betrag(summen.netto_cent),
+                _format_betrag(summen.mwst_voll_cent),
+                _format_betrag(summen.brutto_cent),
+            )
+        )
+
+    schreibe(SCHLUSS % (meta.von_monat, meta.bis_monat, meta.bis_jahr, meta.jahr + 1))
+    return summen
+
+
+def erstelle_rechnung(
+    rechnung: Rechnung,
+    rechnungsnummer: int,
+    meta: Metadaten,
+    preise: "Preise | None" = None,
+) -> str:
+    teile: list[str] = []
+    schreibe_rechnung(teile.append, rechnung, rechnungsnummer, meta, preise)
+    return "".join(teile)
+
+
+# Amounts of one invoice computed by berechne_preise_vektor, one entry per
+# training in document order, amounts in cents
+class Preise(NamedTuple):
+    foerdereinheiten: Sequence[int]
+    foerderung_pp_netto: Sequence[int]
+    halleneinheiten: Sequence[int]
+    hallenpreis_netto: Sequence[int]
+    # netto and brutto with MWST_VOLL_PROZENT, netto and brutto with MWST_ERM_PROZENT
+    summen: tuple[int, int, int, int]
+
+
+def _runde_vektor(zaehler: "np.ndarray", nenner: "np.ndarray") -> "np.ndarray":
+    # Same as _runde for int64 columns
+    gerundet: "np.ndarray" = np.sign(zaehler) * (
+        (2 * np.abs(zaehler) + nenner) // (2 * nenner)
+    )
+    return gerundet
+
+
+def berechne_preise_vektor(
+    rechnungen: Sequence[Rechnung], meta: Metadaten
+) -> list[Preise]:
+    # All trainings of all invoices as columns, so every amount is computed with
+    # one array operation.  Results are identical to erstelle_posten and
+    # erstelle_hallenposten.
+    if np is None:
+        raise TCSRechnungError("Die vektorisierte Preisberechnung benötigt numpy")
+
+    alle = [
+        (index, training)
+        for index, rechnung in enumerate(rechnungen)
+        for kind in rechnung.kinder
+        for training in kind.trainings
+    ]
+    trainings = [training for _, training in alle]
+
+    def spalte(werte: Iterable[object], dtype: type) -> "np.ndarray":
+        return np.fromiter(werte, dtype=dtype, count=len(alle))
+
+    try:
+        stdlohn_a = spalte(
+            (
+                meta.tarif(t.dauer, t.teilnehmerzahl).brutto if t.foerderung else 1
+                for t in trainings
+            ),
+            np.int64,
+        )
+        wochentag = spalte(
+            (
+                WOCHENTAGE_DIC[t.tag] if t.halleneinheiten is None else 0
+                for t in trainings
+            ),
+            np.intp,
+        )
+    except TCSRechnungError:
+        # The scalar path raises the same error with invoice and child context
+        for rechnung in rechnungen:
+            erstelle_rechnung(rechnung, 0, meta)
+        raise
+
+    idx = spalte((index for index, _ in alle), np.intp)
+    dauer_a = spalte((t.dauer for t in trainings), np.int64)
+    tz_a = spalte((t.teilnehmerzahl for t in trainings), np.int64)
+    fk_a = spalte((t.foerderkinder for t in trainings), np.int64)
+    gf_a = spalte((t.gesamtfoerderung for t in trainings), np.int64)
+    foerderung_a = spalte((t.foerderung for t in trainings), bool)
+    vorgabe = spalte(
+        (-1 if t.halleneinheiten is None else t.halleneinheiten for t in trainings),
+        np.int64,
+    )
+
+    ungueltig = foerderung_a & ((gf_a * tz_a % stdlohn_a * fk_a != 0) | (fk_a == 0))
+    if ungueltig.any():
+        rechnung = rechnungen[int(idx[np.argmax(ungueltig)])]
+        erstelle_rechnung(rechnung, 0, meta)
+        raise TCSRechnungError(f"Ungültige Förderung in Rechnung für '{rechnung.name}'")
+
+    foerdereinheiten = np.where(foerderung_a, np.trunc(gf_a / stdlohn_a), 0).astype(
+        np.int64
+    )
+    foerderung_pp_netto = np.where(
+        foerderung_a,
+        _runde_vektor(
+            gf_a * 100 * 100, np.maximum(fk_a, 1) * (100 + MWST_VOLL_PROZENT)
+        ),
+        0,
+    )
+
+    wochentage_cnt = np.array(meta.wochentage_cnt, dtype=np.int64)
+    halleneinheiten = np.where(
+        spalte((t.halleneinheiten is not None for t in trainings), bool),
+        vorgabe,
+        wochentage_cnt[wochentag],
+    )
+    hallenpreis_brutto = halleneinheiten * meta.stdhalle_cent * dauer_a
+    hallenpreis_netto = _runde_vektor(
+        hallenpreis_brutto * 100, 60 * tz_a * (100 + MWST_ERM_PROZENT)
+    )
+
+    # Grouped sums per invoice.  bincount sums in float64, which is exact for
+    # whole cents far beyond any realistic invoice.
+    anzahl = len(rechnungen)
+    netto7 = np.bincount(idx, weights=hallenpreis_netto, minlength=anzahl)
+    brutto7 = np.bincount(
+        idx, weights=_runde_vektor(hallenpreis_brutto, 60 * tz_a), minlength=anzahl
+    )
+
+    grenzen = [0] + np.cumsum(np.bincount(idx, minlength=anzahl)).tolist()
+    einheiten_l = foerdereinheiten.tolist()
+    pp_netto_l = foerderung_pp_netto.tolist()
+    hallen_l = halleneinheiten.tolist()
+    hallenpreis_l = hallenpreis_netto.tolist()
+    netto7_l = netto7.astype(np.int64).tolist()
+    brutto7_l = brutto7.astype(np.int64).tolist()
+    return [
+        Preise(
+            einheiten_l[von:bis],
+            pp_netto_l[von:bis],
+            hallen_l[von:bis],
+            hallenpreis_l[von:bis],
+            (0, 0, netto7_l[i], brutto7_l[i]),
+        )
+        for i, (von, bis) in enumerate(zip(grenzen, grenzen[1:]))
+    ]
+
+
+def erstelle_mail(rechnung: Rechnung, meta: Metadaten, texfile: str) -> str:
+    if rechnung.email is None:
+        raise TCSRechnungError(
+            "Element <email> in Block <rechnung> fehlt oder ist leer"
+        )
+    name = rechnung.name
     anrede = name.split(" ", 1)[0]
     if anrede in ["Familie", "Frau"]:
         anrede_out = "Liebe " + name
@@ -427,38 +1196,1581 @@ def erstelle_mail(rechnung: ET.Element, meta: Metadaten, texfile: str) -> str:
     else:
         anrede_out = "Liebe/r " + name
 
-    kinder = _get_all_elems(rechnung, "kind")
-    kinder_out = _get_text(kinder[0], "name")
-    for kind in kinder[1:-1]:
-        kinder_out += ", " + _get_text(kind, "name")
+    kinder = rechnung.kinder
+    if not kinder:
+        raise TCSRechnungError("Element <kind> in Block <rechnung> fehlt")
     if len(kinder) > 1:
-        kinder_out += " und " + _get_text(kinder[-1], "name")
+        kinder_out = (
+            ", ".join(kind.name for kind in kinder[:-1]) + " und " + kinder[-1].name
+        )
+    else:
+        kinder_out = kinder[0].name
+
+    pdffile = os.path.splitext(os.path.basename(texfile))[0] + ".pdf"
+
+    return MAILZEILE % (
+        anrede_out,
+        rechnung.email,
+        kinder_out,
+        meta.von_monat,
+        meta.bis_monat,
+        meta.jahr,
+        pdffile,
+    )
 
-    pdffile = os.path.join(os.path.splitext(os.path.basename(texfile))[0] + ".pdf")
 
+def get_mail_header() -> str:
+    return "Anrede;Email;Kinder;Von_Monat;Bis_Monat;Jahr;Anhang\n"
+
+
+def rechnungsname(meta: Metadaten, rechnungsnummer: int) -> str:
+    return str(meta.jahr_cur - 2000) + "_{:04d}".format(rechnungsnummer)
+
+
+def periode(meta: Metadaten) -> str:
+    # Billing period, e.g. 2024_10-12
     return (
-        anrede_out
-        + ";"
-        + email_out
-        + ";"
-        + kinder_out
-        + ";"
-        + meta.von_monat
-        + ";"
-        + meta.bis_monat
-        + ";"
-        + str(meta.jahr)
-        + ";"
-        + pdffile
-        + "\n"
+        str(meta.jahr)
+        + "_"
+        + str(MONATE_DIC[meta.von_monat])
+        + "-"
+        + str(MONATE_DIC[meta.bis_monat])
     )
 
 
-def get_mail_header() -> str:
-    return "Anrede;Email;Kinder;Von_Monat;Bis_Monat;Jahr;Anhang\n"
+def gesamtname(meta: Metadaten) -> str:
+    return "rechnungen_" + periode(meta)
+
+
+class Ergebnis(NamedTuple):
+    rechnungsnr: int
+    name: str
+    email: str | None
+    kinder: list[str]
+    output: str | None
+    mail: str | None
+    sekunden: float
+    mandat: Mandat | None = None
+    posten: list[Posten] | None = None
+    summen: Summen | None = None
+
+
+class Zeitmessung:
+    # Phase durations, peak memory and the slowest invoices for --timings
+    def __init__(self, speicher: bool = False) -> None:
+        self.start = time.perf_counter()
+        self.phasen: dict[str, float] = collections.defaultdict(float)
+        self.langsamste: list[tuple[float, int, str]] = []
+        self.rechnungen = 0
+        self.speicher = speicher
+        if speicher:
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phasen[name] += time.perf_counter() - start
+
+    def gemessen(
+        self, name: str, elemente: Iterable[ET.Element]
+    ) -> Iterator[ET.Element]:
+        # Counts the time spent producing the elements, e.g. parsing with --stream
+        iterator = iter(elemente)
+        while True:
+            with self.phase(name):
+                elem = next(iterator, None)
+            if elem is None:
+                return
+            yield elem
+
+    def rechnung(self, ergebnis: Ergebnis) -> None:
+        self.rechnungen += 1
+        self.phasen["rendern"] += ergebnis.sekunden
+        eintrag = (ergebnis.sekunden, ergebnis.rechnungsnr, ergebnis.name)
+        if len(self.langsamste) < LANGSAMSTE:
+            heapq.heappush(self.langsamste, eintrag)
+        else:
+            heapq.heappushpop(self.langsamste, eintrag)
+
+    def bericht(self) -> dict[str, object]:
+        bericht: dict[str, object] = {
+            "gesamt_sekunden": time.perf_counter() - self.start,
+            "phasen_sekunden": dict(self.phasen),
+            "rechnungen": self.rechnungen,
+            "langsamste_rechnungen": [
+                {"rechnungsnr": nr, "name": name, "sekunden": sekunden}
+                for sekunden, nr, name in sorted(self.langsamste, reverse=True)
+            ],
+            # Only the main process, workers of --jobs have their own cache
+            "posten_cache": {
+                "treffer": POSTEN_CACHE.treffer,
+                "fehlgriffe": POSTEN_CACHE.fehlgriffe,
+                "trefferquote": POSTEN_CACHE.trefferquote(),
+            },
+        }
+        if self.speicher:
+            bericht["speicher_spitze_bytes"] = tracemalloc.get_traced_memory()[1]
+        return bericht
+
+    def speichern(self, datei: str) -> None:
+        bericht = self.bericht()
+        if self.speicher:
+            tracemalloc.stop()
+        with open(datei, "w") as f:
+            json.dump(bericht, f, indent=1, ensure_ascii=False)
+
+
+def _rendere_paket(
+    meta: Metadaten,
+    paket: list[tuple[int, Rechnung, bool, Preise | None]],
+    mit_posten: bool = False,
+) -> list[Ergebnis]:
+    ergebnisse: list[Ergebnis] = []
+    for rechnungsnr, rechnung, rendern, preise in paket:
+        start = time.perf_counter()
+        output = None
+        posten: list[Posten] | None = [] if mit_posten and rendern else None
+        summen = None
+        if rendern:
+            teile: list[str] = []
+            summen = schreibe_rechnung(
+                teile.append, rechnung, rechnungsnr, meta, preise, posten
+            )
+            output = "".join(teile)
+        try:
+            mail: str | None = erstelle_mail(
+                rechnung, meta, rechnungsname(meta, rechnungsnr) + ".tex"
+            )
+        except TCSRechnungError:
+            mail = None
+        ergebnisse.append(
+            Ergebnis(
+                rechnungsnr,
+                rechnung.name,
+                rechnung.email,
+                [kind.name for kind in rechnung.kinder],
+                output,
+                mail,
+                time.perf_counter() - start,
+                rechnung.mandat,
+                posten,
+                summen if mit_posten else None,
+            )
+        )
+    return ergebnisse
 
 
-def run() -> None:
+# Metadata of a worker process of --jobs, sent once when the worker starts so
+# that the line item cache of the worker stays valid for all packets
+_worker_meta: Metadaten | None = None
+_worker_mit_posten = False
+
+
+def _starte_worker(meta: Metadaten, mit_posten: bool = False) -> None:
+    global _worker_meta, _worker_mit_posten
+    _worker_meta = meta
+    _worker_mit_posten = mit_posten
+
+
+def _rendere_paket_im_worker(
+    paket: list[tuple[int, Rechnung, bool, Preise | None]],
+) -> list[Ergebnis]:
+    assert _worker_meta is not None
+    return _rendere_paket(_worker_meta, paket, _worker_mit_posten)
+
+
+def rendere_rechnungen(
+    rechnungen: Iterable[ET.Element],
+    meta: Metadaten,
+    rechnungsnr: int,
+    jobs: int = 1,
+    ueberspringe: Callable[[int, ET.Element], bool] | None = None,
+    zeitmessung: Zeitmessung | None = None,
+    vektor: bool = False,
+    nummern: Iterable[int] | None = None,
+    mit_posten: bool = False,
+    modelle: Iterable[Rechnung] | None = None,
+) -> Iterator[Ergebnis]:
+    # Numbers are assigned before dispatching, so the result is identical to a
+    # serial run.  Only a bounded number of packets is in flight at any time to
+    # keep memory flat in combination with --stream.  Invoices for which
+    # ueberspringe returns True are not rendered and yield None as output.  With
+    # vektor all invoices are read first and priced together.  nummern replaces
+    # the consecutive numbers after rechnungsnr, e.g. with numbers from the
+    # Nummernbuch.  With mit_posten the rendered invoices carry their line items
+    # and totals.  modelle are the invoices already read in the same order, e.g.
+    # for the group check.
+    if zeitmessung is None:
+        zeitmessung = Zeitmessung()
+    vorhanden = None if modelle is None else iter(modelle)
+
+    def lade(rechnung: ET.Element) -> Rechnung:
+        if vorhanden is not None:
+            return next(vorhanden)
+        with zeitmessung.phase("laden"):
+            return Rechnung.aus_xml(rechnung)
+
+    geladen: Iterable[tuple[int, Rechnung, bool]] = (
+        (
+            nr,
+            lade(rechnung),
+            ueberspringe is None or not ueberspringe(nr, rechnung),
+        )
+        for nr, rechnung in zip(
+            itertools.count(rechnungsnr + 1) if nummern is None else nummern,
+            rechnungen,
+        )
+    )
+    auftraege: Iterator[tuple[int, Rechnung, bool, Preise | None]]
+    if vektor:
+        geladen = list(geladen)
+        with zeitmessung.phase("preise"):
+            preise = berechne_preise_vektor([r for _, r, _ in geladen], meta)
+        auftraege = (
+            (nr, r, rendern, p) for (nr, r, rendern), p in zip(geladen, preise)
+        )
+    else:
+        auftraege = ((nr, r, rendern, None) for nr, r, rendern in geladen)
+    if jobs <= 1:
+        for auftrag in auftraege:
+            yield from _rendere_paket(meta, [auftrag], mit_posten)
+        return
+
+    with ProcessPoolExecutor(
+        max_workers=jobs, initializer=_starte_worker, initargs=(meta, mit_posten)
+    ) as pool:
+        offen: collections.deque[Future[list[Ergebnis]]] = collections.deque()
+        while paket := list(itertools.islice(auftraege, PAKETGROESSE)):
+            offen.append(pool.submit(_rendere_paket_im_worker, paket))
+            if len(offen) >= 2 * jobs:
+                yield from offen.popleft().result()
+        while offen:
+            yield from offen.popleft().result()
+
+
+def rechnung_hash(rechnung: ET.Element, rechnungsnummer: int, meta: Metadaten) -> str:
+    h = hashlib.sha256()
+    h.update(meta.fingerprint().encode())
+    h.update(str(rechnungsnummer).encode())
+    h.update(
+        ET.canonicalize(
+            ET.tostring(rechnung, encoding="unicode"), strip_text=True
+        ).encode()
+    )
+    return h.hexdigest()
+
+
+# Content hashes of the invoices written by the previous run in the output folder.
+# Used by --incremental to rewrite only the invoices whose input changed.  A run
+# may rewrite any tex file, so the hashes are dropped from the file when it is
+# read and only written again by speichern after a successful run.
+class Manifest:
+    DATEI = ".tcsrechnung-manifest.json"
+
+    def __init__(self, ordner: str, meta: Metadaten) -> None:
+        self.ordner = ordner
+        self.meta = meta
+        self.alt: dict[str, str] = {}
+        self.neu: dict[str, str] = {}
+        try:
+            with open(os.path.join(ordner, Manifest.DATEI)) as f:
+                self.alt = json.load(f)
+        except FileNotFoundError:
+            pass
+        # The names are kept, so that stale invoices are still removed later
+        if self.alt:
+            self._schreibe(dict.fromkeys(self.alt, ""))
+
+    def unveraendert(self, rechnungsnr: int, rechnung: ET.Element) -> bool:
+        name = rechnungsname(self.meta, rechnungsnr)
+        self.neu[name] = rechnung_hash(rechnung, rechnungsnr, self.meta)
+        return self.alt.get(name) == self.neu[name] and os.path.exists(
+            os.path.join(self.ordner, name + ".tex")
+        )
+
+    def _schreibe(self, hashes: dict[str, str]) -> None:
+        with open(os.path.join(self.ordner, Manifest.DATEI), "w") as f:
+            json.dump(hashes, f, indent=1, sort_keys=True)
+
+    def speichern(self) -> list[str]:
+        self._schreibe(self.neu)
+        return sorted(set(self.alt) - set(self.neu))
+
+
+def empfaenger_schluessel(name: str, strasse: str, ort: str) -> str:
+    # Same recipient for --check and --ledger, independent of spacing and case
+    return "\n".join(" ".join(feld.split()).casefold() for feld in [name, strasse, ort])
+
+
+# Invoice numbers assigned once per recipient and period, kept in a SQLite file.
+# Reruns of the same period get the same numbers, only new recipients get new
+# ones.  The file lock serialises concurrent runs, all numbers of a run are
+# assigned in one transaction.
+class Nummernbuch:
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS nummern (
+            zeitraum TEXT NOT NULL,
+            empfaenger TEXT NOT NULL,
+            jahr INTEGER NOT NULL,
+            nummer INTEGER NOT NULL,
+            PRIMARY KEY (zeitraum, empfaenger),
+            UNIQUE (jahr, nummer)
+        )
+    """
+
+    def __init__(self, datei: str) -> None:
+        self.datei = datei
+
+    @contextlib.contextmanager
+    def _gesperrt(self) -> Iterator[sqlite3.Connection]:
+        with open(self.datei + ".lock", "w") as sperre:
+            fcntl.flock(sperre, fcntl.LOCK_EX)
+            verbindung = sqlite3.connect(self.datei, isolation_level=None)
+            try:
+                verbindung.execute(Nummernbuch.SCHEMA)
+                verbindung.execute("BEGIN IMMEDIATE")
+                try:
+                    yield verbindung
+                except BaseException:
+                    verbindung.execute("ROLLBACK")
+                    raise
+                verbindung.execute("COMMIT")
+            finally:
+                verbindung.close()
+
+    def vergebe(
+        self, rechnungen: Sequence[ET.Element], meta: Metadaten, rechnungsnr: int
+    ) -> list[int]:
+        # Returns the numbers of the invoices in file order.  New numbers
+        # continue after the highest number of the year, at least after
+        # <rechnungsnummer>.  A period keeps the year prefix of its first run, so
+        # meta.jahr_cur is set to it.
+        schluessel: list[str] = []
+        positionen: dict[str, int] = {}
+        for position, rechnung in enumerate(rechnungen, 1):
+            empfaenger = empfaenger_schluessel(
+                _get_text(rechnung, "name"),
+                _get_text(rechnung, "strasse"),
+                _get_text(rechnung, "ort"),
+            )
+            if empfaenger in positionen:
+                raise TCSRechnungError(
+                    f"Rechnung {position} '{_get_text(rechnung, 'name')}': Gleicher"
+                    f" Empfänger wie Rechnung {positionen[empfaenger]}"
+                )
+            positionen[empfaenger] = position
+            schluessel.append(empfaenger)
+
+        zeitraum = periode(meta)
+        with self._gesperrt() as verbindung:
+            vergeben = dict(
+                verbindung.execute(
+                    "SELECT empfaenger, nummer FROM nummern WHERE zeitraum = ?",
+                    (zeitraum,),
+                )
+            )
+            zeile = verbindung.execute(
+                "SELECT jahr FROM nummern WHERE zeitraum = ? LIMIT 1", (zeitraum,)
+            ).fetchone()
+            if zeile is not None:
+                meta.jahr_cur = zeile[0]
+            (hoechste,) = verbindung.execute(
+                "SELECT MAX(nummer) FROM nummern WHERE jahr = ?", (meta.jahr_cur,)
+            ).fetchone()
+            naechste = max(rechnungsnr, hoechste or 0) + 1
+
+            neu: list[tuple[str, str, int, int]] = []
+            for empfaenger in schluessel:
+                if empfaenger not in vergeben:
+                    vergeben[empfaenger] = naechste
+                    neu.append((zeitraum, empfaenger, meta.jahr_cur, naechste))
+                    naechste += 1
+            verbindung.executemany("INSERT INTO nummern VALUES (?, ?, ?, ?)", neu)
+        return [vergeben[empfaenger] for empfaenger in schluessel]
+
+
+def ist_hallenposten(posten: Posten) -> bool:
+    # Hall costs have the reduced VAT rate, training costs the full one
+    return posten.kostentyp.startswith("Hallenkosten")
+
+
+# One invoice of a run as handed to every sink.  neu is False for the unchanged
+# invoices of --incremental whose single file is kept.  posten and summen are
+# computed while the letter is built and None if no sink needs them.
+class Datensatz(NamedTuple):
+    ergebnis: Ergebnis
+    name: str
+    fragment: str
+    neu: bool
+    posten: list[Posten] | None
+    summen: Summen | None
+
+
+# Output of a run.  A sink receives all invoices in order between __enter__ and
+# __exit__, a failed run closes it with the error.  With braucht_posten the
+# records carry line items and totals.  The time spent in eintragen is reported
+# as phase.
+class Senke(abc.ABC):
+    phase = "senken"
+    braucht_posten = False
+
+    def __enter__(self) -> "Senke":
+        return self
+
+    def __exit__(self, typ: type[BaseException] | None, *_: object) -> None:
+        pass
+
+    @abc.abstractmethod
+    def eintragen(self, datensatz: Datensatz) -> None:
+        pass
+
+
+# Issued invoices of all periods in a SQLite file: letter, line items and totals
+# with indexes on number, recipient, email, child and period.  A run replaces the
+# invoices of its period in one transaction.
+class Archiv(Senke):
+    phase = "archiv"
+    braucht_posten = True
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS rechnungen (
+            id INTEGER PRIMARY KEY,
+            zeitraum TEXT NOT NULL,
+            jahr INTEGER NOT NULL,
+            nummer TEXT NOT NULL,
+            revision INTEGER NOT NULL,
+            aktuell INTEGER NOT NULL,
+            name TEXT NOT NULL COLLATE NOCASE,
+            email TEXT COLLATE NOCASE,
+            netto_cent INTEGER NOT NULL,
+            mwst_voll_cent INTEGER NOT NULL,
+            mwst_erm_cent INTEGER NOT NULL,
+            brutto_cent INTEGER NOT NULL,
+            tex TEXT NOT NULL,
+            erstellt TEXT NOT NULL,
+            UNIQUE (zeitraum, nummer, revision)
+        );
+        CREATE INDEX IF NOT EXISTS rechnungen_nummer ON rechnungen (nummer);
+        CREATE INDEX IF NOT EXISTS rechnungen_name ON rechnungen (name);
+        CREATE INDEX IF NOT EXISTS rechnungen_email ON rechnungen (email);
+        CREATE INDEX IF NOT EXISTS rechnungen_jahr ON rechnungen (jahr);
+        CREATE TABLE IF NOT EXISTS kinder (
+            rechnung INTEGER NOT NULL REFERENCES rechnungen (id) ON DELETE CASCADE,
+            name TEXT NOT NULL COLLATE NOCASE
+        );
+        CREATE INDEX IF NOT EXISTS kinder_name ON kinder (name);
+        CREATE INDEX IF NOT EXISTS kinder_rechnung ON kinder (rechnung);
+        CREATE TABLE IF NOT EXISTS posten (
+            rechnung INTEGER NOT NULL REFERENCES rechnungen (id) ON DELETE CASCADE,
+            position INTEGER NOT NULL,
+            kostentyp TEXT NOT NULL,
+            tag TEXT NOT NULL,
+            einheiten INTEGER NOT NULL,
+            stundenpreis_cent INTEGER NOT NULL,
+            teilnehmerzahl INTEGER NOT NULL,
+            dauer INTEGER NOT NULL,
+            preis_cent INTEGER NOT NULL,
+            foerderung_cent INTEGER NOT NULL,
+            gesamt_cent INTEGER NOT NULL,
+            PRIMARY KEY (rechnung, position)
+        );
+    """
+
+    def __init__(self, datei: str, meta: Metadaten) -> None:
+        self.datei = datei
+        self.meta = meta
+        self.zeitraum = periode(meta)
+        self.erstellt = datetime.datetime.now().isoformat(timespec="seconds")
+        self.verbindung: sqlite3.Connection | None = None
+
+    def __enter__(self) -> "Archiv":
+        self.verbindung = sqlite3.connect(
+            self.datei, isolation_level=None, check_same_thread=False
+        )
+        self.verbindung.execute("PRAGMA foreign_keys = ON")
+        self.verbindung.executescript(Archiv.SCHEMA)
+        self.verbindung.execute("BEGIN IMMEDIATE")
+        # Invoices of the period that this run does not issue again stay in the
+        # archive as superseded versions
+        self.verbindung.execute(
+            "UPDATE rechnungen SET aktuell = 0 WHERE zeitraum = ?", (self.zeitraum,)
+        )
+        return self
+
+    def __exit__(self, typ: type[BaseException] | None, *_: object) -> None:
+        assert self.verbindung is not None
+        try:
+            self.verbindung.execute("COMMIT" if typ is None else "ROLLBACK")
+        finally:
+            self.verbindung.close()
+            self.verbindung = None
+
+    def eintragen(self, datensatz: Datensatz) -> None:
+        assert self.verbindung is not None
+        assert datensatz.posten is not None and datensatz.summen is not None
+        ergebnis = datensatz.ergebnis
+        letzte = self.verbindung.execute(
+            "SELECT id, revision, email, tex FROM rechnungen WHERE zeitraum = ? AND"
+            " nummer = ? ORDER BY revision DESC LIMIT 1",
+            (self.zeitraum, datensatz.name),
+        ).fetchone()
+        if letzte is not None and letzte[2:] == (ergebnis.email, datensatz.fragment):
+            # Unchanged, the archived version stays the current one
+            self.verbindung.execute(
+                "UPDATE rechnungen SET aktuell = 1 WHERE id = ?", (letzte[0],)
+            )
+            return
+        rechnung = self.verbindung.execute(
+            "INSERT INTO rechnungen (zeitraum, jahr, nummer, revision, aktuell, name,"
+            " email, netto_cent, mwst_voll_cent, mwst_erm_cent, brutto_cent, tex,"
+            " erstellt) VALUES (?, ?, ?, ?, 1, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                self.zeitraum,
+                self.meta.jahr,
+                datensatz.name,
+                1 if letzte is None else letzte[1] + 1,
+                ergebnis.name,
+                ergebnis.email,
+                *datensatz.summen,
+                datensatz.fragment,
+                self.erstellt,
+            ),
+        ).lastrowid
+        self.verbindung.executemany(
+            "INSERT INTO kinder VALUES (?, ?)",
+            [(rechnung, kind) for kind in ergebnis.kinder],
+        )
+        self.verbindung.executemany(
+            "INSERT INTO posten VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (rechnung, position, *p)
+                for position, p in enumerate(datensatz.posten, start=1)
+            ],
+        )
+
+
+# Sink for one file with a header and a footer.  With vergleichen the file is
+# written next to the target and only replaces it if the content changed.
+class DateiSenke(Senke):
+    def __init__(
+        self, datei: str, vergleichen: bool = False, kopf: str = "", fuss: str = ""
+    ) -> None:
+        self.datei = datei
+        self.vergleichen = vergleichen
+        self.kopf = kopf
+        self.fuss = fuss
+        self.f: TextIO | None = None
+
+    def __enter__(self) -> "DateiSenke":
+        self.f = open(self.datei + (".tmp" if self.vergleichen else ""), "w")
+        self.f.write(self.kopf)
+        return self
+
+    def __exit__(self, typ: type[BaseException] | None, *_: object) -> None:
+        assert self.f is not None
+        try:
+            if typ is None:
+                self.f.write(self.fuss)
+        finally:
+            self.f.close()
+            self.f = None
+        if typ is None and self.vergleichen:
+            _ersetze_falls_geaendert(self.datei + ".tmp", self.datei)
+
+    def schreibe(self, text: str) -> None:
+        assert self.f is not None
+        self.f.write(text)
+
+
+class TexSenke(DateiSenke):
+    # All letters in one document
+    phase = "tex"
+
+    def __init__(self, datei: str, vergleichen: bool = False) -> None:
+        super().__init__(datei, vergleichen, DOKUMENT_ANFANG, DOKUMENT_ENDE)
+
+    def eintragen(self, datensatz: Datensatz) -> None:
+        self.schreibe(datensatz.fragment)
+
+
+class EinzelTexSenke(Senke):
+    # One document per invoice, unchanged invoices of --incremental are kept
+    phase = "tex"
+
+    def __init__(self, ordner: str) -> None:
+        self.ordner = ordner
+
+    def eintragen(self, datensatz: Datensatz) -> None:
+        if not datensatz.neu:
+            return
+        with open(os.path.join(self.ordner, datensatz.name + ".tex"), "w") as f:
+            f.write(DOKUMENT_ANFANG)
+            f.write(datensatz.fragment)
+            f.write(DOKUMENT_ENDE)
+
+
+class OhneMailSenke(DateiSenke):
+    # nomail.txt with the PDF files of the invoices without email
+    phase = "mails"
+
+    def __init__(self, ordner: str, vergleichen: bool = False) -> None:
+        super().__init__(os.path.join(ordner, "nomail.txt"), vergleichen)
+
+    def eintragen(self, datensatz: Datensatz) -> None:
+        if datensatz.ergebnis.mail is None:
+            self.schreibe(datensatz.name + ".pdf\n")
+
+
+class MailSenke(DateiSenke):
+    # mails.csv for the invoices with email, nomail.txt lists the PDF files of
+    # the others.  Without eintraege both lists stay empty, e.g. for --nosingle
+    # which has no PDF files to attach.
+    phase = "mails"
+
+    def __init__(
+        self, ordner: str, vergleichen: bool = False, eintraege: bool = True
+    ) -> None:
+        super().__init__(
+            os.path.join(ordner, "mails.csv"), vergleichen, get_mail_header()
+        )
+        self.ohne_mail = OhneMailSenke(ordner, vergleichen)
+        self.eintraege = eintraege
+
+    def __enter__(self) -> "MailSenke":
+        super().__enter__()
+        try:
+            self.ohne_mail.__enter__()
+        except BaseException as e:
+            super().__exit__(type(e))
+            raise
+        return self
+
+    def __exit__(self, typ: type[BaseException] | None, *rest: object) -> None:
+        try:
+            super().__exit__(typ, *rest)
+        finally:
+            self.ohne_mail.__exit__(typ, *rest)
+
+    def eintragen(self, datensatz: Datensatz) -> None:
+        if not self.eintraege:
+            return
+        if datensatz.ergebnis.mail is not None:
+            self.schreibe(datensatz.ergebnis.mail)
+        else:
+            self.ohne_mail.eintragen(datensatz)
+
+
+class JsonSenke(DateiSenke):
+    # One JSON object per line with recipient, line items and totals in cents
+    phase = "jsonl"
+    braucht_posten = True
+
+    def __init__(self, datei: str, meta: Metadaten) -> None:
+        super().__init__(datei)
+        self.zeitraum = periode(meta)
+
+    def eintragen(self, datensatz: Datensatz) -> None:
+        assert datensatz.posten is not None and datensatz.summen is not None
+        ergebnis = datensatz.ergebnis
+        eintrag = {
+            "zeitraum": self.zeitraum,
+            "nummer": datensatz.name,
+            "name": ergebnis.name,
+            "email": ergebnis.email,
+            "kinder": ergebnis.kinder,
+            "posten": [p._asdict() for p in datensatz.posten],
+            **datensatz.summen._asdict(),
+        }
+        self.schreibe(json.dumps(eintrag, ensure_ascii=False) + "\n")
+
+
+class BuchhaltungSenke(DateiSenke):
+    # One line per invoice with net amount and tax for each rate, hall costs have
+    # the reduced rate
+    phase = "buchhaltung"
+    braucht_posten = True
+
+    def __init__(self, datei: str, meta: Metadaten) -> None:
+        super().__init__(
+            datei,
+            kopf=(
+                f"Belegnummer;Zeitraum;Name;Netto {MWST_VOLL_PROZENT}%;MwSt"
+                f" {MWST_VOLL_PROZENT}%;Netto {MWST_ERM_PROZENT}%;MwSt"
+                f" {MWST_ERM_PROZENT}%;Brutto\n"
+            ),
+        )
+        self.zeitraum = periode(meta)
+
+    def eintragen(self, datensatz: Datensatz) -> None:
+        assert datensatz.posten is not None and datensatz.summen is not None
+        summen = datensatz.summen
+        netto_erm = sum(p.gesamt_cent for p in datensatz.posten if ist_hallenposten(p))
+        self.schreibe(
+            ";".join(
+                [datensatz.name, self.zeitraum, datensatz.ergebnis.name]
+                + [
+                    _format_betrag(betrag)
+                    for betrag in [
+                        summen.netto_cent - netto_erm,
+                        summen.mwst_voll_cent,
+                        netto_erm,
+                        summen.mwst_erm_cent,
+                        summen.brutto_cent,
+                    ]
+                ]
+            )
+            + "\n"
+        )
+
+
+# Recipient types for --report by the first word of the name
+EMPFAENGERTYPEN = ("Familie", "Frau", "Herr")
+
+
+def _tag_reihenfolge(tag: str) -> tuple[int, str]:
+    # Weekdays in calendar order, other days with explicit hall units after them
+    return (WOCHENTAGE_DIC.get(tag, len(WOCHENTAGE_DIC)), tag)
+
+
+# Totals of a run for --report: revenue by VAT rate, funding by weekday and
+# duration, hall units by weekday and invoices by recipient type.  Memory only
+# grows with the number of groups.  Written as JSON if the file name ends in
+# .json and as CSV otherwise, a summary goes to stderr.
+class BerichtSenke(Senke):
+    phase = "bericht"
+    braucht_posten = True
+
+    def __init__(self, datei: str, meta: Metadaten) -> None:
+        self.datei = datei
+        self.zeitraum = periode(meta)
+        self.rechnungen = 0
+        self.umsatz = dict.fromkeys(
+            [
+                "netto_voll_cent",
+                "mwst_voll_cent",
+                "netto_erm_cent",
+                "mwst_erm_cent",
+                "brutto_cent",
+            ],
+            0,
+        )
+        # Participants and funding, hall units and net hall costs, invoices and
+        # gross totals
+        self.foerderung: dict[tuple[str, int], list[int]] = collections.defaultdict(
+            lambda: [0, 0]
+        )
+        self.halle: dict[str, list[int]] = collections.defaultdict(lambda: [0, 0])
+        self.empfaenger: dict[str, list[int]] = collections.defaultdict(lambda: [0, 0])
+
+    def eintragen(self, datensatz: Datensatz) -> None:
+        assert datensatz.posten is not None and datensatz.summen is not None
+        summen = datensatz.summen
+        netto_erm = 0
+        for p in datensatz.posten:
+            if ist_hallenposten(p):
+                halle = self.halle[p.tag]
+                halle[0] += p.einheiten
+                halle[1] += p.gesamt_cent
+                netto_erm += p.gesamt_cent
+            else:
+                foerderung = self.foerderung[(p.tag, p.dauer)]
+                foerderung[0] += 1
+                foerderung[1] += p.foerderung_cent
+        self.rechnungen += 1
+        self.umsatz["netto_voll_cent"] += summen.netto_cent - netto_erm
+        self.umsatz["mwst_voll_cent"] += summen.mwst_voll_cent
+        self.umsatz["netto_erm_cent"] += netto_erm
+        self.umsatz["mwst_erm_cent"] += summen.mwst_erm_cent
+        self.umsatz["brutto_cent"] += summen.brutto_cent
+        typ = datensatz.ergebnis.name.split(" ", 1)[0]
+        empfaenger = self.empfaenger[typ if typ in EMPFAENGERTYPEN else "Sonstige"]
+        empfaenger[0] += 1
+        empfaenger[1] += summen.brutto_cent
+
+    def bericht(self) -> dict[str, object]:
+        return {
+            "zeitraum": self.zeitraum,
+            "rechnungen": self.rechnungen,
+            "umsatz": self.umsatz,
+            "foerderung": [
+                {"tag": tag, "dauer": dauer, "teilnehmer": anzahl, "netto_cent": cent}
+                for (tag, dauer), (anzahl, cent) in sorted(
+                    self.foerderung.items(),
+                    key=lambda eintrag: (
+                        _tag_reihenfolge(eintrag[0][0]),
+                        eintrag[0][1],
+                    ),
+                )
+            ],
+            "halle": [
+                {"tag": tag, "einheiten": einheiten, "netto_cent": cent}
+                for tag, (einheiten, cent) in sorted(
+                    self.halle.items(), key=lambda eintrag: _tag_reihenfolge(eintrag[0])
+                )
+            ],
+            "empfaenger": [
+                {"typ": typ, "rechnungen": anzahl, "brutto_cent": cent}
+                for typ, (anzahl, cent) in sorted(self.empfaenger.items())
+            ],
+        }
+
+    def _csv(self) -> str:
+        umsatz = self.umsatz
+        zeilen: list[tuple[str, str, object, int]] = [
+            ("Umsatz", f"Netto {MWST_VOLL_PROZENT}%", "", umsatz["netto_voll_cent"]),
+            ("Umsatz", f"MwSt {MWST_VOLL_PROZENT}%", "", umsatz["mwst_voll_cent"]),
+            ("Umsatz", f"Netto {MWST_ERM_PROZENT}%", "", umsatz["netto_erm_cent"]),
+            ("Umsatz", f"MwSt {MWST_ERM_PROZENT}%", "", umsatz["mwst_erm_cent"]),
+            ("Umsatz", "Brutto", self.rechnungen, umsatz["brutto_cent"]),
+        ]
+        for (tag, dauer), (anzahl, cent) in sorted(
+            self.foerderung.items(),
+            key=lambda eintrag: (_tag_reihenfolge(eintrag[0][0]), eintrag[0][1]),
+        ):
+            zeilen.append(("Förderung", f"{tag} {dauer} Minuten", anzahl, cent))
+        for tag, (einheiten, cent) in sorted(
+            self.halle.items(), key=lambda eintrag: _tag_reihenfolge(eintrag[0])
+        ):
+            zeilen.append(("Halle", tag, einheiten, cent))
+        for typ, (anzahl, cent) in sorted(self.empfaenger.items()):
+            zeilen.append(("Empfänger", typ, anzahl, cent))
+        return "Bereich;Schlüssel;Anzahl;Betrag\n" + "".join(
+            f"{bereich};{schluessel};{anzahl};{_format_betrag(cent)}\n"
+            for bereich, schluessel, anzahl, cent in zeilen
+        )
+
+    def __exit__(self, typ: type[BaseException] | None, *_: object) -> None:
+        if typ is not None:
+            return
+        with open(self.datei, "w") as f:
+            if self.datei.endswith(".json"):
+                json.dump(self.bericht(), f, indent=1, ensure_ascii=False)
+            else:
+                f.write(self._csv())
+        umsatz = self.umsatz
+        print(
+            f"Bericht {self.zeitraum}: {self.rechnungen} Rechnungen, brutto"
+            f" {_format_betrag(umsatz['brutto_cent'])} EUR (netto"
+            f" {MWST_VOLL_PROZENT}% {_format_betrag(umsatz['netto_voll_cent'])},"
+            f" MwSt {_format_betrag(umsatz['mwst_voll_cent'])}; netto"
+            f" {MWST_ERM_PROZENT}% {_format_betrag(umsatz['netto_erm_cent'])}, MwSt"
+            f" {_format_betrag(umsatz['mwst_erm_cent'])}), Förderung"
+            f" {_format_betrag(sum(c for _, c in self.foerderung.values()))} EUR"
+            f" netto für {sum(a for a, _ in self.foerderung.values())} Teilnehmer,"
+            f" {sum(e for e, _ in self.halle.values())} Halleneinheiten",
+            file=sys.stderr,
+        )
+
+
+# Creditor of the direct debits from the optional block <lastschrift> of <data>
+class Glaeubiger(NamedTuple):
+    name: str
+    iban: str
+    bic: str | None
+    glaeubiger_id: str
+    faelligkeit: datetime.date
+
+    @classmethod
+    def aus_xml(cls, root: ET.Element) -> "Glaeubiger":
+        block = root.find("lastschrift")
+        if block is None:
+            raise TCSRechnungError("Block <lastschrift> in <data> fehlt")
+        felder = {elem.tag: elem.text for elem in reversed(block)}
+        glaeubiger_id = (
+            _feld_text(felder, "glaeubiger_id", "lastschrift").replace(" ", "").upper()
+        )
+        # The business code at positions 5 to 7 is not part of the check digits
+        if GLAEUBIGER_ID_RE.fullmatch(glaeubiger_id) is None or not _mod97(
+            glaeubiger_id[7:] + glaeubiger_id[:4]
+        ):
+            raise TCSRechnungError(
+                f"<glaeubiger_id>='{felder['glaeubiger_id']}' ist keine gültige"
+                " Gläubiger-Identifikationsnummer"
+            )
+        return cls(
+            _feld_text(felder, "name", "lastschrift"),
+            _feld_iban(felder, "iban", "lastschrift"),
+            _feld_bic(felder, "lastschrift"),
+            glaeubiger_id,
+            _feld_datum(felder, "faelligkeit", "lastschrift"),
+        )
+
+
+SEPA_NS = "urn:iso:std:iso:20022:tech:xsd:pain.008.001.02"
+SEPA_KOPF = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n<Document xmlns="'
+    + SEPA_NS
+    + '">\n'
+    + """ <CstmrDrctDbtInitn>
+  <GrpHdr>
+   <MsgId>%s</MsgId>
+   <CreDtTm>%s</CreDtTm>
+   <NbOfTxs>%d</NbOfTxs>
+   <CtrlSum>%s</CtrlSum>
+   <InitgPty><Nm>%s</Nm></InitgPty>
+  </GrpHdr>
+  <PmtInf>
+   <PmtInfId>%s</PmtInfId>
+   <PmtMtd>DD</PmtMtd>
+   <NbOfTxs>%d</NbOfTxs>
+   <CtrlSum>%s</CtrlSum>
+   <PmtTpInf>
+    <SvcLvl><Cd>SEPA</Cd></SvcLvl>
+    <LclInstrm><Cd>CORE</Cd></LclInstrm>
+    <SeqTp>RCUR</SeqTp>
+   </PmtTpInf>
+   <ReqdColltnDt>%s</ReqdColltnDt>
+   <Cdtr><Nm>%s</Nm></Cdtr>
+   <CdtrAcct><Id><IBAN>%s</IBAN></Id></CdtrAcct>
+   <CdtrAgt><FinInstnId>%s</FinInstnId></CdtrAgt>
+   <ChrgBr>SLEV</ChrgBr>
+   <CdtrSchmeId><Id><PrvtId><Othr>
+    <Id>%s</Id><SchmeNm><Prtry>SEPA</Prtry></SchmeNm>
+   </Othr></PrvtId></Id></CdtrSchmeId>
+"""
+)
+SEPA_BUCHUNG = """   <DrctDbtTxInf>
+    <PmtId><EndToEndId>%s</EndToEndId></PmtId>
+    <InstdAmt Ccy="EUR">%s</InstdAmt>
+    <DrctDbtTx><MndtRltdInf>
+     <MndtId>%s</MndtId><DtOfSgntr>%s</DtOfSgntr>
+    </MndtRltdInf></DrctDbtTx>
+    <DbtrAgt><FinInstnId>%s</FinInstnId></DbtrAgt>
+    <Dbtr><Nm>%s</Nm></Dbtr>
+    <DbtrAcct><Id><IBAN>%s</IBAN></Id></DbtrAcct>
+    <RmtInf><Ustrd>%s</Ustrd></RmtInf>
+   </DrctDbtTxInf>
+"""
+SEPA_ENDE = "  </PmtInf>\n </CstmrDrctDbtInitn>\n</Document>\n"
+
+
+def _sepa_betrag(cent: int) -> str:
+    return "%d.%02d" % divmod(cent, 100)
+
+
+def _sepa_cent(betrag: str) -> int:
+    # Inverse of _sepa_betrag, also for amounts with one or no decimal
+    euro, _, cent = betrag.partition(".")
+    return int(euro) * 100 + int(cent.ljust(2, "0"))
+
+
+def _sepa_bank(bic: str | None) -> str:
+    if bic is None:
+        return "<Othr><Id>NOTPROVIDED</Id></Othr>"
+    return f"<BIC>{bic}</BIC>"
+
+
+def _sepa_text(text: str, laenge: int) -> str:
+    return xml.sax.saxutils.escape(text[:laenge])
+
+
+def pruefe_sepa(datei: str) -> tuple[int, int]:
+    # Number and sum in cents of the direct debits of a pain.008 file, streamed
+    # so that large files are not held in memory.  Raises if the numbers and
+    # control sums in the group header or the payment block do not match the
+    # transactions.
+    def tag(name: str) -> str:
+        return "{" + SEPA_NS + "}" + name
+
+    anzahl = 0
+    summe = 0
+    angaben: list[tuple[str, int, int]] = []
+    for _, elem in ET.iterparse(datei):
+        if elem.tag == tag("InstdAmt"):
+            summe += _sepa_cent(elem.text or "")
+        elif elem.tag == tag("DrctDbtTxInf"):
+            anzahl += 1
+            elem.clear()
+        elif elem.tag in (tag("GrpHdr"), tag("PmtInf")):
+            angaben.append(
+                (
+                    elem.tag.rsplit("}", 1)[1],
+                    int(elem.findtext(tag("NbOfTxs")) or -1),
+                    _sepa_cent(elem.findtext(tag("CtrlSum")) or "-1"),
+                )
+            )
+    if len(angaben) != 2:
+        raise TCSRechnungError(f"{datei}: <GrpHdr> oder <PmtInf> fehlt")
+    for block, nb_of_txs, ctrl_sum in angaben:
+        if (nb_of_txs, ctrl_sum) != (anzahl, summe):
+            raise TCSRechnungError(
+                f"{datei}: <{block}> gibt {nb_of_txs} Lastschriften über"
+                f" {_sepa_betrag(ctrl_sum)} EUR an, enthalten sind {anzahl} über"
+                f" {_sepa_betrag(summe)} EUR"
+            )
+    return anzahl, summe
+
+
+# SEPA direct debits (pain.008) for all invoices with a mandate and a positive
+# total, at most max_buchungen per file.  The number and the control sum precede
+# the transactions, so the transactions of a file go to a temporary file first
+# and are copied behind the header when the file is complete.  Every file is
+# checked by pruefe_sepa and all files only replace the previous ones of the
+# period after the whole run succeeded.
+class SepaSenke(Senke):
+    phase = "sepa"
+    braucht_posten = True
+
+    def __init__(
+        self,
+        ordner: str,
+        meta: Metadaten,
+        glaeubiger: Glaeubiger,
+        max_buchungen: int = SEPA_BUCHUNGEN,
+    ) -> None:
+        if max_buchungen < 1:
+            raise TCSRechnungError("Mindestens eine Lastschrift je Datei")
+        self.ordner = ordner
+        self.meta = meta
+        self.glaeubiger = glaeubiger
+        self.max_buchungen = max_buchungen
+        self.zeitraum = periode(meta)
+        erstellt = datetime.datetime.now()
+        self.erstellt = erstellt.isoformat(timespec="seconds")
+        # MsgId and PmtInfId must differ between runs and may not contain "_"
+        self.lauf = "TCS-" + erstellt.strftime("%Y%m%d%H%M%S%f")
+        self.dateien: list[str] = []
+        self.f: TextIO | None = None
+        self.buchungen: str | None = None
+        self.anzahl = 0
+        self.summe = 0
+        self.gesamt_anzahl = 0
+        self.gesamt_summe = 0
+
+    def __enter__(self) -> "SepaSenke":
+        os.makedirs(self.ordner, exist_ok=True)
+        return self
+
+    def _name(self, teil: int) -> str:
+        return os.path.join(
+            self.ordner, f"lastschriften_{self.zeitraum}_{teil:03d}.xml"
+        )
+
+    def eintragen(self, datensatz: Datensatz) -> None:
+        mandat = datensatz.ergebnis.mandat
+        assert datensatz.summen is not None
+        betrag = datensatz.summen.brutto_cent
+        if mandat is None or betrag <= 0:
+            return
+        if self.f is None:
+            self.buchungen = self._name(len(self.dateien) + 1) + ".buchungen"
+            self.f = open(self.buchungen, "w", encoding="utf-8")
+        self.f.write(
+            SEPA_BUCHUNG
+            % (
+                datensatz.name.replace("_", "-"),
+                _sepa_betrag(betrag),
+                _sepa_text(mandat.referenz, 35),
+                mandat.datum.isoformat(),
+                _sepa_bank(mandat.bic),
+                _sepa_text(mandat.kontoinhaber, 70),
+                mandat.iban,
+                _sepa_text(
+                    f"Rechnung {self.meta.jahr_cur - 2000}"
+                    f"/{datensatz.ergebnis.rechnungsnr:04d} {self.meta.von_monat}"
+                    f" bis {self.meta.bis_monat} {self.meta.bis_jahr}",
+                    140,
+                ),
+            )
+        )
+        self.anzahl += 1
+        self.summe += betrag
+        if self.anzahl == self.max_buchungen:
+            self._schliesse_datei()
+
+    def _schliesse_datei(self) -> None:
+        assert self.f is not None and self.buchungen is not None
+        self.f.close()
+        self.f = None
+        teil = len(self.dateien) + 1
+        kennung = f"{self.lauf}-{teil:03d}"
+        ziel = self._name(teil) + ".tmp"
+        self.dateien.append(ziel)
+        glaeubiger = self.glaeubiger
+        with open(ziel, "w", encoding="utf-8") as f, open(
+            self.buchungen, encoding="utf-8"
+        ) as buchungen:
+            f.write(
+                SEPA_KOPF
+                % (
+                    kennung,
+                    self.erstellt,
+                    self.anzahl,
+                    _sepa_betrag(self.summe),
+                    _sepa_text(glaeubiger.name, 70),
+                    kennung,
+                    self.anzahl,
+                    _sepa_betrag(self.summe),
+                    glaeubiger.faelligkeit.isoformat(),
+                    _sepa_text(glaeubiger.name, 70),
+                    glaeubiger.iban,
+                    _sepa_bank(glaeubiger.bic),
+                    glaeubiger.glaeubiger_id,
+                )
+            )
+            shutil.copyfileobj(buchungen, f)
+            f.write(SEPA_ENDE)
+        os.remove(self.buchungen)
+        self.buchungen = None
+        # The file as written must agree with the totals of the invoices
+        if pruefe_sepa(ziel) != (self.anzahl, self.summe):
+            raise TCSRechnungError(
+                f"{ziel}: Anzahl oder Summe der Lastschriften weicht von den Rechnungen"
+                " ab"
+            )
+        self.gesamt_anzahl += self.anzahl
+        self.gesamt_summe += self.summe
+        self.anzahl = 0
+        self.summe = 0
+
+    def __exit__(self, typ: type[BaseException] | None, *_: object) -> None:
+        fertig = False
+        try:
+            if typ is None:
+                if self.f is not None:
+                    self._schliesse_datei()
+                self._ersetze()
+                fertig = True
+        finally:
+            if not fertig:
+                self._verwerfe()
+
+    def _ersetze(self) -> None:
+        alt = set(
+            glob.glob(
+                os.path.join(
+                    glob.escape(self.ordner),
+                    f"lastschriften_{self.zeitraum}_[0-9][0-9][0-9].xml",
+                )
+            )
+        )
+        for datei in self.dateien:
+            os.replace(datei, datei[: -len(".tmp")])
+            alt.discard(datei[: -len(".tmp")])
+        for datei in alt:
+            os.remove(datei)
+        print(
+            f"{self.gesamt_anzahl} Lastschriften über"
+            f" {_sepa_betrag(self.gesamt_summe)} EUR in {len(self.dateien)} Dateien"
+        )
+
+    def _verwerfe(self) -> None:
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+        for datei in self.dateien + [self.buchungen or ""]:
+            if os.path.exists(datei):
+                os.remove(datei)
+
+
+# Feeds the invoices of a run to all sinks in one pass.  With threads every sink
+# writes on its own thread behind a bounded queue, in the order of the invoices
+# and in packets of PAKETGROESSE to keep the overhead of the queues low.  The
+# first error of a sink is raised in the main thread and all sinks are closed
+# with it.
+class Senken:
+    def __init__(
+        self,
+        senken: Sequence[Senke],
+        zeitmessung: Zeitmessung | None = None,
+        threads: bool = False,
+    ) -> None:
+        self.senken = senken
+        self.zeitmessung = zeitmessung
+        self.threads = threads
+        self.braucht_posten = any(senke.braucht_posten for senke in senken)
+        self.sekunden = [0.0] * len(senken)
+        self.paket: list[Datensatz] = []
+        self.schlangen: list[queue.Queue[list[Datensatz] | None]] = []
+        self.arbeiter: list[threading.Thread] = []
+        self.fehler: BaseException | None = None
+        self.stapel = contextlib.ExitStack()
+
+    def __enter__(self) -> "Senken":
+        with contextlib.ExitStack() as stapel:
+            for senke in self.senken:
+                stapel.enter_context(senke)
+            self.stapel = stapel.pop_all()
+        if self.threads:
+            for i in range(len(self.senken)):
+                schlange: queue.Queue[list[Datensatz] | None] = queue.Queue(
+                    SENKEN_PUFFER
+                )
+                arbeiter = threading.Thread(
+                    target=self._arbeite, args=(i, schlange), daemon=True
+                )
+                arbeiter.start()
+                self.schlangen.append(schlange)
+                self.arbeiter.append(arbeiter)
+        return self
+
+    def __exit__(
+        self,
+        typ: type[BaseException] | None,
+        wert: BaseException | None,
+        verlauf: object,
+    ) -> None:
+        # The threads write all queued invoices before the sinks are closed
+        if self.paket and typ is None:
+            self._verteile()
+        for schlange in self.schlangen:
+            schlange.put(None)
+        for arbeiter in self.arbeiter:
+            arbeiter.join()
+        if self.zeitmessung is not None:
+            for senke, sekunden in zip(self.senken, self.sekunden):
+                self.zeitmessung.phasen[senke.phase] += sekunden
+        if typ is None and self.fehler is not None:
+            wert = self.fehler
+        if wert is None:
+            self.stapel.close()
+            return
+        self.stapel.__exit__(type(wert), wert, wert.__traceback__)
+        if typ is None:
+            raise wert
+
+    def _schreibe(self, i: int, datensatz: Datensatz) -> None:
+        start = time.perf_counter()
+        self.senken[i].eintragen(datensatz)
+        self.sekunden[i] += time.perf_counter() - start
+
+    def _arbeite(self, i: int, schlange: queue.Queue[list[Datensatz] | None]) -> None:
+        # After an error the queue is still drained so that the main thread is not
+        # blocked
+        while (paket := schlange.get()) is not None:
+            try:
+                for datensatz in paket:
+                    if self.fehler is not None:
+                        break
+                    self._schreibe(i, datensatz)
+            except BaseException as e:
+                self.fehler = e
+
+    def _verteile(self) -> None:
+        for schlange in self.schlangen:
+            schlange.put(self.paket)
+        self.paket = []
+
+    def eintragen(self, datensatz: Datensatz) -> None:
+        if not self.threads:
+            for i in range(len(self.senken)):
+                self._schreibe(i, datensatz)
+            return
+        if self.fehler is not None:
+            raise self.fehler
+        self.paket.append(datensatz)
+        if len(self.paket) >= PAKETGROESSE:
+            self._verteile()
+
+
+def pruefe_rechnung(
+    rechnung: ET.Element, position: int, meta: Metadaten
+) -> tuple[list[str], Rechnung]:
+    # All errors that loading and rendering the invoice would raise instead of
+    # only the first one.  The returned Rechnung holds the valid parts only.
+    felder = {elem.tag: elem.text for elem in reversed(rechnung)}
+    ort = f"Rechnung {position} '{felder.get('name') or ''}'"
+    fehler = []
+    for feld in ["name", "strasse", "ort"]:
+        try:
+            _feld_text(felder, feld, "rechnung")
+        except TCSRechnungError as e:
+            fehler.append(f"{ort}: {e}")
+    mandat = None
+    try:
+        mandat = Mandat.aus_felder(felder)
+    except TCSRechnungError as e:
+        fehler.append(f"{ort}: {e}")
+
+    kinder = []
+    for kind in rechnung.findall("kind"):
+        kind_name = kind.findtext("name") or ""
+        if not kind_name:
+            fehler.append(f"{ort}: Element <name> in Block <kind> fehlt oder ist leer")
+        trainings = []
+        for index, elem in enumerate(kind.findall("training"), 1):
+            kontext = f"{ort}, Kind '{kind_name}', Training {index}"
+            try:
+                training = Training.aus_xml(elem)
+                POSTEN_CACHE.posten(erstelle_posten, training, meta, [], [])
+                POSTEN_CACHE.posten(erstelle_hallenposten, training, meta, [], [])
+            except TCSRechnungError as e:
+                fehler.append(f"{kontext}: {e}")
+                continue
+            trainings.append(training)
+        kinder.append(Kind(kind_name, trainings))
+    return fehler, Rechnung(
+        felder.get("name") or "",
+        felder.get("strasse") or "",
+        felder.get("ort") or "",
+        felder.get("email"),
+        kinder,
+        mandat,
+    )
+
+
+def _pruefe_paket(
+    meta: Metadaten, paket: list[tuple[int, ET.Element]]
+) -> list[tuple[list[str], Rechnung]]:
+    return [pruefe_rechnung(rechnung, position, meta) for position, rechnung in paket]
+
+
+def _pruefe_paket_im_worker(
+    paket: list[tuple[int, ET.Element]],
+) -> list[tuple[list[str], Rechnung]]:
+    assert _worker_meta is not None
+    return _pruefe_paket(_worker_meta, paket)
+
+
+def _pruefe_alle(
+    rechnungen: Iterable[ET.Element], meta: Metadaten, jobs: int
+) -> Iterator[tuple[list[str], Rechnung]]:
+    # Same packet scheme as rendere_rechnungen, results in input order
+    positionen = enumerate(rechnungen, 1)
+    if jobs <= 1:
+        for position, rechnung in positionen:
+            yield pruefe_rechnung(rechnung, position, meta)
+        return
+
+    with ProcessPoolExecutor(
+        max_workers=jobs, initializer=_starte_worker, initargs=(meta,)
+    ) as pool:
+        offen: collections.deque[Future[list[tuple[list[str], Rechnung]]]] = (
+            collections.deque()
+        )
+        while paket := list(itertools.islice(positionen, PAKETGROESSE)):
+            offen.append(pool.submit(_pruefe_paket_im_worker, paket))
+            if len(offen) >= 2 * jobs:
+                yield from offen.popleft().result()
+        while offen:
+            yield from offen.popleft().result()
+
+
+def pruefe_eingabe(eingabedatei: str, stream: bool = False, jobs: int = 1) -> None:
+    # --check: validates every invoice without writing anything and prints all
+    # errors.  Raises a TCSRechnungError with a summary if there were any.
+    root, rechnungen = lade_eingabe(eingabedatei, stream)
+    meta = Metadaten(root)
+
+    anzahl = 0
+    fehlerhaft = 0
+    alle_fehler = 0
+    empfaenger: dict[str, int] = {}
+    emails: dict[str, int] = {}
+    gruppen = Gruppenindex()
+    for position, (fehler, rechnung) in enumerate(
+        _pruefe_alle(rechnungen, meta, jobs), 1
+    ):
+        anzahl += 1
+        ort = f"Rechnung {position} '{rechnung.name}'"
+        schluessel = empfaenger_schluessel(
+            rechnung.name, rechnung.strasse, rechnung.ort
+        )
+        if schluessel in empfaenger:
+            fehler.append(
+                f"{ort}: Gleicher Empfänger wie Rechnung {empfaenger[schluessel]}"
+            )
+        else:
+            empfaenger[schluessel] = position
+        if rechnung.email is not None:
+            email = rechnung.email.strip().lower()
+            if email in emails:
+                fehler.append(
+                    f"{ort}: Email {rechnung.email} schon in Rechnung {emails[email]}"
+                )
+            else:
+                emails[email] = position
+        gruppen.hinzufuegen(rechnung)
+
+        if fehler:
+            fehlerhaft += 1
+            alle_fehler += len(fehler)
+            for meldung in fehler:
+                print(meldung, file=sys.stderr)
+
+    for meldung in gruppen.fehler():
+        print("Warnung: " + meldung, file=sys.stderr)
+    if alle_fehler:
+        raise TCSRechnungError(
+            f"{alle_fehler} Fehler in {fehlerhaft} von {anzahl} Rechnungen"
+        )
+    print(f"{anzahl} Rechnungen geprüft, keine Fehler")
+
+
+def _lese_fragment(texfile: str) -> str:
+    with open(texfile) as f:
+        inhalt = f.read()
+    if not inhalt.startswith(DOKUMENT_ANFANG) or not inhalt.endswith(DOKUMENT_ENDE):
+        raise TCSRechnungError(f"{texfile} hat ein unerwartetes Format")
+    return inhalt[len(DOKUMENT_ANFANG) : -len(DOKUMENT_ENDE)]
+
+
+def _ersetze_falls_geaendert(tmpfile: str, ziel: str) -> None:
+    # Keeps the modification time of unchanged files for the compile stage
+    if os.path.exists(ziel) and filecmp.cmp(tmpfile, ziel, shallow=False):
+        os.remove(tmpfile)
+    else:
+        os.replace(tmpfile, ziel)
+
+
+# State of --watch: the rendered letters, mail lines and input hashes of all
+# invoices of the last pass.  A pass only renders the invoices whose <rechnung>
+# block, number or metadata changed and only replaces files whose content
+# changed, so tcscompile.veraltet() finds exactly the PDFs to rebuild.
+class Beobachter:
+    def __init__(
+        self,
+        eingabedatei: str,
+        output: str,
+        mails: str,
+        jobs: int = 1,
+        pdfdir: str | None = None,
+        builddir: str = "tmp",
+        fmt: tuple[str, str] | None = None,
+    ) -> None:
+        self.eingabedatei = eingabedatei
+        self.output = output
+        self.mails = mails
+        self.jobs = jobs
+        self.pdfdir = pdfdir
+        self.builddir = builddir
+        self.fmt = fmt
+        self.fingerprint: str | None = None
+        self.hashes: dict[str, bytes] = {}
+        self.fragmente: dict[str, str] = {}
+        self.mailzeilen: dict[str, str | None] = {}
+        os.makedirs(output, exist_ok=True)
+        os.makedirs(mails, exist_ok=True)
+
+    def aktualisiere(self) -> list[str]:
+        # One pass over the input file, returns the names of the invoices that
+        # were rendered again
+        root, rechnungen = lade_eingabe(self.eingabedatei)
+        meta = Metadaten(root)
+        if meta.fingerprint() != self.fingerprint:
+            self.fingerprint = meta.fingerprint()
+            self.hashes = {}
+
+        hashes: dict[str, bytes] = {}
+
+        def unveraendert(rechnungsnr: int, rechnung: ET.Element) -> bool:
+            # Tags and stripped texts in document order, much faster than
+            # ET.tostring and also ignoring indentation
+            name = rechnungsname(meta, rechnungsnr)
+            inhalt = "\0".join(
+                elem.tag + "\1" + (elem.text or "").strip() for elem in rechnung.iter()
+            )
+            hashes[name] = hashlib.sha256(inhalt.encode()).digest()
+            return self.hashes.get(name) == hashes[name]
+
+        namen = []
+        neu = []
+        fragmente: dict[str, str] = {}
+        mailzeilen: dict[str, str | None] = {}
+        for ergebnis in rendere_rechnungen(
+            rechnungen,
+            meta,
+            _get_int(root, "rechnungsnummer"),
+            self.jobs,
+            unveraendert,
+        ):
+            name = rechnungsname(meta, ergebnis.rechnungsnr)
+            namen.append(name)
+            mailzeilen[name] = ergebnis.mail
+            if ergebnis.output is None:
+                fragmente[name] = self.fragmente[name]
+                continue
+            fragmente[name] = ergebnis.output
+            neu.append(name)
+            texfile = os.path.join(self.output, name + ".tex")
+            with open(texfile + ".tmp", "w") as f:
+                f.write(DOKUMENT_ANFANG + ergebnis.output + DOKUMENT_ENDE)
+            _ersetze_falls_geaendert(texfile + ".tmp", texfile)
+
+        for name in set(self.fragmente) - set(fragmente):
+            dateien = [os.path.join(self.output, name + ".tex")]
+            if self.pdfdir is not None:
+                dateien.append(os.path.join(self.pdfdir, name + ".pdf"))
+            for datei in dateien:
+                if os.path.exists(datei):
+                    os.remove(datei)
+        self.hashes = hashes
+        self.fragmente = fragmente
+        self.mailzeilen = mailzeilen
+        self._schreibe_sammeldateien(meta, namen)
+        if self.pdfdir is not None:
+            self._kompiliere(namen)
+        return neu
+
+    def _schreibe_sammeldateien(self, meta: Metadaten, namen: list[str]) -> None:
+        # Same content as written by run(), only replaced if changed
+        texfile_all = os.path.join(self.output, gesamtname(meta) + ".tex")
+        filename_mail = os.path.join(self.mails, "mails.csv")
+        filename_nomail = os.path.join(self.mails, "nomail.txt")
+        with open(texfile_all + ".tmp", "w") as f_tex_all, open(
+            filename_mail + ".tmp", "w"
+        ) as f_mail, open(filename_nomail + ".tmp", "w") as f_nomail:
+            f_tex_all.write(DOKUMENT_ANFANG)
+            f_mail.write(get_mail_header())
+            for name in namen:
+                f_tex_all.write(self.fragmente[name])
+                mail = self.mailzeilen[name]
+                if mail is not None:
+                    f_mail.write(mail)
+                else:
+                    f_nomail.write(name + ".pdf\n")
+            f_tex_all.write(DOKUMENT_ENDE)
+        for ziel in [texfile_all, filename_mail, filename_nomail]:
+            _ersetze_falls_geaendert(ziel + ".tmp", ziel)
+
+    def _kompiliere(self, namen: list[str]) -> None:
+        import tcscompile
+
+        assert self.pdfdir is not None
+        texfiles = tcscompile.veraltet(
+            [os.path.join(self.output, name + ".tex") for name in namen], self.pdfdir
+        )
+        fehler = tcscompile.kompiliere(
+            texfiles, self.pdfdir, self.builddir, self.jobs, self.fmt
+        )
+        for name, log in sorted(fehler.items()):
+            print(f"Fehler beim Erstellen von {name}.pdf:\n{log}\n", file=sys.stderr)
+
+
+def beobachte(
+    beobachter: Beobachter, intervall: float = 0.5, runden: int | None = None
+) -> None:
+    # --watch: polls the modification time of the input file and runs a pass of
+    # beobachter after every change.  Errors in the file are reported and the
+    # next change is awaited.  runden limits the number of polls for tests.
+    stand = None
+    while runden is None or runden > 0:
+        if runden is not None:
+            runden -= 1
+        try:
+            info = os.stat(beobachter.eingabedatei)
+        except FileNotFoundError:
+            # Editors that save by renaming briefly remove the file
+            info = None
+        if info is not None and (info.st_mtime_ns, info.st_size) != stand:
+            stand = (info.st_mtime_ns, info.st_size)
+            start = time.perf_counter()
+            try:
+                neu = beobachter.aktualisiere()
+            except (TCSRechnungError, ET.ParseError) as e:
+                print(f"Fehler: {e}", file=sys.stderr)
+            else:
+                print(
+                    f"{len(neu)} von {len(beobachter.fragmente)} Rechnungen neu"
+                    f" erstellt in {time.perf_counter() - start:.2f} s"
+                )
+        time.sleep(intervall)
+
+
+def run(argv: list[str] | None = None) -> None:
     parser = argparse.ArgumentParser(
         prog="tcsrechnung", description="Erstelle LaTeX Datei für TCS Rechnungen"
     )
@@ -466,70 +2778,314 @@ def run() -> None:
     parser.add_argument(
         "-o",
         "--output",
-        required=True,
         help="Ausgabeordner für Rechnungen im tex format ",
     )
-    parser.add_argument("-m", "--mails", required=True, help="Ausgabeordner für Emails")
+    parser.add_argument("-m", "--mails", help="Ausgabeordner für Emails")
     parser.add_argument(
         "--nosingle",
         action="store_true",
         help="Erstelle keine einzelnen Rechnungsdateien",
     )
-    args = parser.parse_args()
-
-    tree = ET.parse(args.eingabedatei)
-    root = tree.getroot()
-    if os.path.exists(args.output):
-        raise TCSRechnungError(f"{args.output} existiert bereits")
-    if os.path.exists(args.mails):
-        raise TCSRechnungError(f"{args.mails} existiert bereits")
-    os.makedirs(args.output)
-    os.makedirs(args.mails)
-    meta = Metadaten(root)
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help=(
+            "Lese Eingabedatei inkrementell (Kopfdaten müssen vor der ersten"
+            " <rechnung> stehen)"
+        ),
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Anzahl paralleler Prozesse für die Erstellung der Rechnungen",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help=(
+            "Aktualisiere bestehende Ausgabeordner und schreibe nur geänderte"
+            " Rechnungen neu"
+        ),
+    )
+    parser.add_argument(
+        "--timings",
+        metavar="DATEI",
+        help=(
+            "Schreibe Dauer der einzelnen Phasen, Speicherspitze und die"
+            " langsamsten Rechnungen als JSON (verlangsamt die Ausführung)"
+        ),
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="DATEI",
+        help="Schreibe ein cProfile Profil (mit --jobs nur der Hauptprozess)",
+    )
+    parser.add_argument(
+        "--vektor",
+        action="store_true",
+        help=(
+            "Berechne alle Beträge gemeinsam mit numpy (liest alle Rechnungen vor"
+            " dem Schreiben ein)"
+        ),
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help=(
+            "Beobachte die Eingabedatei und erstelle nach jeder Änderung nur die"
+            " geänderten Rechnungen neu (beenden mit Strg+C)"
+        ),
+    )
+    parser.add_argument(
+        "-p",
+        "--pdf",
+        help="Mit --watch: Übersetze geänderte Rechnungen in diesen Ordner",
+    )
+    parser.add_argument(
+        "-b",
+        "--build",
+        default="tmp",
+        help="Mit --watch und --pdf: Ordner für temporäre LaTeX Dateien",
+    )
+    parser.add_argument(
+        "--ledger",
+        metavar="DATEI",
+        help=(
+            "Vergebe Rechnungsnummern dauerhaft pro Empfänger und Zeitraum über"
+            " dieses Nummernbuch (SQLite Datei)"
+        ),
+    )
+    parser.add_argument(
+        "--archiv",
+        metavar="DATEI",
+        help=(
+            "Schreibe alle Rechnungen mit Posten und Summen in dieses Archiv"
+            " (SQLite Datei), auswertbar mit tcsarchiv"
+        ),
+    )
+    parser.add_argument(
+        "--jsonl",
+        metavar="DATEI",
+        help="Schreibe alle Rechnungen mit Posten und Summen als JSON Lines",
+    )
+    parser.add_argument(
+        "--buchhaltung",
+        metavar="DATEI",
+        help="Schreibe Netto, MwSt und Brutto jeder Rechnung als CSV Datei",
+    )
+    parser.add_argument(
+        "--sepa",
+        metavar="ORDNER",
+        help=(
+            "Schreibe SEPA Lastschriften (pain.008) für alle Rechnungen mit Mandat"
+            " in diesen Ordner, Gläubiger aus <lastschrift>"
+        ),
+    )
+    parser.add_argument(
+        "--sepa-max",
+        type=int,
+        default=SEPA_BUCHUNGEN,
+        metavar="N",
+        help=f"Höchstens N Lastschriften je Datei (Standard: {SEPA_BUCHUNGEN})",
+    )
+    parser.add_argument(
+        "--report",
+        metavar="DATEI",
+        help=(
+            "Schreibe Umsatz je MwSt Satz, Förderung je Trainingszeit, Halleneinheiten"
+            " je Wochentag und Rechnungen je Empfängertyp als CSV (oder JSON bei"
+            " Endung .json)"
+        ),
+    )
+    parser.add_argument(
+        "--threads",
+        action="store_true",
+        help="Schreibe jede Ausgabe in einem eigenen Thread",
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help=(
+            "Prüfe alle Rechnungen und gib alle Fehler aus, ohne etwas zu schreiben"
+            " (-o und -m werden nicht benötigt)"
+        ),
+    )
+    args = parser.parse_args(argv)
+
+    if args.check:
+        pruefe_eingabe(args.eingabedatei, args.stream, args.jobs)
+        return
+    if args.output is None or args.mails is None:
+        parser.error("die Argumente -o/--output und -m/--mails werden benötigt")
+    if args.watch:
+        unvertraeglich = [
+            option
+            for option, gesetzt in [
+                ("--stream", args.stream),
+                ("--nosingle", args.nosingle),
+                ("--incremental", args.incremental),
+                ("--vektor", args.vektor),
+                ("--ledger", args.ledger is not None),
+                ("--archiv", args.archiv is not None),
+                ("--jsonl", args.jsonl is not None),
+                ("--buchhaltung", args.buchhaltung is not None),
+                ("--sepa", args.sepa is not None),
+                ("--report", args.report is not None),
+                ("--threads", args.threads),
+            ]
+            if gesetzt
+        ]
+        if unvertraeglich:
+            parser.error(
+                f"--watch kann nicht mit {', '.join(unvertraeglich)} verwendet werden"
+            )
+        fmt = None
+        if args.pdf is not None:
+            import tcscompile
+
+            cache = tcscompile.standard_cache()
+            fmt = (os.path.abspath(cache), tcscompile.erstelle_format(cache))
+        beobachter = Beobachter(
+            args.eingabedatei,
+            args.output,
+            args.mails,
+            args.jobs,
+            args.pdf,
+            args.build,
+            fmt,
+        )
+        try:
+            beobachte(beobachter)
+        except KeyboardInterrupt:
+            pass
+        return
+    if args.incremental and args.nosingle:
+        parser.error("--incremental kann nicht mit --nosingle verwendet werden")
+    if args.vektor and args.stream:
+        parser.error("--vektor kann nicht mit --stream verwendet werden")
+    if args.ledger is not None and args.stream:
+        parser.error("--ledger kann nicht mit --stream verwendet werden")
+    if args.vektor and np is None:
+        raise TCSRechnungError("--vektor benötigt das Paket numpy")
+
+    profil = cProfile.Profile() if args.profile is not None else None
+    if profil is not None:
+        profil.enable()
+    zeitmessung = Zeitmessung(speicher=args.timings is not None)
+
+    with zeitmessung.phase("xml"):
+        root, rechnungen = lade_eingabe(args.eingabedatei, args.stream)
+    if not args.incremental:
+        if os.path.exists(args.output):
+            raise TCSRechnungError(f"{args.output} existiert bereits")
+        if os.path.exists(args.mails):
+            raise TCSRechnungError(f"{args.mails} existiert bereits")
+    with zeitmessung.phase("metadaten"):
+        meta = Metadaten(root)
+        glaeubiger = Glaeubiger.aus_xml(root) if args.sepa is not None else None
+    rechnungsnr = _get_int(root, "rechnungsnummer")
+    modelle = None
+    if not args.stream:
+        # Groups span the whole file, which --stream does not hold at once.  The
+        # invoices read here are reused for rendering.
+        alle = list(zeitmessung.gemessen("xml", rechnungen))
+        with zeitmessung.phase("laden"):
+            modelle = [Rechnung.aus_xml(rechnung) for rechnung in alle]
+        with zeitmessung.phase("gruppen"):
+            for meldung in pruefe_gruppen(modelle):
+                print("Warnung: " + meldung, file=sys.stderr)
+        rechnungen = iter(alle)
+    nummern = None
+    if args.ledger is not None:
+        # All recipients are needed before the first number is assigned
+        alle_rechnungen = list(zeitmessung.gemessen("xml", rechnungen))
+        with zeitmessung.phase("nummern"):
+            nummern = Nummernbuch(args.ledger).vergebe(
+                alle_rechnungen, meta, rechnungsnr
+            )
+        rechnungen = iter(alle_rechnungen)
+    # Errors in the input found so far leave no output folders behind
+    os.makedirs(args.output, exist_ok=args.incremental)
+    os.makedirs(args.mails, exist_ok=args.incremental)
+    manifest = Manifest(args.output, meta) if args.incremental else None
+
+    # In incremental mode the collected files are only replaced if they changed
+    vergleichen = manifest is not None
+    senken: list[Senke] = [
+        TexSenke(os.path.join(args.output, gesamtname(meta) + ".tex"), vergleichen),
+        MailSenke(args.mails, vergleichen, eintraege=not args.nosingle),
+    ]
+    if not args.nosingle:
+        senken.append(EinzelTexSenke(args.output))
+    if args.archiv is not None:
+        # The archive keeps the invoices of the previous run if this one fails
+        senken.append(Archiv(args.archiv, meta))
+    if args.jsonl is not None:
+        senken.append(JsonSenke(args.jsonl, meta))
+    if args.buchhaltung is not None:
+        senken.append(BuchhaltungSenke(args.buchhaltung, meta))
+    if glaeubiger is not None:
+        senken.append(SepaSenke(args.sepa, meta, glaeubiger, args.sepa_max))
+    if args.report is not None:
+        senken.append(BerichtSenke(args.report, meta))
+    with Senken(senken, zeitmessung, args.threads) as ausgabe:
+        unveraendert: set[int] = set()
+
+        def merke_unveraendert(nr: int, rechnung: ET.Element) -> bool:
+            # Line items only exist for rendered invoices, so unchanged ones are
+            # rendered anyway and only their single file is kept
+            assert manifest is not None
+            if manifest.unveraendert(nr, rechnung):
+                unveraendert.add(nr)
+            return False
+
+        ueberspringe = None
+        if manifest is not None:
+            ueberspringe = (
+                merke_unveraendert if ausgabe.braucht_posten else manifest.unveraendert
+            )
 
-    texfile_all = os.path.join(
-        args.output,
-        "rechnungen_"
-        + str(meta.jahr)
-        + "_"
-        + str(MONATE_DIC[meta.von_monat])
-        + "-"
-        + str(MONATE_DIC[meta.bis_monat])
-        + ".tex",
-    )
-    filename_mail = os.path.join(args.mails, "mails.csv")
-    filename_nomail = os.path.join(args.mails, "nomail.txt")
-    with open(filename_mail, "w") as f_mail, open(texfile_all, "w") as f_tex_all, open(
-        filename_nomail, "w"
-    ) as f_nomail:
-        f_mail.write(get_mail_header())
-        f_tex_all.write("\\documentclass{tcsrechnung}\n")
-        f_tex_all.write("\\begin{document}\n")
-        rechnungsnr = _get_int(root, "rechnungsnummer")
-        for rechnung in _get_all_elems(root, "rechnung"):
-            rechnungsnr += 1
-            output = erstelle_rechnung(rechnung, rechnungsnr, meta)
-            f_tex_all.write(output)
-            if args.nosingle:
-                continue
-            texfile = os.path.join(
-                args.output,
-                str(meta.jahr_cur - 2000) + "_{:04d}".format(rechnungsnr) + ".tex",
-            )
-            with open(texfile, "w") as f_tex:
-                f_tex.write("\\documentclass{tcsrechnung}\n")
-                f_tex.write("\\begin{document}\n")
-                f_tex.write(output)
-                f_tex.write("\\end{document}\n")
-            try:
-                f_mail.write(erstelle_mail(rechnung, meta, texfile))
-            except TCSRechnungError:
-                pdffile = os.path.join(
-                    os.path.splitext(os.path.basename(texfile))[0] + ".pdf"
+        for ergebnis in rendere_rechnungen(
+            zeitmessung.gemessen("xml", rechnungen),
+            meta,
+            rechnungsnr,
+            args.jobs,
+            ueberspringe,
+            zeitmessung,
+            args.vektor,
+            nummern,
+            ausgabe.braucht_posten,
+            modelle,
+        ):
+            zeitmessung.rechnung(ergebnis)
+            name = rechnungsname(meta, ergebnis.rechnungsnr)
+            fragment = ergebnis.output
+            if fragment is None:
+                with zeitmessung.phase("tex"):
+                    fragment = _lese_fragment(os.path.join(args.output, name + ".tex"))
+            neu = (
+                ergebnis.output is not None and ergebnis.rechnungsnr not in unveraendert
+            )
+            unveraendert.discard(ergebnis.rechnungsnr)
+            ausgabe.eintragen(
+                Datensatz(
+                    ergebnis, name, fragment, neu, ergebnis.posten, ergebnis.summen
                 )
-                f_nomail.write(pdffile + "\n")
+            )
 
-        f_tex_all.write("\\end{document}\n")
+    if manifest is not None:
+        for name in manifest.speichern():
+            texfile = os.path.join(args.output, name + ".tex")
+            if os.path.exists(texfile):
+                os.remove(texfile)
+
+    if profil is not None:
+        profil.disable()
+        profil.dump_stats(args.profile)
+    if args.timings is not None:
+        zeitmessung.speichern(args.timings)
 
 
 if __name__ == "__main__":
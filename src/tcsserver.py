@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+
+##########################################################################
+# tcsserver.py - Lokaler HTTP Dienst für einzelne TCS Rechnungen         #
+#                                                                        #
+# This program is free software: you can redistribute it and/or modify   #
+# it under the terms of the GNU General Public License as published by   #
+# the Free Software Foundation, either version 3 of the License, or      #
+# (at your option) any later version.                                    #
+#                                                                        #
+# This program is distributed in the hope that it will be useful,        #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of         #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the          #
+# GNU General Public License for more details.                           #
+#                                                                        #
+# You should have received a copy of the GNU General Public License      #
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.  #
+##########################################################################
+
+import sys
+import os
+import collections
+import hashlib
+import threading
+import urllib.parse
+import xml.etree.ElementTree as ET
+import argparse
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import tcscompile
+from tcsrechnung import (
+    DOKUMENT_ANFANG,
+    DOKUMENT_ENDE,
+    Metadaten,
+    Rechnung,
+    TCSRechnungError,
+    _get_int,
+    erstelle_mail,
+    erstelle_rechnung,
+    get_mail_header,
+    lade_eingabe,
+    rechnungsname,
+)
+
+# Number of rendered documents (tex, mail rows and PDFs) kept in memory
+CACHE_GROESSE = 256
+
+TEXT = "text/plain; charset=utf-8"
+ENDUNGEN = {"tex": ".tex", "mail": ".csv", "pdf": ".pdf"}
+ARTEN = {
+    "tex": "text/x-tex; charset=utf-8",
+    "mail": "text/csv; charset=utf-8",
+    "pdf": "application/pdf",
+}
+
+
+class NichtGefunden(TCSRechnungError):
+    pass
+
+
+class Mehrdeutig(TCSRechnungError):
+    pass
+
+
+# Input file, metadata and rendered documents of the running service.  The input
+# file is checked on every request and reloaded when its content hash changed,
+# which also invalidates all cached documents.  Without fmt the precompiled
+# format is created with the first PDF, unless mit_format is False.
+class Rechnungsdienst:
+    def __init__(
+        self,
+        eingabedatei: str,
+        builddir: str = "tmp",
+        fmt: tuple[str, str] | None = None,
+        groesse: int = CACHE_GROESSE,
+        mit_format: bool = True,
+    ) -> None:
+        self.eingabedatei = eingabedatei
+        self.builddir = builddir
+        self.fmt = fmt
+        self.mit_format = mit_format
+        self.groesse = groesse
+        self.sperre = threading.Lock()
+        # LaTeX runs share the build folder and the format, tex and mail requests
+        # are answered while a PDF is compiled
+        self.kompiliersperre = threading.Lock()
+        self.stand: tuple[int, int] | None = None
+        self.hash = ""
+        self.meta: Metadaten | None = None
+        self.rechnungen: dict[int, ET.Element] = {}
+        self.namen: dict[str, list[int]] = {}
+        self.cache: collections.OrderedDict[tuple[str, int, str], bytes] = (
+            collections.OrderedDict()
+        )
+        self.treffer = 0
+        self.fehlgriffe = 0
+
+    def _lade(self) -> None:
+        # Only called with self.sperre held
+        info = os.stat(self.eingabedatei)
+        stand = (info.st_mtime_ns, info.st_size)
+        if stand == self.stand:
+            return
+        with open(self.eingabedatei, "rb") as f:
+            inhalt_hash = hashlib.sha256(f.read()).hexdigest()
+        if inhalt_hash == self.hash:
+            self.stand = stand
+            return
+
+        root, elemente = lade_eingabe(self.eingabedatei)
+        meta = Metadaten(root)
+        rechnungsnr = _get_int(root, "rechnungsnummer")
+        rechnungen: dict[int, ET.Element] = {}
+        namen: dict[str, list[int]] = collections.defaultdict(list)
+        for nr, rechnung in enumerate(elemente, rechnungsnr + 1):
+            rechnungen[nr] = rechnung
+            namen[(rechnung.findtext("name") or "").strip().casefold()].append(nr)
+        self.hash = inhalt_hash
+        self.meta = meta
+        self.rechnungen = rechnungen
+        self.namen = dict(namen)
+        self.cache.clear()
+        # Only a successful load is remembered, so an input that fails to load
+        # is read again on every request and answered with its error
+        self.stand = stand
+
+    def _nummer(self, schluessel: str) -> int:
+        # Invoice number as "3", "24_0003" or "24/0003", or the recipient name
+        assert self.meta is not None
+        kandidat = schluessel.replace("/", "_")
+        if kandidat.isdigit():
+            nr = int(kandidat)
+        elif kandidat[-5:-4] == "_" and kandidat[-4:].isdigit():
+            if kandidat != rechnungsname(self.meta, int(kandidat[-4:])):
+                raise NichtGefunden(f"Rechnung {schluessel} nicht gefunden")
+            nr = int(kandidat[-4:])
+        else:
+            nummern = self.namen.get(schluessel.strip().casefold(), [])
+            if len(nummern) > 1:
+                raise Mehrdeutig(
+                    f"Mehrere Rechnungen für '{schluessel}': "
+                    + ", ".join(rechnungsname(self.meta, nr) for nr in nummern)
+                )
+            if not nummern:
+                raise NichtGefunden(f"Keine Rechnung für '{schluessel}'")
+            nr = nummern[0]
+        if nr not in self.rechnungen:
+            raise NichtGefunden(f"Rechnung {schluessel} nicht gefunden")
+        return nr
+
+    def _kompiliere(self, name: str, tex: bytes) -> bytes:
+        # One LaTeX run
+        with self.kompiliersperre:
+            if self.fmt is None and self.mit_format:
+                cache = tcscompile.standard_cache()
+                self.fmt = (os.path.abspath(cache), tcscompile.erstelle_format(cache))
+            texdir = os.path.join(self.builddir, "tex")
+            os.makedirs(texdir, exist_ok=True)
+            texfile = os.path.join(texdir, name + ".tex")
+            with open(texfile, "wb") as f:
+                f.write(tex)
+            result = tcscompile.kompiliere_datei(texfile, self.builddir, self.fmt)
+            pdffile = os.path.join(self.builddir, name, name + ".pdf")
+            if result.returncode != 0 or not os.path.exists(pdffile):
+                log = "\n".join(result.stdout.splitlines()[-tcscompile.FEHLER_ZEILEN :])
+                raise TCSRechnungError(f"{name} konnte nicht übersetzt werden:\n{log}")
+            with open(pdffile, "rb") as f:
+                return f.read()
+
+    def _aus_cache(self, eintrag: tuple[str, int, str]) -> bytes | None:
+        inhalt = self.cache.get(eintrag)
+        if inhalt is None:
+            self.fehlgriffe += 1
+        else:
+            self.treffer += 1
+            self.cache.move_to_end(eintrag)
+        return inhalt
+
+    def _in_cache(self, eintrag: tuple[str, int, str], inhalt: bytes) -> None:
+        # Documents of an outdated input file are not stored anymore
+        if eintrag[0] != self.hash:
+            return
+        self.cache[eintrag] = inhalt
+        if len(self.cache) > self.groesse:
+            self.cache.popitem(last=False)
+
+    def _erstelle(self, nr: int, art: str) -> bytes:
+        assert self.meta is not None
+        rechnung = Rechnung.aus_xml(self.rechnungen[nr])
+        if art == "mail":
+            texfile = rechnungsname(self.meta, nr) + ".tex"
+            mail = erstelle_mail(rechnung, self.meta, texfile)
+            return (get_mail_header() + mail).encode()
+        return (
+            DOKUMENT_ANFANG + erstelle_rechnung(rechnung, nr, self.meta) + DOKUMENT_ENDE
+        ).encode()
+
+    def dokument(self, schluessel: str, art: str) -> tuple[str, bytes]:
+        # Returns file name and content of one invoice as tex, mail row or PDF
+        with self.sperre:
+            self._lade()
+            assert self.meta is not None
+            nr = self._nummer(schluessel)
+            name = rechnungsname(self.meta, nr)
+            eintrag = (self.hash, nr, art)
+            inhalt = self._aus_cache(eintrag)
+            if inhalt is not None:
+                return name, inhalt
+            if art != "pdf":
+                inhalt = self._erstelle(nr, art)
+                self._in_cache(eintrag, inhalt)
+                return name, inhalt
+            tex_eintrag = (self.hash, nr, "tex")
+            tex = self._aus_cache(tex_eintrag)
+            if tex is None:
+                tex = self._erstelle(nr, "tex")
+                self._in_cache(tex_eintrag, tex)
+
+        inhalt = self._kompiliere(name, tex)
+        with self.sperre:
+            self._in_cache(eintrag, inhalt)
+        return name, inhalt
+
+    def verzeichnis(self) -> str:
+        with self.sperre:
+            self._lade()
+            assert self.meta is not None
+            return "".join(
+                f"{rechnungsname(self.meta, nr)};{rechnung.findtext('name')}\n"
+                for nr, rechnung in self.rechnungen.items()
+            )
+
+
+class Anfrage(BaseHTTPRequestHandler):
+    # GET /                       list of all invoices
+    # GET /<art>/<schluessel>     art is tex, mail or pdf, schluessel is the
+    #                             invoice number or the recipient name
+    dienst: Rechnungsdienst
+
+    def do_GET(self) -> None:
+        pfad = urllib.parse.unquote(urllib.parse.urlsplit(self.path).path)
+        teile = pfad.split("/", 2)
+        try:
+            if pfad == "/":
+                self._antworte(HTTPStatus.OK, TEXT, self.dienst.verzeichnis().encode())
+                return
+            if len(teile) != 3 or teile[1] not in ARTEN or not teile[2]:
+                raise NichtGefunden(f"Unbekannter Pfad {pfad}")
+            name, inhalt = self.dienst.dokument(teile[2], teile[1])
+        except NichtGefunden as e:
+            self._antworte(HTTPStatus.NOT_FOUND, TEXT, str(e).encode())
+            return
+        except Mehrdeutig as e:
+            self._antworte(HTTPStatus.CONFLICT, TEXT, str(e).encode())
+            return
+        except (TCSRechnungError, ET.ParseError, OSError) as e:
+            self._antworte(HTTPStatus.INTERNAL_SERVER_ERROR, TEXT, str(e).encode())
+            return
+        except Exception as e:
+            # Unexpected errors, e.g. from input the checks do not catch, must not
+            # drop the connection
+            self.log_error("Fehler bei %s: %r", pfad, e)
+            meldung = f"Interner Fehler: {type(e).__name__}: {e}"
+            self._antworte(HTTPStatus.INTERNAL_SERVER_ERROR, TEXT, meldung.encode())
+            return
+        self._antworte(
+            HTTPStatus.OK,
+            ARTEN[teile[1]],
+            inhalt,
+            {"Content-Disposition": f'inline; filename="{name}{ENDUNGEN[teile[1]]}"'},
+        )
+
+    def _antworte(
+        self,
+        status: HTTPStatus,
+        typ: str,
+        inhalt: bytes,
+        kopf: dict[str, str] | None = None,
+    ) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", typ)
+        self.send_header("Content-Length", str(len(inhalt)))
+        for schluessel, wert in (kopf or {}).items():
+            self.send_header(schluessel, wert)
+        self.end_headers()
+        self.wfile.write(inhalt)
+
+
+def erstelle_server(
+    dienst: Rechnungsdienst, host: str = "127.0.0.1", port: int = 8080
+) -> ThreadingHTTPServer:
+    anfrage = type("Anfrage", (Anfrage,), {"dienst": dienst})
+    return ThreadingHTTPServer((host, port), anfrage)
+
+
+def run(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="tcsserver",
+        description=(
+            "Lokaler HTTP Dienst für einzelne Rechnungen als tex, Mail oder PDF"
+        ),
+    )
+    parser.add_argument("eingabedatei", help="Eingabedatei (xml Format)")
+    parser.add_argument("--host", default="127.0.0.1", help="Adresse des Dienstes")
+    parser.add_argument("--port", type=int, default=8080, help="Port des Dienstes")
+    parser.add_argument(
+        "-b", "--build", default="tmp", help="Ordner für temporäre LaTeX Dateien"
+    )
+    parser.add_argument(
+        "--noformat",
+        action="store_true",
+        help="Verwende kein vorkompiliertes Format für die Präambel",
+    )
+    parser.add_argument(
+        "--cache",
+        default=tcscompile.standard_cache(),
+        help="Ordner für vorkompilierte Formate",
+    )
+    args = parser.parse_args(argv)
+
+    fmt = None
+    if not args.noformat:
+        fmt = (os.path.abspath(args.cache), tcscompile.erstelle_format(args.cache))
+    dienst = Rechnungsdienst(
+        args.eingabedatei, args.build, fmt, mit_format=not args.noformat
+    )
+    # Load once at startup, so errors in the input file are reported right away
+    dienst.verzeichnis()
+
+    server = erstelle_server(dienst, args.host, args.port)
+    adresse = f"http://{args.host}:{server.server_port}/"
+    print(f"Rechnungen unter {adresse}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    try:
+        run()
+    except TCSRechnungError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    except ET.ParseError as e:
+        print("Fehlerhaftes Format der XML Datei: " + str(e), file=sys.stderr)
+        sys.exit(1)
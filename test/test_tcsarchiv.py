@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+##########################################################################
+# test_tcsarchiv.py - Tests for tcsarchiv.py                             #
+#                                                                        #
+# This program is free software: you can redistribute it and/or modify   #
+# it under the terms of the GNU General Public License as published by   #
+# the Free Software Foundation, either version 3 of the License, or      #
+# (at your option) any later version.                                    #
+#                                                                        #
+# This program is distributed in the hope that it will be useful,        #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of         #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the          #
+# GNU General Public License for more details.                           #
+#                                                                        #
+# You should have received a copy of the GNU General Public License      #
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.  #
+##########################################################################
+
+
+import sys
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+import pytest
+import tcsarchiv
+import tcsrechnung
+from tcsrechnung import TCSRechnungError
+
+
+class TestArchiv:
+    xml_path = Path(__file__).parent / "rechnungen.xml"
+
+    @pytest.fixture
+    def archiv(self, tmp_path):
+        # Two periods with the same invoices
+        archiv = tmp_path / "archiv.db"
+        root = ET.parse(self.xml_path).getroot()
+        for bis in ["Dezember", "November"]:
+            root.find("bis").text = bis
+            eingabe = tmp_path / f"{bis}.xml"
+            ET.ElementTree(root).write(eingabe, encoding="utf-8")
+            tcsrechnung.run(
+                [
+                    "-o",
+                    str(tmp_path / bis / "tex"),
+                    "-m",
+                    str(tmp_path / bis / "mails"),
+                    "--archiv",
+                    str(archiv),
+                    str(eingabe),
+                ]
+            )
+        return archiv
+
+    def test_suche(self, archiv):
+        verbindung = tcsarchiv.oeffne(str(archiv))
+        treffer = tcsarchiv.suche(verbindung, name="familie berger")
+        assert [(t["zeitraum"], t["brutto_cent"]) for t in treffer] == [
+            ("2024_10-11", 22401),
+            ("2024_10-12", 22401),
+        ]
+        assert len(tcsarchiv.suche(verbindung, kind="MIA", zeitraum="2024_10-12")) == 1
+        assert len(tcsarchiv.suche(verbindung, email="SABINE.krueger@mailtest.de")) == 2
+        assert len(tcsarchiv.suche(verbindung, jahr=2024)) == 4
+        assert tcsarchiv.suche(verbindung, jahr=2023) == []
+
+    def test_suche_ausgabe(self, archiv, capsys):
+        tcsarchiv.run([str(archiv), "suche", "--name", "Herr Krüger", "--posten"])
+        zeilen = capsys.readouterr().out.splitlines()
+        assert (
+            zeilen[0]
+            == "Zeitraum;Nummer;Revision;Name;Email;Netto;MwSt 19%;MwSt 7%;Brutto"
+        )
+        assert zeilen[1].startswith("2024_10-11;")
+        assert zeilen[1].endswith(
+            ";1;Herr Krüger;sabine.krueger@mailtest.de;68,33;0,00;4,78;73,11"
+        )
+        assert zeilen[2].startswith("  Hallenkosten (Mia): Dienstag, ")
+        assert zeilen[-1] == "2 Rechnungen, Summe brutto 169,55"
+
+    def test_tex(self, archiv, tmp_path, capsys):
+        (texfile,) = (tmp_path / "Dezember" / "tex").glob("??_0001.tex")
+        nummer = texfile.stem
+        with pytest.raises(TCSRechnungError, match="2024_10-11, 2024_10-12"):
+            tcsarchiv.run([str(archiv), "tex", nummer])
+        tcsarchiv.run([str(archiv), "tex", nummer, "--zeitraum", "2024_10-12"])
+        assert capsys.readouterr().out == texfile.read_text()
+
+        ausgabe = tmp_path / "nachdruck.tex"
+        tcsarchiv.run(
+            [str(archiv), "tex", nummer, "--zeitraum", "2024_10-12", "-o", str(ausgabe)]
+        )
+        assert ausgabe.read_text() == texfile.read_text()
+
+        with pytest.raises(TCSRechnungError, match="nicht im Archiv"):
+            tcsarchiv.run([str(archiv), "tex", "99_9999"])
+
+    def test_ersetzte_versionen(self, archiv, tmp_path, capsys):
+        # Rerun of December with a new address for the first invoice
+        root = ET.parse(self.xml_path).getroot()
+        root.find("bis").text = "Dezember"
+        strasse = root.findall("rechnung")[0].find("strasse")
+        assert strasse is not None
+        strasse.text = "Neuer Weg 1"
+        eingabe = tmp_path / "neu.xml"
+        ET.ElementTree(root).write(eingabe, encoding="utf-8")
+        tcsrechnung.run(
+            [
+                "-o",
+                str(tmp_path / "neu" / "tex"),
+                "-m",
+                str(tmp_path / "neu" / "mails"),
+                "--archiv",
+                str(archiv),
+                str(eingabe),
+            ]
+        )
+        verbindung = tcsarchiv.oeffne(str(archiv))
+        kriterien = {"name": "Familie Berger", "zeitraum": "2024_10-12"}
+        treffer = tcsarchiv.suche(verbindung, **kriterien)
+        assert [(t["revision"], t["aktuell"]) for t in treffer] == [(2, 1)]
+        treffer = tcsarchiv.suche(verbindung, alle=True, **kriterien)
+        assert [(t["revision"], t["aktuell"]) for t in treffer] == [(1, 0), (2, 1)]
+
+        (alt,) = (tmp_path / "Dezember" / "tex").glob("??_0001.tex")
+        nummer = alt.stem
+        aktuell = tcsarchiv.lade_tex(verbindung, nummer, "2024_10-12")
+        assert "Neuer Weg 1" in aktuell
+        assert aktuell == (tmp_path / "neu" / "tex" / alt.name).read_text()
+        assert tcsarchiv.lade_tex(verbindung, nummer, "2024_10-12", 1) == (
+            alt.read_text()
+        )
+
+        capsys.readouterr()
+        tcsarchiv.run([str(archiv), "suche", "--zeitraum", "2024_10-12", "--alle"])
+        zeilen = capsys.readouterr().out.splitlines()
+        assert [zeile.split(";")[1:4] for zeile in zeilen[1:-1]] == [
+            [nummer, "1*", "Familie Berger"],
+            [nummer, "2", "Familie Berger"],
+            [nummer[:3] + "0002", "1", "Herr Krüger"],
+        ]
+
+    def test_fehlendes_archiv(self, tmp_path):
+        with pytest.raises(TCSRechnungError, match="existiert nicht"):
+            tcsarchiv.run([str(tmp_path / "fehlt.db"), "suche"])
+        assert not (tmp_path / "fehlt.db").exists()
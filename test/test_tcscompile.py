@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+
+##########################################################################
+# test_tcscompile.py - Tests for tcscompile.py                           #
+#                                                                        #
+# This program is free software: you can redistribute it and/or modify   #
+# it under the terms of the GNU General Public License as published by   #
+# the Free Software Foundation, either version 3 of the License, or      #
+# (at your option) any later version.                                    #
+#                                                                        #
+# This program is distributed in the hope that it will be useful,        #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of         #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the          #
+# GNU General Public License for more details.                           #
+#                                                                        #
+# You should have received a copy of the GNU General Public License      #
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.  #
+##########################################################################
+
+
+import sys
+import os
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+import pytest
+import tcscompile
+from tcsrechnung import TCSRechnungError
+
+# Stand-in for latexmk: writes <outdir>/<name>.pdf and fails for files whose name
+# contains "fehler"
+FAKE_LATEXMK = """
+import sys, os
+outdir = [a for a in sys.argv if a.startswith("-outdir=")][0][len("-outdir="):]
+texfile = sys.argv[-1]
+name = os.path.splitext(os.path.basename(texfile))[0]
+if "fehler" in name:
+    print("! Undefined control sequence.")
+    sys.exit(12)
+with open(os.path.join(outdir, name + ".aux"), "w") as f:
+    f.write("aux")
+with open(os.path.join(outdir, name + ".pdf"), "w") as f:
+    f.write("pdf " + name)
+if name.startswith("rechnungen_"):
+    with open(os.path.join(outdir, name + ".seiten"), "w") as f:
+        f.write("24/0001;1\\n24/0002;3\\n24/0003;4\\n")
+"""
+
+# Stand-in for qpdf: writes the requested page range into the output file
+FAKE_QPDF = """
+import sys
+_, _, _, pdffile, seiten, _, ausgabe = sys.argv
+with open(ausgabe, "w") as f:
+    f.write(open(pdffile).read() + " " + seiten)
+"""
+
+
+# Stand-in for pdftex: reports a version and dumps an empty format file
+FAKE_PDFTEX = """
+import sys, os
+if sys.argv[1] == "--version":
+    print("pdfTeX 3.141592653-2.6-1.40.26 (fake)")
+    sys.exit(0)
+args = dict(a[1:].split("=", 1) for a in sys.argv if a.startswith("-") and "=" in a)
+with open(os.path.join(args["output-directory"], args["jobname"] + ".fmt"), "w") as f:
+    f.write("fmt")
+with open(os.path.join(os.path.dirname(__file__), "aufrufe"), "a") as f:
+    f.write(" ".join(sys.argv[1:]) + "\\n")
+"""
+
+
+@pytest.fixture
+def fake_pdftex(tmp_path, monkeypatch):
+    script = tmp_path / "pdftex"
+    script.write_text(f"#!{sys.executable}\n" + FAKE_PDFTEX)
+    script.chmod(0o755)
+    monkeypatch.setattr(tcscompile, "PDFTEX", str(script))
+
+    texmf = tmp_path / "texmf"
+    texmf.mkdir()
+    for name in tcscompile.FORMAT_DATEIEN:
+        (texmf / name).write_text("% " + name)
+    monkeypatch.setattr(tcscompile, "finde_texdatei", lambda name: str(texmf / name))
+    return tmp_path / "aufrufe"
+
+
+@pytest.fixture
+def fake_latexmk(tmp_path, monkeypatch):
+    script = tmp_path / "latexmk.py"
+    script.write_text(FAKE_LATEXMK)
+    monkeypatch.setattr(tcscompile, "LATEXMK", [sys.executable, str(script)])
+
+
+def create_texfiles(texdir: Path, namen: list[str]) -> None:
+    texdir.mkdir()
+    for name in namen:
+        (texdir / (name + ".tex")).write_text("\\documentclass{tcsrechnung}\n")
+
+
+class TestKompiliere:
+    def test_all_pdfs_moved(self, tmp_path, fake_latexmk):
+        namen = ["24_0001", "24_0002", "24_0003"]
+        create_texfiles(tmp_path / "tex", namen)
+
+        tcscompile.run(
+            [
+                "-p",
+                str(tmp_path / "pdf"),
+                "-b",
+                str(tmp_path / "tmp"),
+                "-j",
+                "2",
+                "--noformat",
+                str(tmp_path / "tex"),
+            ]
+        )
+
+        pdfs = sorted(f.name for f in (tmp_path / "pdf").iterdir())
+        assert pdfs == [n + ".pdf" for n in namen]
+        for name in namen:
+            assert (tmp_path / "tmp" / name / (name + ".aux")).exists()
+
+    def test_failures_collected(self, tmp_path, fake_latexmk, capsys):
+        create_texfiles(tmp_path / "tex", ["24_0001", "fehler", "24_0003"])
+
+        with pytest.raises(TCSRechnungError) as exc_info:
+            tcscompile.run(
+                [
+                    "-p",
+                    str(tmp_path / "pdf"),
+                    "-b",
+                    str(tmp_path / "tmp"),
+                    "--noformat",
+                    str(tmp_path / "tex"),
+                ]
+            )
+        assert "1 von 3 Rechnungen" in str(exc_info.value)
+
+        pdfs = sorted(f.name for f in (tmp_path / "pdf").iterdir())
+        assert pdfs == ["24_0001.pdf", "24_0003.pdf"]
+        assert "Undefined control sequence" in capsys.readouterr().err
+
+    def test_format_passed_to_latexmk(self, tmp_path, monkeypatch):
+        aufrufe = []
+
+        def fake_run(cmd, **kwargs):
+            aufrufe.append((cmd, kwargs["env"]))
+            return tcscompile.subprocess.CompletedProcess(cmd, 1, stdout="")
+
+        monkeypatch.setattr(tcscompile.subprocess, "run", fake_run)
+        tcscompile.kompiliere_datei(
+            "tex/24_0001.tex", str(tmp_path), ("/cache", "tcsrechnung-abc")
+        )
+
+        cmd, env = aufrufe[0]
+        assert "-pdflatex=pdflatex -fmt=tcsrechnung-abc %O %S" in cmd
+        assert env["TEXFORMATS"].startswith("/cache" + tcscompile.os.pathsep)
+
+    def test_incremental_skips_up_to_date(self, tmp_path, fake_latexmk):
+        create_texfiles(tmp_path / "tex", ["24_0001", "24_0002"])
+        args = [
+            "-p",
+            str(tmp_path / "pdf"),
+            "-b",
+            str(tmp_path / "tmp"),
+            "--noformat",
+            "--incremental",
+            str(tmp_path / "tex"),
+        ]
+        tcscompile.run(args)
+        assert (
+            tcscompile.veraltet(
+                [str(tmp_path / "tex" / "24_0001.tex")], str(tmp_path / "pdf")
+            )
+            == []
+        )
+
+        texfile = tmp_path / "tex" / "24_0002.tex"
+        pdffile = tmp_path / "pdf" / "24_0002.pdf"
+        os.utime(texfile, (pdffile.stat().st_mtime + 10,) * 2)
+        (tmp_path / "pdf" / "24_0001.pdf").write_text("unverändert")
+        tcscompile.run(args)
+
+        assert (tmp_path / "pdf" / "24_0001.pdf").read_text() == "unverändert"
+        assert pdffile.read_text() == "pdf 24_0002"
+
+    def test_empty_texdir(self, tmp_path):
+        (tmp_path / "tex").mkdir()
+        with pytest.raises(TCSRechnungError) as exc_info:
+            tcscompile.run([str(tmp_path / "tex")])
+        assert "Keine tex Dateien" in str(exc_info.value)
+
+
+class TestSplit:
+    def test_lese_seiten(self, tmp_path):
+        seitenfile = tmp_path / "rechnungen.seiten"
+        seitenfile.write_text("24/0001;1\n24/0002;3\n25/0003;4\n")
+        assert tcscompile.lese_seiten(str(seitenfile)) == [
+            ("24_0001", 1, 1),
+            ("24_0002", 2, 3),
+            ("25_0003", 4, 4),
+        ]
+
+    def test_lese_seiten_invalid(self, tmp_path):
+        seitenfile = tmp_path / "rechnungen.seiten"
+        seitenfile.write_text("24/0001;2\n24/0002;2\n")
+        with pytest.raises(TCSRechnungError) as exc_info:
+            tcscompile.lese_seiten(str(seitenfile))
+        assert "24/0002" in str(exc_info.value)
+
+    def test_split_only_compiles_combined_file(
+        self, tmp_path, fake_latexmk, monkeypatch
+    ):
+        script = tmp_path / "qpdf"
+        script.write_text(f"#!{sys.executable}\n" + FAKE_QPDF)
+        script.chmod(0o755)
+        monkeypatch.setattr(tcscompile, "QPDF", str(script))
+        create_texfiles(
+            tmp_path / "tex",
+            ["rechnungen_2024_10-12", "24_0001", "24_0002", "24_0003"],
+        )
+
+        tcscompile.run(
+            [
+                "-p",
+                str(tmp_path / "pdf"),
+                "-b",
+                str(tmp_path / "tmp"),
+                "--noformat",
+                "--split",
+                str(tmp_path / "tex"),
+            ]
+        )
+
+        assert sorted(f.name for f in (tmp_path / "tmp").iterdir()) == [
+            "rechnungen_2024_10-12"
+        ]
+        pdfdir = tmp_path / "pdf"
+        assert (pdfdir / "24_0001.pdf").read_text().endswith(" 1-1")
+        assert (pdfdir / "24_0002.pdf").read_text().endswith(" 2-3")
+        assert (pdfdir / "24_0003.pdf").read_text().endswith(" 4-4")
+        assert (pdfdir / "rechnungen_2024_10-12.pdf").exists()
+
+
+class TestFormat:
+    def test_format_created_once(self, tmp_path, fake_pdftex):
+        cache = tmp_path / "cache"
+        name = tcscompile.erstelle_format(str(cache))
+        assert name.startswith("tcsrechnung-")
+        assert (cache / (name + ".fmt")).exists()
+        assert sorted(f.name for f in cache.iterdir()) == [name + ".fmt"]
+
+        assert tcscompile.erstelle_format(str(cache)) == name
+        assert len(fake_pdftex.read_text().splitlines()) == 1
+
+    def test_format_rebuilt_after_change(self, tmp_path, fake_pdftex):
+        cache = tmp_path / "cache"
+        name = tcscompile.erstelle_format(str(cache))
+        (tmp_path / "texmf" / "personal-config.tex").write_text("% geändert")
+
+        neu = tcscompile.erstelle_format(str(cache))
+        assert neu != name
+        assert (cache / (neu + ".fmt")).exists()
+        assert len(fake_pdftex.read_text().splitlines()) == 2
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -19,6 +19,13 @@
 
 
 import sys
+import os
+import concurrent.futures
+import copy
+import json
+import pstats
+import re
+import sqlite3
 import xml.etree.ElementTree as ET
 import datetime
 from pathlib import Path
@@ -26,7 +33,10 @@ from pathlib import Path
 sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
 
 import pytest
+import tcsrechnung
 from tcsrechnung import (
+    DOKUMENT_ANFANG,
+    DOKUMENT_ENDE,
     TCSRechnungError,
     Metadaten,
     _get_elem,
@@ -36,10 +46,26 @@ from tcsrechnung import (
     erstelle_posten,
     erstelle_hallenposten,
     erstelle_rechnung,
+    schreibe_rechnung,
+    Senke,
+    Senken,
+    Datensatz,
+    PostenCache,
+    pruefe_gruppen,
+    Beobachter,
+    beobachte,
     erstelle_mail,
     get_mail_header,
-    MWST_VOLL,
-    MWST_ERM,
+    Training,
+    Kind,
+    Rechnung,
+    lade_eingabe,
+    run,
+    zeitraum,
+    wochentage_zaehlen,
+    hallenkalender,
+    _format_betrag,
+    _runde,
 )
 
 
@@ -87,6 +113,21 @@ class TestHelperFunctions:
         elems = _get_all_elems(parent, "item")
         assert elems == []
 
+    def test_runde_half_cent_away_from_zero(self):
+        assert _runde(1, 2) == 1
+        assert _runde(-1, 2) == -1
+        assert _runde(4999, 100) == 50
+        assert _runde(4949, 100) == 49
+        # 10 * 14 € * 40 min / (60 min * 2), exactly 4666.67 cents
+        assert _runde(10 * 1400 * 40, 60 * 2) == 4667
+
+    def test_format_betrag_cents(self):
+        assert _format_betrag(0) == "0,00"
+        assert _format_betrag(5) == "0,05"
+        assert _format_betrag(4538) == "45,38"
+        assert _format_betrag(123456) == "1234,56"
+        assert _format_betrag(-1308) == "-13,08"
+
 
 class TestMetadaten:
     def create_metadata_xml(
@@ -130,14 +171,24 @@ class TestMetadaten:
         assert meta.bis_monat == "Dezember"
         assert meta.jahr_cur == datetime.date.today().year
 
-        assert meta.stdlohn60 == [48, 52, 54, 56, 60]
-        assert meta.stdlohn40 == [36, 40, 42, 48]
+        assert [meta.tarife[(60, p)].brutto for p in range(1, 6)] == [
+            48,
+            52,
+            54,
+            56,
+            60,
+        ]
+        assert [meta.tarife[(40, p)].brutto for p in range(1, 5)] == [36, 40, 42, 48]
+        assert (40, 5) not in meta.tarife
 
-        assert meta.stdlohn60n[0] == 48 / (1 + MWST_VOLL)
-        assert meta.stdlohn40n[0] == 36 / (1 + MWST_VOLL)
+        # Net price per hour in cents, 48 / 1.19 and 36 / 1.19 * 60 / 40
+        assert meta.tarife[(60, 1)].netto_std_cent == 4034
+        assert meta.tarife[(40, 1)].netto_std_cent == 4538
+        assert meta.tarife[(40, 1)].netto_std_str == "45,38"
 
         assert meta.stdhalle == 14
-        assert meta.stdhalle_netto == 14 / (1 + MWST_ERM)
+        assert meta.stdhalle_cent == 1400
+        assert meta.stdhalle_netto_cent == 1308
 
     def test_hallensaison_winter_detected(self, capsys):
         root = self.create_metadata_xml(
@@ -159,12 +210,107 @@ class TestMetadaten:
         assert "Im Rechnungszeitraum ist keine Hallensaison" in captured.out
         assert meta.hallensaison is False
 
+    def test_generic_stdkosten_blocks(self):
+        root = self.create_metadata_xml()
+        elem = ET.SubElement(root, "stdkosten90")
+        ET.SubElement(elem, "p1").text = "72"
+        ET.SubElement(elem, "p2").text = "78"
+        meta = Metadaten(root)
+
+        assert meta.tarif(90, 2).brutto == 78
+        assert meta.tarif(90, 2).netto_std_cent == 4370
+
+        with pytest.raises(TCSRechnungError) as exc_info:
+            meta.tarif(90, 3)
+        assert "Kein Stundensatz für teilnehmerzahl=3 bei dauer=90" in str(
+            exc_info.value
+        )
+        with pytest.raises(TCSRechnungError) as exc_info:
+            meta.tarif(30, 1)
+        assert "Ungültige Trainingsdauer=30" in str(exc_info.value)
+
+    def test_invalid_stdkosten_element(self):
+        root = self.create_metadata_xml()
+        ET.SubElement(_get_elem(root, "stdkosten60"), "x1").text = "1"
+        with pytest.raises(TCSRechnungError) as exc_info:
+            Metadaten(root)
+        assert "Ungültiges Element <x1> in Block <stdkosten60>" in str(exc_info.value)
+
+    def test_wochentage_cnt_matches_weekly_iteration(self):
+        # Reference: step week by week from von_datum up to min(bis, ende_halle)
+        for von, bis, beginn_halle in [
+            ("Oktober", "Dezember", "01-10-2024"),
+            ("September", "Oktober", "15-10-2024"),
+            ("Januar", "März", "01-10-2024"),
+            ("November", "Februar", "01-10-2024"),
+            ("April", "Juni", "01-10-2024"),
+        ]:
+            root = self.create_metadata_xml(von=von, bis=bis, beginn_halle=beginn_halle)
+            meta = Metadaten(root)
+            von_datum, bis_datum = zeitraum(2024, von, bis)
+            ende = min(
+                bis_datum,
+                datetime.datetime.strptime(beginn_halle, "%d-%m-%Y").date()
+                + datetime.timedelta(30 * 7 - 1),
+            )
+            expected = [0] * 7
+            datum = von_datum
+            while datum <= ende:
+                expected[datum.weekday()] += 1
+                datum += datetime.timedelta(1)
+            assert meta.wochentage_cnt == expected
+
+    def test_wochentage_zaehlen(self):
+        montag = datetime.date(2024, 10, 7)
+        assert wochentage_zaehlen(montag, montag) == (1, 0, 0, 0, 0, 0, 0)
+        assert wochentage_zaehlen(montag, montag - datetime.timedelta(1)) == (0,) * 7
+        assert wochentage_zaehlen(montag, montag + datetime.timedelta(8)) == (
+            2,
+            2,
+            1,
+            1,
+            1,
+            1,
+            1,
+        )
+
+    def test_cross_year_period(self, capsys):
+        root = self.create_metadata_xml(
+            von="November", bis="Februar", beginn_halle="01-10-2024"
+        )
+        meta = Metadaten(root)
+
+        assert zeitraum(2024, "November", "Februar") == (
+            datetime.date(2024, 11, 1),
+            datetime.date(2025, 2, 28),
+        )
+        assert meta.bis_jahr == 2025
+        assert meta.hallensaison is True
+        assert (
+            sum(meta.wochentage_cnt)
+            == (datetime.date(2025, 2, 28) - datetime.date(2024, 11, 1)).days + 1
+        )
+
+    def test_hallenkalender_memoized(self):
+        hallenkalender.cache_clear()
+        Metadaten(self.create_metadata_xml())
+        Metadaten(self.create_metadata_xml())
+        info = hallenkalender.cache_info()
+        assert info.misses == 1
+        assert info.hits == 1
+
     def test_invalid_beginn_halle_format(self):
         root = self.create_metadata_xml(beginn_halle="invalid-date")
         with pytest.raises(TCSRechnungError) as exc_info:
             Metadaten(root)
         assert "hat ungültiges Format (erwartet: DD-MM-YYYY)" in str(exc_info.value)
 
+    def test_invalid_month(self):
+        root = self.create_metadata_xml()
+        root.find("bis").text = "Dezmber"
+        with pytest.raises(TCSRechnungError, match="Ungültiger Monat <bis>=Dezmber"):
+            Metadaten(root)
+
 
 class TestErstellePosten:
     def create_training_xml(
@@ -239,12 +385,14 @@ class TestErstellePosten:
 
         nettopreise = []
         bruttopreise = []
-        result = erstelle_posten(training, meta, nettopreise, bruttopreise)
+        result = erstelle_posten(
+            Training.aus_xml(training), meta, nettopreise, bruttopreise
+        )
 
         assert "\\Posten{Montag}{4}{" in result
 
-        assert nettopreise == [0.0]
-        assert bruttopreise == [0.0]
+        assert nettopreise == [0]
+        assert bruttopreise == [0]
 
     def test_posten_no_foerderung_returns_none(self):
         meta = self.create_metadata()
@@ -257,7 +405,9 @@ class TestErstellePosten:
 
         nettopreise = []
         bruttopreise = []
-        result = erstelle_posten(training, meta, nettopreise, bruttopreise)
+        result = erstelle_posten(
+            Training.aus_xml(training), meta, nettopreise, bruttopreise
+        )
 
         assert result is None
         assert nettopreise == []
@@ -276,12 +426,14 @@ class TestErstellePosten:
 
         nettopreise = []
         bruttopreise = []
-        result = erstelle_posten(training, meta, nettopreise, bruttopreise)
+        result = erstelle_posten(
+            Training.aus_xml(training), meta, nettopreise, bruttopreise
+        )
 
         assert "\\Posten{Dienstag}{3}{" in result
 
-        assert nettopreise == [0.0]
-        assert bruttopreise == [0.0]
+        assert nettopreise == [0]
+        assert bruttopreise == [0]
 
     def test_posten_multiple_foerderbetraege(self):
         meta = self.create_metadata()
@@ -296,12 +448,14 @@ class TestErstellePosten:
 
         nettopreise = []
         bruttopreise = []
-        result = erstelle_posten(training, meta, nettopreise, bruttopreise)
+        result = erstelle_posten(
+            Training.aus_xml(training), meta, nettopreise, bruttopreise
+        )
 
         assert "\\Posten{Mittwoch}{5}{" in result
 
-        assert nettopreise == [0.0]
-        assert bruttopreise == [0.0]
+        assert nettopreise == [0]
+        assert bruttopreise == [0]
 
     def test_posten_invalid_dauer(self):
         meta = self.create_metadata()
@@ -313,7 +467,7 @@ class TestErstellePosten:
         )
 
         with pytest.raises(TCSRechnungError) as exc_info:
-            erstelle_posten(training, meta, [], [])
+            erstelle_posten(Training.aus_xml(training), meta, [], [])
         assert "Ungültige Trainingsdauer" in str(exc_info.value)
 
     def test_posten_invalid_foerderung(self):
@@ -321,7 +475,7 @@ class TestErstellePosten:
         training = self.create_training_xml(foerderung="invalid")
 
         with pytest.raises(TCSRechnungError) as exc_info:
-            erstelle_posten(training, meta, [], [])
+            erstelle_posten(Training.aus_xml(training), meta, [], [])
         assert "Ungültiger Eintrag <foerderung>" in str(exc_info.value)
 
     def test_posten_foerderung_not_multiple_of_stdlohn(self):
@@ -335,7 +489,7 @@ class TestErstellePosten:
         )
 
         with pytest.raises(TCSRechnungError) as exc_info:
-            erstelle_posten(training, meta, [], [])
+            erstelle_posten(Training.aus_xml(training), meta, [], [])
         assert "ist kein Vielfaches von stdlohn" in str(exc_info.value)
 
     def test_posten_empty_foerderbetrag_gruppe(self):
@@ -350,7 +504,7 @@ class TestErstellePosten:
         </training>""")
 
         with pytest.raises(TCSRechnungError) as exc_info:
-            erstelle_posten(training, meta, [], [])
+            erstelle_posten(Training.aus_xml(training), meta, [], [])
         assert "ist leer" in str(exc_info.value)
 
     def test_posten_invalid_foerderbetrag_value(self):
@@ -365,7 +519,7 @@ class TestErstellePosten:
         </training>""")
 
         with pytest.raises(TCSRechnungError) as exc_info:
-            erstelle_posten(training, meta, [], [])
+            erstelle_posten(Training.aus_xml(training), meta, [], [])
         assert "ist keine gültige Zahl" in str(exc_info.value)
 
     def test_posten_foerderung_nein_with_foerderbetrag_value(self):
@@ -380,7 +534,7 @@ class TestErstellePosten:
         </training>""")
 
         with pytest.raises(TCSRechnungError) as exc_info:
-            erstelle_posten(training, meta, [], [])
+            erstelle_posten(Training.aus_xml(training), meta, [], [])
         assert "<foerderbetrag_gruppe> hat Wert" in str(exc_info.value)
         assert "darf keinen gültigen Wert haben" in str(exc_info.value)
 
@@ -396,7 +550,7 @@ class TestErstellePosten:
         </training>""")
 
         with pytest.raises(TCSRechnungError) as exc_info:
-            erstelle_posten(training, meta, [], [])
+            erstelle_posten(Training.aus_xml(training), meta, [], [])
         assert "<foerderkinder> hat Wert" in str(exc_info.value)
         assert "darf keinen gültigen Wert haben" in str(exc_info.value)
 
@@ -411,7 +565,7 @@ class TestErstellePosten:
         </training>""")
 
         with pytest.raises(TCSRechnungError) as exc_info:
-            erstelle_posten(training, meta, [], [])
+            erstelle_posten(Training.aus_xml(training), meta, [], [])
         assert "Element <foerderkinder>" in str(exc_info.value)
         assert "fehlt" in str(exc_info.value)
 
@@ -434,6 +588,7 @@ class TestErstelleHallenposten:
 
         return ET.fromstring(f"""<training>
             <tag>{tag}</tag>
+            <foerderung>nein</foerderung>
             <teilnehmerzahl>{teilnehmerzahl}</teilnehmerzahl>
             <dauer>{dauer}</dauer>
             <bezahlt>nein</bezahlt>
@@ -479,15 +634,15 @@ class TestErstelleHallenposten:
 
         nettopreise = []
         bruttopreise = []
-        result = erstelle_hallenposten(training, meta, nettopreise, bruttopreise)
+        result = erstelle_hallenposten(
+            Training.aus_xml(training), meta, nettopreise, bruttopreise
+        )
 
         assert "\\Posten{Montag}{10}{" in result
 
-        expected_netto = round(10 * (14 / (1 + MWST_ERM)) * 60 / (60 * 4), 2)
-        expected_brutto = round(10 * 14 * 60 / (60 * 4), 2)
-
-        assert nettopreise == [expected_netto]
-        assert bruttopreise == [expected_brutto]
+        # 10 * 14 € / 4 participants, net of 7 % VAT
+        assert nettopreise == [3271]
+        assert bruttopreise == [3500]
 
     def test_hallenposten_manual_override(self):
         meta = self.create_metadata_with_wochentage([10, 10, 10, 10, 10, 10, 10])
@@ -497,7 +652,9 @@ class TestErstelleHallenposten:
 
         nettopreise = []
         bruttopreise = []
-        result = erstelle_hallenposten(training, meta, nettopreise, bruttopreise)
+        result = erstelle_hallenposten(
+            Training.aus_xml(training), meta, nettopreise, bruttopreise
+        )
 
         assert "\\Posten{Montag}{5}{" in result
 
@@ -507,25 +664,27 @@ class TestErstelleHallenposten:
 
         nettopreise = []
         bruttopreise = []
-        result = erstelle_hallenposten(training, meta, nettopreise, bruttopreise)
+        result = erstelle_hallenposten(
+            Training.aus_xml(training), meta, nettopreise, bruttopreise
+        )
 
         assert "\\Posten{Dienstag}{10}{" in result
         assert "}{2}{40}{" in result
 
-        expected_netto = round(10 * (14 / (1 + MWST_ERM)) * 40 / (60 * 2), 2)
-        assert nettopreise == [expected_netto]
+        assert nettopreise == [4361]
+        assert bruttopreise == [4667]
 
     def test_hallenposten_invalid_weekday(self):
-        meta = self.create_metadata_with_wochentage([10, 10, 10, 10, 10, 10, 10])
         training = ET.fromstring("""<training>
             <tag>UnbekannterTag</tag>
+            <foerderung>nein</foerderung>
             <teilnehmerzahl>4</teilnehmerzahl>
             <dauer>60</dauer>
             <halleneinheiten></halleneinheiten>
         </training>""")
 
-        with pytest.raises(KeyError):
-            erstelle_hallenposten(training, meta, [], [])
+        with pytest.raises(TCSRechnungError, match="Ungültiger Wochentag"):
+            Training.aus_xml(training)
 
 
 class TestErstelleRechnung:
@@ -626,7 +785,7 @@ class TestErstelleRechnung:
         meta = self.create_metadata()
         rechnung = self.create_rechnung_xml()
 
-        result = erstelle_rechnung(rechnung, 1, meta)
+        result = erstelle_rechnung(Rechnung.aus_xml(rechnung), 1, meta)
 
         assert "\\Empfaenger{Familie Test}{Teststraße 1}{12345 Teststadt}" in result
         assert "\\Referenz{" in result
@@ -669,7 +828,7 @@ class TestErstelleRechnung:
         ]
         rechnung = self.create_rechnung_xml(kinder_data=kinder_data)
 
-        result = erstelle_rechnung(rechnung, 1, meta)
+        result = erstelle_rechnung(Rechnung.aus_xml(rechnung), 1, meta)
 
         assert "Max, Lisa}" in result or "Max und Lisa}" in result
         assert "Trainingskosten (Max)}" in result
@@ -706,7 +865,7 @@ class TestErstelleRechnung:
         ]
         rechnung = self.create_rechnung_xml(kinder_data=kinder_data)
 
-        result = erstelle_rechnung(rechnung, 1, meta)
+        result = erstelle_rechnung(Rechnung.aus_xml(rechnung), 1, meta)
 
         parts = result.split("\\Kostentyp{")
 
@@ -773,7 +932,7 @@ class TestErstelleRechnung:
         ]
         rechnung = self.create_rechnung_xml(kinder_data=kinder_data)
 
-        result = erstelle_rechnung(rechnung, 1, meta)
+        result = erstelle_rechnung(Rechnung.aus_xml(rechnung), 1, meta)
 
         assert "\\SummeSommer{" in result
         assert "\\SummeWinter{" not in result
@@ -792,7 +951,7 @@ class TestErstelleRechnung:
         </rechnung>""")
 
         with pytest.raises(TCSRechnungError) as exc_info:
-            erstelle_rechnung(rechnung, 1, meta)
+            erstelle_rechnung(Rechnung.aus_xml(rechnung), 1, meta)
         assert "Element <name>" in str(exc_info.value)
         assert "fehlt" in str(exc_info.value)
 
@@ -808,7 +967,7 @@ class TestErstelleRechnung:
         </rechnung>""")
 
         with pytest.raises(TCSRechnungError) as exc_info:
-            erstelle_rechnung(rechnung, 1, meta)
+            erstelle_rechnung(Rechnung.aus_xml(rechnung), 1, meta)
         assert "Element <strasse>" in str(exc_info.value)
         assert "fehlt" in str(exc_info.value)
 
@@ -832,7 +991,7 @@ class TestErstelleRechnung:
         </rechnung>""")
 
         with pytest.raises(TCSRechnungError) as exc_info:
-            erstelle_rechnung(rechnung, 1, meta)
+            erstelle_rechnung(Rechnung.aus_xml(rechnung), 1, meta)
         assert "Element <name>" in str(exc_info.value)
 
 
@@ -850,6 +1009,8 @@ class TestErstelleMail:
 
         return ET.fromstring(f"""<rechnung>
             <name>{name}</name>
+            <strasse>Teststraße 1</strasse>
+            <ort>12345 Teststadt</ort>
             <email>{email}</email>
             {kinder_xml}
         </rechnung>""")
@@ -883,7 +1044,7 @@ class TestErstelleMail:
         meta = self.create_metadata()
         rechnung = self.create_rechnung_xml(name="Familie Müller", kinder=["Max"])
 
-        result = erstelle_mail(rechnung, meta, "/path/to/24_0001.tex")
+        result = erstelle_mail(Rechnung.aus_xml(rechnung), meta, "/path/to/24_0001.tex")
 
         assert (
             result
@@ -895,7 +1056,7 @@ class TestErstelleMail:
         meta = self.create_metadata()
         rechnung = self.create_rechnung_xml(name="Frau Schmidt", kinder=["Lisa"])
 
-        result = erstelle_mail(rechnung, meta, "/path/to/24_0002.tex")
+        result = erstelle_mail(Rechnung.aus_xml(rechnung), meta, "/path/to/24_0002.tex")
 
         assert (
             result
@@ -907,7 +1068,7 @@ class TestErstelleMail:
         meta = self.create_metadata()
         rechnung = self.create_rechnung_xml(name="Herr Meyer", kinder=["Tom"])
 
-        result = erstelle_mail(rechnung, meta, "/path/to/24_0003.tex")
+        result = erstelle_mail(Rechnung.aus_xml(rechnung), meta, "/path/to/24_0003.tex")
 
         assert (
             result
@@ -919,7 +1080,7 @@ class TestErstelleMail:
         meta = self.create_metadata()
         rechnung = self.create_rechnung_xml(name="Dr. Test", kinder=["Anna"])
 
-        result = erstelle_mail(rechnung, meta, "/path/to/24_0004.tex")
+        result = erstelle_mail(Rechnung.aus_xml(rechnung), meta, "/path/to/24_0004.tex")
 
         assert (
             result
@@ -933,7 +1094,7 @@ class TestErstelleMail:
             name="Familie Test", kinder=["Max", "Lisa", "Tom"]
         )
 
-        result = erstelle_mail(rechnung, meta, "/path/to/24_0005.tex")
+        result = erstelle_mail(Rechnung.aus_xml(rechnung), meta, "/path/to/24_0005.tex")
 
         assert (
             result
@@ -945,7 +1106,7 @@ class TestErstelleMail:
         meta = self.create_metadata()
         rechnung = self.create_rechnung_xml(name="Familie Test", kinder=["Max", "Lisa"])
 
-        result = erstelle_mail(rechnung, meta, "/path/to/24_0006.tex")
+        result = erstelle_mail(Rechnung.aus_xml(rechnung), meta, "/path/to/24_0006.tex")
 
         assert (
             result
@@ -969,13 +1130,1383 @@ class TestIntegration:
         rechnungsnummer = 0
         for rechnung in root.findall("rechnung"):
             rechnungsnummer += 1
-            result = erstelle_rechnung(rechnung, rechnungsnummer, meta)
+            result = erstelle_rechnung(
+                Rechnung.aus_xml(rechnung), rechnungsnummer, meta
+            )
 
             assert "\\Empfaenger{" in result
             assert "\\Referenz{" in result
             assert "\\Schluss{" in result
             assert result.endswith("}\n\n")
 
+    def test_misspelt_weekday(self, tmp_path):
+        xml_path = Path(__file__).parent / "rechnungen.xml"
+        root = ET.parse(xml_path).getroot()
+        training = root.find("rechnung").find("kind").find("training")
+        training.find("tag").text = "Dinstag"
+        training.remove(training.find("halleneinheiten"))
+        eingabe = tmp_path / "rechnungen.xml"
+        ET.ElementTree(root).write(eingabe, encoding="utf-8")
+        with pytest.raises(
+            TCSRechnungError, match="Ungültiger Wochentag <tag>=Dinstag"
+        ):
+            run_in(tmp_path, eingabe)
+
+
+def run_in(ziel: Path, xml_path: Path, extra: list[str] | None = None) -> None:
+    run(
+        ["-o", str(ziel / "tex"), "-m", str(ziel / "mails"), str(xml_path)]
+        + (extra or [])
+    )
+
+
+def assert_same_output(a: Path, b: Path, ignore_manifest: bool = False) -> None:
+    for sub in ["tex", "mails"]:
+        files = sorted(f.name for f in (a / sub).iterdir())
+        other = sorted(f.name for f in (b / sub).iterdir())
+        if ignore_manifest:
+            other = [f for f in other if f != tcsrechnung.Manifest.DATEI]
+        assert files == other
+        for f in files:
+            assert (a / sub / f).read_bytes() == (b / sub / f).read_bytes()
+
+
+class TestStream:
+    xml_path = Path(__file__).parent / "rechnungen.xml"
+
+    def test_stream_header_and_rechnungen(self):
+        root, rechnungen = lade_eingabe(str(self.xml_path), stream=True)
+        meta = Metadaten(root)
+        assert meta.jahr == 2024
+        assert _get_int(root, "rechnungsnummer") == 0
+
+        namen = [_get_text(r, "name") for r in rechnungen]
+        expected = [
+            _get_text(r, "name") for r in ET.parse(self.xml_path).findall("rechnung")
+        ]
+        assert namen == expected
+
+    def test_stream_removes_processed_rechnungen(self):
+        root, rechnungen = lade_eingabe(str(self.xml_path), stream=True)
+        vorherige = None
+        for rechnung in rechnungen:
+            assert rechnung in list(root)
+            assert vorherige not in list(root)
+            vorherige = rechnung
+        assert root.findall("rechnung") == []
+
+    def test_stream_output_identical(self, tmp_path):
+        run_in(tmp_path / "normal", self.xml_path)
+        run_in(tmp_path / "stream", self.xml_path, ["--stream"])
+        assert_same_output(tmp_path / "normal", tmp_path / "stream")
+
+
+class TestJobs:
+    xml_path = Path(__file__).parent / "rechnungen.xml"
+
+    @pytest.mark.parametrize("extra", [[], ["--stream"], ["--nosingle"]])
+    def test_jobs_output_identical(self, tmp_path, monkeypatch, extra):
+        monkeypatch.setattr(tcsrechnung, "PAKETGROESSE", 2)
+        run_in(tmp_path / "serial", self.xml_path, extra)
+        run_in(tmp_path / "parallel", self.xml_path, extra + ["--jobs", "3"])
+        assert_same_output(tmp_path / "serial", tmp_path / "parallel")
+
+    def test_jobs_error_propagates(self, tmp_path):
+        xml = self.xml_path.read_text().replace(
+            "<dauer>60</dauer>", "<dauer>90</dauer>", 1
+        )
+        xml_path = tmp_path / "fehler.xml"
+        xml_path.write_text(xml)
+        with pytest.raises(TCSRechnungError) as exc_info:
+            run_in(tmp_path / "out", xml_path, ["--jobs", "2"])
+        assert "Ungültige Trainingsdauer=90" in str(exc_info.value)
+
+
+class TestIncremental:
+    xml_path = Path(__file__).parent / "rechnungen.xml"
+
+    def test_incremental_rewrites_only_changed(self, tmp_path):
+        run_in(tmp_path / "ref", self.xml_path)
+        run_in(tmp_path / "inc", self.xml_path, ["--incremental"])
+        assert_same_output(tmp_path / "ref", tmp_path / "inc", ignore_manifest=True)
+
+        texdir = tmp_path / "inc" / "tex"
+        for f in texdir.iterdir():
+            os.utime(f, (0, 0))
+
+        xml = self.xml_path.read_text().replace("Lindenweg 12", "Lindenweg 14")
+        geaendert = tmp_path / "geaendert.xml"
+        geaendert.write_text(xml)
+        run_in(tmp_path / "inc", geaendert, ["--incremental"])
+        run_in(tmp_path / "ref2", geaendert)
+        assert_same_output(tmp_path / "ref2", tmp_path / "inc", ignore_manifest=True)
+
+        neu = sorted(f.name for f in texdir.glob("*.tex") if f.stat().st_mtime != 0)
+        assert len(neu) == 2
+        assert neu[0].endswith("_0001.tex")
+        assert neu[1].startswith("rechnungen_")
+
+    def test_incremental_removes_stale_invoices(self, tmp_path):
+        run_in(tmp_path / "inc", self.xml_path, ["--incremental"])
+        root = ET.parse(self.xml_path).getroot()
+        root.remove(root.findall("rechnung")[-1])
+        gekuerzt = tmp_path / "gekuerzt.xml"
+        ET.ElementTree(root).write(gekuerzt, encoding="unicode")
+
+        run_in(tmp_path / "inc", gekuerzt, ["--incremental"])
+        run_in(tmp_path / "ref", gekuerzt)
+        assert_same_output(tmp_path / "ref", tmp_path / "inc", ignore_manifest=True)
+
+    def test_incremental_after_failed_run(self, tmp_path):
+        run_in(tmp_path / "inc", self.xml_path, ["--incremental"])
+        texdir = tmp_path / "inc" / "tex"
+        vorher = {f.name: f.read_bytes() for f in texdir.glob("*.tex")}
+
+        # The first invoice is rewritten before the second one fails
+        root = ET.parse(self.xml_path).getroot()
+        erste, zweite = root.findall("rechnung")
+        erste.find("strasse").text = "Lindenweg 14"
+        training = zweite.find("kind").find("training")
+        training.find("foerderung").text = "ja"
+        training.find("foerderbetrag_gruppe").text = "100"
+        training.find("foerderkinder").text = "1"
+        kaputt = tmp_path / "kaputt.xml"
+        ET.ElementTree(root).write(kaputt, encoding="unicode")
+        with pytest.raises(TCSRechnungError, match="Herr Krüger"):
+            run_in(tmp_path / "inc", kaputt, ["--incremental"])
+        assert {f.name: f.read_bytes() for f in texdir.glob("*.tex")} != vorher
+
+        run_in(tmp_path / "inc", self.xml_path, ["--incremental"])
+        assert {f.name: f.read_bytes() for f in texdir.glob("*.tex")} == vorher
+
+    def test_incremental_nosingle_rejected(self, tmp_path):
+        with pytest.raises(SystemExit):
+            run_in(tmp_path, self.xml_path, ["--incremental", "--nosingle"])
+
+
+class TestTimings:
+    xml_path = Path(__file__).parent / "rechnungen.xml"
+
+    def test_timings_report(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(tcsrechnung, "LANGSAMSTE", 2)
+        bericht_datei = tmp_path / "timings.json"
+        run_in(tmp_path / "out", self.xml_path, ["--timings", str(bericht_datei)])
+
+        bericht = json.loads(bericht_datei.read_text())
+        anzahl = len(ET.parse(self.xml_path).findall("rechnung"))
+        assert bericht["rechnungen"] == anzahl
+        assert set(bericht["phasen_sekunden"]) == {
+            "xml",
+            "metadaten",
+            "laden",
+            "gruppen",
+            "rendern",
+            "tex",
+            "mails",
+        }
+        assert bericht["speicher_spitze_bytes"] > 0
+
+        langsamste = bericht["langsamste_rechnungen"]
+        assert len(langsamste) == 2
+        assert langsamste[0]["sekunden"] >= langsamste[1]["sekunden"]
+        assert {"rechnungsnr", "name"} <= set(langsamste[0])
+
+    def test_timings_do_not_change_output(self, tmp_path):
+        run_in(tmp_path / "normal", self.xml_path)
+        run_in(
+            tmp_path / "gemessen",
+            self.xml_path,
+            ["--timings", str(tmp_path / "t.json"), "--profile", str(tmp_path / "p")],
+        )
+        assert_same_output(tmp_path / "normal", tmp_path / "gemessen")
+        assert pstats.Stats(str(tmp_path / "p")).total_calls > 0
+
+
+class TestVektor:
+    xml_path = Path(__file__).parent / "rechnungen.xml"
+
+    def trainings(self, meta: Metadaten) -> list[Training]:
+        trainings = []
+        for dauer in [40, 60]:
+            for teilnehmerzahl in [1, 2, 3, 4]:
+                stdlohn = meta.tarif(dauer, teilnehmerzahl).brutto
+                for hallen in [None, 0, 7, 13]:
+                    tz = teilnehmerzahl
+                    trainings.append(
+                        Training("Mittwoch", True, 3 * stdlohn, 1, tz, dauer, hallen)
+                    )
+                    trainings.append(
+                        Training("Freitag", False, 0, 0, tz, dauer, hallen)
+                    )
+        return trainings
+
+    @pytest.mark.parametrize("hallenkosten", [7, 13, 14, 17, 23])
+    def test_matches_scalar_path(self, hallenkosten):
+        pytest.importorskip("numpy")
+        root = ET.parse(self.xml_path).getroot()
+        _get_elem(root, "hallenkosten").text = str(hallenkosten)
+        meta = Metadaten(root)
+        trainings = self.trainings(meta)
+        rechnungen = [Rechnung.aus_xml(r) for r in root.findall("rechnung")]
+        for i in range(3):
+            kinder = [Kind("Anna", trainings[i::3]), Kind("Max", trainings[i + 1 :: 5])]
+            rechnungen.append(
+                Rechnung("Familie Test", "Teststraße 1", "Teststadt", None, kinder)
+            )
+        rechnungen.append(
+            Rechnung("Familie Leer", "Teststraße 2", "12345 Teststadt", None, [])
+        )
+
+        preise = tcsrechnung.berechne_preise_vektor(rechnungen, meta)
+        for nr, (rechnung, p) in enumerate(zip(rechnungen, preise), 1):
+            assert erstelle_rechnung(rechnung, nr, meta, p) == erstelle_rechnung(
+                rechnung, nr, meta
+            )
+
+    def test_same_error_as_scalar_path(self):
+        pytest.importorskip("numpy")
+        meta = Metadaten(ET.parse(self.xml_path).getroot())
+        kinder = [Kind("Anna", [Training("Montag", True, 50, 1, 2, 60, None)])]
+        falsch = Rechnung("Familie Test", "Teststraße 1", "Teststadt", None, kinder)
+        with pytest.raises(TCSRechnungError) as skalar:
+            erstelle_rechnung(falsch, 1, meta)
+        with pytest.raises(TCSRechnungError) as vektor:
+            tcsrechnung.berechne_preise_vektor([falsch], meta)
+        assert str(vektor.value) == str(skalar.value)
+
+    def test_output_identical(self, tmp_path):
+        pytest.importorskip("numpy")
+        run_in(tmp_path / "normal", self.xml_path)
+        run_in(tmp_path / "vektor", self.xml_path, ["--vektor", "-j", "2"])
+        assert_same_output(tmp_path / "normal", tmp_path / "vektor")
+
+    def test_vektor_stream_rejected(self, tmp_path):
+        with pytest.raises(SystemExit):
+            run_in(tmp_path, self.xml_path, ["--vektor", "--stream"])
+
+
+class TestModell:
+    def test_training_aus_xml(self):
+        training = Training.aus_xml(ET.fromstring("""
+            <training>
+                <tag>Montag</tag>
+                <foerderung>ja</foerderung>
+                <foerderbetrag_gruppe>30</foerderbetrag_gruppe>
+                <foerderbetrag_gruppe>20</foerderbetrag_gruppe>
+                <foerderkinder>2</foerderkinder>
+                <teilnehmerzahl>4</teilnehmerzahl>
+                <dauer>60</dauer>
+            </training>
+        """))
+        assert training.tag == "Montag"
+        assert training.foerderung
+        assert training.gesamtfoerderung == 50
+        assert training.foerderkinder == 2
+        assert training.teilnehmerzahl == 4
+        assert training.dauer == 60
+        assert training.halleneinheiten is None
+
+    def test_rechnung_aus_xml(self):
+        rechnung = Rechnung.aus_xml(ET.fromstring("""
+            <rechnung>
+                <name>Familie Test</name>
+                <strasse>Teststraße 1</strasse>
+                <ort>12345 Teststadt</ort>
+                <kind>
+                    <name>Anna</name>
+                    <training>
+                        <tag>Dienstag</tag>
+                        <foerderung>nein</foerderung>
+                        <teilnehmerzahl>2</teilnehmerzahl>
+                        <dauer>40</dauer>
+                        <halleneinheiten>3</halleneinheiten>
+                    </training>
+                </kind>
+                <kind>
+                    <name>Max</name>
+                </kind>
+            </rechnung>
+        """))
+        assert rechnung.email is None
+        assert [kind.name for kind in rechnung.kinder] == ["Anna", "Max"]
+        assert rechnung.kinder[0].trainings[0].halleneinheiten == 3
+        assert rechnung.kinder[1].trainings == []
+
+    def test_fehler_mit_kontext(self):
+        with pytest.raises(TCSRechnungError) as exc_info:
+            Rechnung.aus_xml(ET.fromstring("""
+                <rechnung>
+                    <name>Familie Test</name>
+                    <strasse>Teststraße 1</strasse>
+                    <ort>12345 Teststadt</ort>
+                    <kind>
+                        <name>Anna</name>
+                        <training>
+                            <tag>Dienstag</tag>
+                            <foerderung>nein</foerderung>
+                            <teilnehmerzahl>zwei</teilnehmerzahl>
+                            <dauer>40</dauer>
+                        </training>
+                    </kind>
+                </rechnung>
+            """))
+        meldung = str(exc_info.value)
+        assert meldung.startswith("Fehler in Rechnung für 'Familie Test': ")
+        assert "Kind 'Anna'" in meldung
+        assert "<teilnehmerzahl>='zwei'" in meldung
+
+
+class TestSchreiber:
+    def test_schreibe_rechnung_matches_erstelle_rechnung(self):
+        root = ET.parse(Path(__file__).parent / "rechnungen.xml").getroot()
+        meta = Metadaten(root)
+        rechnung = Rechnung.aus_xml(root.findall("rechnung")[0])
+
+        teile: list[str] = []
+        schreibe_rechnung(teile.append, rechnung, 7, meta)
+        assert len(teile) > 1
+        assert "".join(teile) == erstelle_rechnung(rechnung, 7, meta)
+
+    def test_senken_write_all_files(self, tmp_path):
+        senken = [
+            tcsrechnung.TexSenke(str(tmp_path / "a.tex")),
+            tcsrechnung.EinzelTexSenke(str(tmp_path)),
+        ]
+        ergebnis = tcsrechnung.Ergebnis(1, "Familie Berger", None, [], "", None, 0.0)
+        fragment = "\\Posten{Montag}\n"
+        with Senken(senken) as ausgabe:
+            ausgabe.eintragen(Datensatz(ergebnis, "b", fragment, True, None, None))
+        for datei in ["a.tex", "b.tex"]:
+            assert (tmp_path / datei).read_text() == (
+                DOKUMENT_ANFANG + fragment + DOKUMENT_ENDE
+            )
+
+    def test_incomplete_sink(self):
+        class OhneEintragen(Senke):
+            pass
+
+        with pytest.raises(TypeError):
+            OhneEintragen()
+
+
+class TestPostenCache:
+    xml_path = Path(__file__).parent / "rechnungen.xml"
+
+    def training(self, tag: str = "Montag", gesamtfoerderung: int = 224) -> Training:
+        return Training(tag, True, gesamtfoerderung, 1, 4, 60, None)
+
+    def test_identical_trainings_hit(self):
+        meta = Metadaten(ET.parse(self.xml_path).getroot())
+        cache = PostenCache()
+        netto: list[int] = []
+        brutto: list[int] = []
+        erwartet_netto: list[int] = []
+        erwartet_brutto: list[int] = []
+        erwartet = erstelle_hallenposten(
+            self.training(), meta, erwartet_netto, erwartet_brutto
+        )
+
+        for _ in range(3):
+            posten = cache.posten(
+                erstelle_hallenposten, self.training(), meta, netto, brutto
+            )
+            assert posten == erwartet
+        assert netto == erwartet_netto * 3
+        assert brutto == erwartet_brutto * 3
+        assert (cache.treffer, cache.fehlgriffe) == (2, 1)
+        assert cache.trefferquote() == pytest.approx(2 / 3)
+
+        cache.posten(erstelle_posten, self.training(), meta, netto, brutto)
+        cache.posten(erstelle_hallenposten, self.training("Dienstag"), meta, [], [])
+        assert cache.fehlgriffe == 3
+
+    def test_no_sharing_between_metadaten(self):
+        root = ET.parse(self.xml_path).getroot()
+        cache = PostenCache()
+        for meta in [Metadaten(root), Metadaten(root)]:
+            cache.posten(erstelle_hallenposten, self.training(), meta, [], [])
+        assert (cache.treffer, cache.fehlgriffe) == (0, 2)
+
+    def test_bounded(self):
+        meta = Metadaten(ET.parse(self.xml_path).getroot())
+        cache = PostenCache(groesse=2)
+        for tag in ["Montag", "Dienstag", "Mittwoch"]:
+            cache.posten(erstelle_hallenposten, self.training(tag), meta, [], [])
+        assert len(cache.eintraege) == 2
+
+        # The oldest entry was dropped
+        cache.posten(erstelle_hallenposten, self.training("Montag"), meta, [], [])
+        assert cache.treffer == 0
+
+    def test_errors_not_cached(self):
+        meta = Metadaten(ET.parse(self.xml_path).getroot())
+        cache = PostenCache()
+        # 100 is no multiple of the hourly rate
+        training = self.training(gesamtfoerderung=100)
+        for _ in range(2):
+            with pytest.raises(TCSRechnungError):
+                cache.posten(erstelle_posten, training, meta, [], [])
+        assert cache.fehlgriffe == 2
+        assert cache.eintraege == {}
+
+    def test_timings_report_hit_rate(self, tmp_path):
+        tcsrechnung.POSTEN_CACHE.leeren()
+        bericht_datei = tmp_path / "timings.json"
+        run_in(tmp_path / "out", self.xml_path, ["--timings", str(bericht_datei)])
+
+        posten_cache = json.loads(bericht_datei.read_text())["posten_cache"]
+        assert posten_cache["fehlgriffe"] > 0
+        assert posten_cache["treffer"] > 0
+        assert 0 < posten_cache["trefferquote"] < 1
+
+
+class TestGruppen:
+    xml_path = Path(__file__).parent / "rechnungen.xml"
+
+    def rechnung(self, name: str, *trainings: Training) -> Rechnung:
+        kind = Kind("Kind", list(trainings))
+        return Rechnung(name, "Weg 1", "12345 Ort", None, [kind])
+
+    def test_consistent_groups(self):
+        gefoerdert = Training("Montag", True, 224, 2, 3, 60, None)
+        selbstzahler = Training("Montag", False, 0, 0, 3, 60, None)
+        einzeln = Training("Dienstag", True, 48, 1, 1, 60, None)
+        rechnungen = [
+            self.rechnung("A", gefoerdert, einzeln),
+            self.rechnung("B", gefoerdert),
+            self.rechnung("C", selbstzahler, einzeln),
+        ]
+        assert pruefe_gruppen(rechnungen) == []
+
+    def test_wrong_member_count(self):
+        training = Training("Montag", False, 0, 0, 3, 60, None)
+        meldungen = pruefe_gruppen(
+            [self.rechnung("A", training), self.rechnung("B", training)]
+        )
+        assert meldungen == [
+            "Gruppe Montag 60 Minuten: 2 Teilnehmer, aber teilnehmerzahl=3"
+            " (A: Kind, B: Kind)"
+        ]
+
+    def test_wrong_foerderkinder(self):
+        rechnungen = [
+            self.rechnung("A", Training("Montag", True, 224, 2, 2, 60, None)),
+            self.rechnung("B", Training("Montag", True, 224, 1, 2, 60, None)),
+        ]
+        meldungen = pruefe_gruppen(rechnungen)
+        assert len(meldungen) == 1
+        assert "Förderung 224: 2 geförderte Teilnehmer" in meldungen[0]
+        assert "foerderkinder=1, 2" in meldungen[0]
+
+    def test_warnings_before_output(self, tmp_path, capsys, monkeypatch):
+        warnung = "Warnung: Gruppe Dienstag 40 Minuten: 1 Teilnehmer"
+        run(["--check", str(self.xml_path)])
+        assert warnung in capsys.readouterr().err
+
+        # Reported on stderr before the output folders are created
+        ausgaben = []
+        makedirs = os.makedirs
+
+        def pruefe_makedirs(*args, **kwargs):
+            ausgaben.append(capsys.readouterr())
+            makedirs(*args, **kwargs)
+
+        monkeypatch.setattr(tcsrechnung.os, "makedirs", pruefe_makedirs)
+        run_in(tmp_path / "out", self.xml_path)
+        assert warnung in ausgaben[0].err
+        assert "Warnung" not in ausgaben[0].out
+
+        # Groups span the whole file, which --stream does not hold at once
+        monkeypatch.undo()
+        run_in(tmp_path / "stream", self.xml_path, ["--stream"])
+        assert "Warnung" not in capsys.readouterr().err
+
+
+class TestCheck:
+    xml_path = Path(__file__).parent / "rechnungen.xml"
+
+    def create_broken_xml(self, tmp_path: Path) -> Path:
+        root = ET.parse(self.xml_path).getroot()
+        erste, zweite = root.findall("rechnung")
+        trainings = erste.findall("kind")[0].findall("training")
+        dauer = trainings[0].find("dauer")
+        tag = trainings[1].find("tag")
+        halleneinheiten = trainings[1].find("halleneinheiten")
+        strasse = zweite.find("strasse")
+        email = zweite.find("email")
+        erste_email = erste.findtext("email")
+        assert dauer is not None and tag is not None and halleneinheiten is not None
+        assert strasse is not None and email is not None and erste_email is not None
+        dauer.text = "zehn"
+        # The weekday is only needed without <halleneinheiten>
+        tag.text = "Feiertag"
+        trainings[1].remove(halleneinheiten)
+        zweite.remove(strasse)
+        email.text = erste_email.upper()
+        kaputt = tmp_path / "kaputt.xml"
+        ET.ElementTree(root).write(kaputt, encoding="utf-8")
+        return kaputt
+
+    def test_check_valid_file(self, tmp_path, monkeypatch, capsys):
+        monkeypatch.chdir(tmp_path)
+        run(["--check", str(self.xml_path)])
+        assert "2 Rechnungen geprüft, keine Fehler" in capsys.readouterr().out
+        assert list(tmp_path.iterdir()) == []
+
+    @pytest.mark.parametrize("jobs", ["1", "2"])
+    def test_check_collects_all_errors(self, tmp_path, capsys, jobs):
+        kaputt = self.create_broken_xml(tmp_path)
+        with pytest.raises(TCSRechnungError) as exc_info:
+            run(["--check", "-j", jobs, str(kaputt)])
+        assert str(exc_info.value) == "4 Fehler in 2 von 2 Rechnungen"
+
+        fehler = capsys.readouterr().err.splitlines()
+        assert fehler[0].startswith(
+            "Rechnung 1 'Familie Berger', Kind 'Leon', Training 1: Element <dauer>"
+        )
+        assert (
+            fehler[1]
+            == "Rechnung 1 'Familie Berger', Kind 'Leon', Training 2: Ungültiger"
+            " Wochentag <tag>=Feiertag"
+        )
+        assert "Element <strasse> in Block <rechnung> fehlt" in fehler[2]
+        assert "schon in Rechnung 1" in fehler[3]
+
+    def test_check_finds_first_error_of_normal_run(self, tmp_path, capsys):
+        kaputt = self.create_broken_xml(tmp_path)
+        with pytest.raises(TCSRechnungError) as exc_info:
+            run_in(tmp_path / "out", kaputt)
+        assert "<dauer>='zehn'" in str(exc_info.value)
+
+        with pytest.raises(TCSRechnungError):
+            run(["--check", str(kaputt)])
+        assert "<dauer>='zehn'" in capsys.readouterr().err
+
+    @pytest.mark.parametrize("jobs", ["1", "2"])
+    @pytest.mark.parametrize("feld", ["foerderkinder", "teilnehmerzahl"])
+    def test_check_zero_group_values(self, tmp_path, capsys, jobs, feld):
+        root = ET.parse(self.xml_path).getroot()
+        # foerderkinder only exists with funding, teilnehmerzahl alone divides
+        # the price without funding
+        foerderung = "ja" if feld == "foerderkinder" else "nein"
+        for training in root.iter("training"):
+            if training.findtext("foerderung") == foerderung:
+                element = training.find(feld)
+                assert element is not None
+                element.text = "0"
+                break
+        kaputt = tmp_path / "kaputt.xml"
+        ET.ElementTree(root).write(kaputt, encoding="utf-8")
+        with pytest.raises(TCSRechnungError, match="1 Fehler in 1 von 2 Rechnungen"):
+            run(["--check", "-j", jobs, str(kaputt)])
+        assert f"<{feld}>=0, muss mindestens 1 sein" in capsys.readouterr().err
+
+        with pytest.raises(TCSRechnungError, match=f"<{feld}>=0"):
+            run_in(tmp_path / "out", kaputt)
+
+    def test_output_required_without_check(self):
+        with pytest.raises(SystemExit):
+            run([str(self.xml_path)])
+
+
+class TestNummernbuch:
+    xml_path = Path(__file__).parent / "rechnungen.xml"
+
+    def create_xml(
+        self, tmp_path: Path, name: str, rechnungen: list[ET.Element]
+    ) -> Path:
+        root = ET.parse(self.xml_path).getroot()
+        for rechnung in root.findall("rechnung"):
+            root.remove(rechnung)
+        root.extend(rechnungen)
+        datei = tmp_path / name
+        ET.ElementTree(root).write(datei, encoding="utf-8")
+        return datei
+
+    def test_same_as_without_ledger(self, tmp_path):
+        run_in(tmp_path / "ref", self.xml_path)
+        run_in(tmp_path / "nr", self.xml_path, ["--ledger", str(tmp_path / "nr.db")])
+        assert_same_output(tmp_path / "ref", tmp_path / "nr")
+
+    def test_numbers_stay_with_recipient(self, tmp_path):
+        ledger = ["--ledger", str(tmp_path / "nr.db")]
+        run_in(tmp_path / "erst", self.xml_path, ledger)
+
+        # Reordered, first recipient removed and a new one added
+        berger, krueger = ET.parse(self.xml_path).getroot().findall("rechnung")
+        neu = copy.deepcopy(berger)
+        neu.find("name").text = "Familie Neumann"
+        geaendert = self.create_xml(tmp_path, "geaendert.xml", [neu, krueger])
+        run_in(tmp_path / "zweit", geaendert, ledger)
+
+        erst = tmp_path / "erst" / "tex"
+        zweit = tmp_path / "zweit" / "tex"
+        (krueger_tex,) = erst.glob("??_0002.tex")
+        jahr = krueger_tex.name[:2]
+        assert sorted(f.name for f in zweit.glob("??_*.tex")) == [
+            f"{jahr}_0002.tex",
+            f"{jahr}_0003.tex",
+        ]
+        assert (zweit / krueger_tex.name).read_bytes() == krueger_tex.read_bytes()
+        assert "Familie Neumann" in (zweit / f"{jahr}_0003.tex").read_text()
+
+    def test_vergebe(self, tmp_path):
+        root = ET.parse(self.xml_path).getroot()
+        rechnungen = root.findall("rechnung")
+        meta = Metadaten(root)
+        buch = tcsrechnung.Nummernbuch(str(tmp_path / "nr.db"))
+
+        # <rechnungsnummer> is the lower bound for new numbers
+        assert buch.vergebe(rechnungen[1:], meta, 10) == [11]
+        assert buch.vergebe(rechnungen[::-1], meta, 0) == [11, 12]
+
+        # Spacing and case of name and address do not matter
+        rechnungen[0].find("name").text = "  familie   BERGER "
+        assert buch.vergebe(rechnungen, meta, 0) == [12, 11]
+
+        # A period keeps the year prefix of its first run
+        meta.jahr_cur = 2099
+        assert buch.vergebe(rechnungen, meta, 0) == [12, 11]
+        assert meta.jahr_cur == datetime.date.today().year
+
+    def test_duplicate_recipient(self, tmp_path, capsys):
+        berger, _ = ET.parse(self.xml_path).getroot().findall("rechnung")
+        # Same recipient up to spacing and case
+        zweiter = copy.deepcopy(berger)
+        name = zweiter.find("name")
+        assert name is not None
+        name.text = "familie  BERGER"
+        doppelt = self.create_xml(tmp_path, "doppelt.xml", [berger, zweiter])
+        with pytest.raises(TCSRechnungError, match="Rechnung 2 'familie  BERGER'"):
+            run_in(tmp_path / "out", doppelt, ["--ledger", str(tmp_path / "nr.db")])
+        # Nothing was written, so the corrected file can be run right away
+        assert not (tmp_path / "out").exists()
+
+        # Also the same email address
+        with pytest.raises(TCSRechnungError, match="2 Fehler in 1 von 2 Rechnungen"):
+            run(["--check", str(doppelt)])
+        assert "Gleicher Empfänger wie Rechnung 1" in capsys.readouterr().err
+
+    def test_concurrent_runs(self, tmp_path):
+        root = ET.parse(self.xml_path).getroot()
+        vorlage = root.findall("rechnung")[0]
+        meta = Metadaten(root)
+        rechnungen = []
+        for i in range(40):
+            rechnung = copy.deepcopy(vorlage)
+            rechnung.find("name").text = f"Familie {i}"
+            rechnungen.append(rechnung)
+
+        def vergebe(teil: int) -> list[int]:
+            buch = tcsrechnung.Nummernbuch(str(tmp_path / "nr.db"))
+            return [
+                nummer
+                for i in range(5)
+                for nummer in buch.vergebe(
+                    rechnungen[teil::4][i * 2 : (i + 1) * 2], meta, 0
+                )
+            ]
+
+        with concurrent.futures.ThreadPoolExecutor(4) as pool:
+            nummern = [n for teil in pool.map(vergebe, range(4)) for n in teil]
+        assert sorted(nummern) == list(range(1, 41))
+
+    def test_ledger_stream_rejected(self, tmp_path):
+        with pytest.raises(SystemExit):
+            run_in(
+                tmp_path,
+                self.xml_path,
+                ["--ledger", str(tmp_path / "nr.db"), "--stream"],
+            )
+
+
+class TestArchiv:
+    xml_path = Path(__file__).parent / "rechnungen.xml"
+
+    def lese(self, archiv: Path, abfrage: str) -> list[tuple]:
+        verbindung = sqlite3.connect(archiv)
+        try:
+            return verbindung.execute(abfrage).fetchall()
+        finally:
+            verbindung.close()
+
+    def test_archiv(self, tmp_path):
+        archiv = tmp_path / "archiv.db"
+        run_in(tmp_path / "ref", self.xml_path)
+        run_in(tmp_path / "arch", self.xml_path, ["--archiv", str(archiv)])
+        assert_same_output(tmp_path / "ref", tmp_path / "arch")
+
+        rechnungen = self.lese(
+            archiv,
+            "SELECT nummer, name, email, netto_cent, mwst_voll_cent, mwst_erm_cent,"
+            " brutto_cent, tex FROM rechnungen ORDER BY nummer",
+        )
+        assert [r[1:7] for r in rechnungen] == [
+            ("Familie Berger", "thomas.berger82@example.com", 20937, 0, 1464, 22401),
+            ("Herr Krüger", "sabine.krueger@mailtest.de", 9014, 0, 630, 9644),
+        ]
+        for nummer, *_, tex in rechnungen:
+            texfile = tmp_path / "ref" / "tex" / (nummer + ".tex")
+            assert DOKUMENT_ANFANG + tex + DOKUMENT_ENDE == texfile.read_text()
+
+        assert self.lese(archiv, "SELECT name FROM kinder ORDER BY rowid") == [
+            ("Leon",),
+            ("Lara",),
+            ("David",),
+            ("Mia",),
+            ("Jonas",),
+        ]
+        posten = self.lese(
+            archiv,
+            "SELECT kostentyp, tag, einheiten, stundenpreis_cent, teilnehmerzahl,"
+            " dauer, preis_cent, foerderung_cent, gesamt_cent FROM posten"
+            " ORDER BY rechnung, position",
+        )
+        assert len(posten) == 14
+        assert posten[0] == (
+            "Trainingskosten (Leon)",
+            "Dienstag",
+            5,
+            4538,
+            3,
+            60,
+            12101,
+            12101,
+            0,
+        )
+        assert posten[-1] == (
+            "Hallenkosten (Jonas)",
+            "Dienstag",
+            10,
+            1308,
+            3,
+            40,
+            2908,
+            0,
+            2908,
+        )
+
+    @pytest.mark.parametrize(
+        "extra", [["-j", "2"], ["--nosingle"], ["--incremental"], ["--stream"]]
+    )
+    def test_same_archive_with_options(self, tmp_path, extra):
+        abfrage = "SELECT zeitraum, nummer, name, brutto_cent, tex FROM rechnungen"
+        run_in(tmp_path / "ref", self.xml_path, ["--archiv", str(tmp_path / "a.db")])
+        # With --incremental the second run takes all invoices from the tex files
+        # of the first one
+        for _ in range(2 if "--incremental" in extra else 1):
+            run_in(
+                tmp_path / "opt",
+                self.xml_path,
+                ["--archiv", str(tmp_path / "b.db")] + extra,
+            )
+        assert self.lese(tmp_path / "a.db", abfrage) == self.lese(
+            tmp_path / "b.db", abfrage
+        )
+
+    def test_rerun_keeps_superseded(self, tmp_path):
+        archiv = tmp_path / "archiv.db"
+        abfrage = (
+            "SELECT nummer, revision, aktuell, name FROM rechnungen"
+            " ORDER BY nummer, revision"
+        )
+        run_in(tmp_path / "erst", self.xml_path, ["--archiv", str(archiv)])
+        # An unchanged rerun adds nothing
+        run_in(tmp_path / "gleich", self.xml_path, ["--archiv", str(archiv)])
+        jahr = str(datetime.date.today().year - 2000)
+        assert [r[1:] for r in self.lese(archiv, abfrage)] == [
+            (1, 1, "Familie Berger"),
+            (1, 1, "Herr Krüger"),
+        ]
+
+        # Without the first invoice Krüger gets its number
+        root = ET.parse(self.xml_path).getroot()
+        root.remove(root.findall("rechnung")[0])
+        gekuerzt = tmp_path / "gekuerzt.xml"
+        ET.ElementTree(root).write(gekuerzt, encoding="utf-8")
+        run_in(tmp_path / "zweit", gekuerzt, ["--archiv", str(archiv)])
+        assert self.lese(archiv, abfrage) == [
+            (jahr + "_0001", 1, 0, "Familie Berger"),
+            (jahr + "_0001", 2, 1, "Herr Krüger"),
+            (jahr + "_0002", 1, 0, "Herr Krüger"),
+        ]
+        assert self.lese(archiv, "SELECT COUNT(*) FROM kinder") == [(7,)]
+        assert self.lese(archiv, "SELECT COUNT(*) FROM posten") == [(16,)]
+
+        # Other periods stay
+        root.find("bis").text = "November"
+        anderer = tmp_path / "anderer.xml"
+        ET.ElementTree(root).write(anderer, encoding="utf-8")
+        run_in(tmp_path / "dritt", anderer, ["--archiv", str(archiv)])
+        assert self.lese(
+            archiv,
+            "SELECT zeitraum, COUNT(*) FROM rechnungen WHERE aktuell = 1"
+            " GROUP BY zeitraum",
+        ) == [("2024_10-11", 1), ("2024_10-12", 1)]
+
+    @pytest.mark.parametrize("extra", [[], ["--threads"]])
+    def test_failed_run_keeps_archive(self, tmp_path, extra):
+        archiv = tmp_path / "archiv.db"
+        run_in(tmp_path / "erst", self.xml_path, ["--archiv", str(archiv)])
+
+        # The second invoice fails after the first one was archived
+        root = ET.parse(self.xml_path).getroot()
+        training = root.findall("rechnung")[1].find("kind").find("training")
+        training.find("foerderung").text = "ja"
+        training.find("foerderbetrag_gruppe").text = "100"
+        training.find("foerderkinder").text = "1"
+        kaputt = tmp_path / "kaputt.xml"
+        ET.ElementTree(root).write(kaputt, encoding="utf-8")
+        with pytest.raises(TCSRechnungError, match="Herr Krüger"):
+            run_in(tmp_path / "zweit", kaputt, ["--archiv", str(archiv)] + extra)
+        assert self.lese(archiv, "SELECT COUNT(*) FROM rechnungen") == [(2,)]
+        assert self.lese(archiv, "SELECT COUNT(*) FROM posten") == [(14,)]
+
+
+# Stand-in for latexmk: writes <outdir>/<name>.pdf and logs the compiled files
+FAKE_LATEXMK = """
+import sys, os
+outdir = [a for a in sys.argv if a.startswith("-outdir=")][0][len("-outdir="):]
+name = os.path.splitext(os.path.basename(sys.argv[-1]))[0]
+with open(os.path.join(outdir, name + ".pdf"), "w") as f:
+    f.write("pdf " + name)
+with open(os.path.join(os.path.dirname(__file__), "latexmk.log"), "a") as f:
+    f.write(name + "\\n")
+"""
+
+
+class TestSenken:
+    xml_path = Path(__file__).parent / "rechnungen.xml"
+
+    def test_jsonl_und_buchhaltung(self, tmp_path):
+        run_in(
+            tmp_path / "out",
+            self.xml_path,
+            [
+                "--jsonl",
+                str(tmp_path / "r.jsonl"),
+                "--buchhaltung",
+                str(tmp_path / "b.csv"),
+            ],
+        )
+        jahr = str(datetime.date.today().year - 2000)
+        zeilen = [
+            json.loads(zeile)
+            for zeile in (tmp_path / "r.jsonl").read_text().splitlines()
+        ]
+        assert [(z["nummer"], z["name"], z["kinder"]) for z in zeilen] == [
+            (jahr + "_0001", "Familie Berger", ["Leon", "Lara", "David"]),
+            (jahr + "_0002", "Herr Krüger", ["Mia", "Jonas"]),
+        ]
+        assert zeilen[0]["zeitraum"] == "2024_10-12"
+        assert zeilen[0]["email"] == "thomas.berger82@example.com"
+        assert [
+            zeilen[0][k]
+            for k in ["netto_cent", "mwst_voll_cent", "mwst_erm_cent", "brutto_cent"]
+        ] == [20937, 0, 1464, 22401]
+        assert len(zeilen[0]["posten"]) + len(zeilen[1]["posten"]) == 14
+        assert zeilen[1]["posten"][-1] == {
+            "kostentyp": "Hallenkosten (Jonas)",
+            "tag": "Dienstag",
+            "einheiten": 10,
+            "stundenpreis_cent": 1308,
+            "teilnehmerzahl": 3,
+            "dauer": 40,
+            "preis_cent": 2908,
+            "foerderung_cent": 0,
+            "gesamt_cent": 2908,
+        }
+
+        assert (tmp_path / "b.csv").read_text().splitlines() == [
+            "Belegnummer;Zeitraum;Name;Netto 19%;MwSt 19%;Netto 7%;MwSt 7%;Brutto",
+            jahr + "_0001;2024_10-12;Familie Berger;0,00;0,00;209,37;14,64;224,01",
+            jahr + "_0002;2024_10-12;Herr Krüger;0,00;0,00;90,14;6,30;96,44",
+        ]
+
+    @pytest.mark.parametrize(
+        "extra", [[], ["-j", "2"], ["--nosingle"], ["--incremental"], ["--stream"]]
+    )
+    def test_threads_same_output(self, tmp_path, extra):
+        for ziel, threads in [("seriell", []), ("threads", ["--threads"])]:
+            # With --incremental the second run takes all invoices from the tex
+            # files of the first one
+            for _ in range(2 if "--incremental" in extra else 1):
+                run_in(
+                    tmp_path / ziel,
+                    self.xml_path,
+                    [
+                        "--jsonl",
+                        str(tmp_path / ziel / "r.jsonl"),
+                        "--buchhaltung",
+                        str(tmp_path / ziel / "b.csv"),
+                    ]
+                    + extra
+                    + threads,
+                )
+        assert_same_output(tmp_path / "seriell", tmp_path / "threads")
+        for datei in ["r.jsonl", "b.csv"]:
+            assert (tmp_path / "seriell" / datei).read_bytes() == (
+                tmp_path / "threads" / datei
+            ).read_bytes()
+
+    def test_posten_only_if_needed(self, tmp_path, monkeypatch):
+        aufrufe = []
+        schreibe_rechnung = tcsrechnung.schreibe_rechnung
+
+        def zaehle(*args):
+            aufrufe.append(args[5] is not None)
+            return schreibe_rechnung(*args)
+
+        monkeypatch.setattr(tcsrechnung, "schreibe_rechnung", zaehle)
+        run_in(tmp_path / "out", self.xml_path)
+        assert aufrufe == [False, False]
+        aufrufe.clear()
+        run_in(
+            tmp_path / "alle",
+            self.xml_path,
+            [
+                "--archiv",
+                str(tmp_path / "a.db"),
+                "--jsonl",
+                str(tmp_path / "r.jsonl"),
+                "--buchhaltung",
+                str(tmp_path / "b.csv"),
+            ],
+        )
+        assert aufrufe == [True, True]
+
+    def test_incremental_posten_of_unchanged(self, tmp_path):
+        # Unchanged invoices keep their single file but still carry line items
+        for jsonl in ["r1.jsonl", "r2.jsonl"]:
+            run_in(
+                tmp_path / "out",
+                self.xml_path,
+                ["--incremental", "--jsonl", str(tmp_path / jsonl)],
+            )
+        assert (tmp_path / "r1.jsonl").read_text() == (
+            tmp_path / "r2.jsonl"
+        ).read_text()
+
+    @pytest.mark.parametrize("threads", [False, True])
+    def test_sink_error_closes_all_sinks(self, tmp_path, threads):
+        class Kaputt(Senke):
+            def eintragen(self, datensatz):
+                if datensatz.name == "2":
+                    raise TCSRechnungError("Platte voll")
+
+        class Protokoll(Senke):
+            def __init__(self):
+                self.namen = []
+                self.fehler = "offen"
+
+            def __exit__(self, typ, *_):
+                self.fehler = typ
+
+            def eintragen(self, datensatz):
+                self.namen.append(datensatz.name)
+
+        protokoll = Protokoll()
+        ergebnis = tcsrechnung.Ergebnis(1, "Familie Berger", None, [], "", None, 0.0)
+        with pytest.raises(TCSRechnungError, match="Platte voll"):
+            with Senken([protokoll, Kaputt()], threads=threads) as senken:
+                for name in ["1", "2", "3"]:
+                    senken.eintragen(Datensatz(ergebnis, name, "", True, None, None))
+        # The threads stop writing after the first error
+        if not threads:
+            assert protokoll.namen == ["1", "2"]
+        assert protokoll.fehler is TCSRechnungError
+
+    def test_watch_not_with_sinks(self, tmp_path):
+        for extra in [["--jsonl", "r.jsonl"], ["--report", "r.csv"], ["--threads"]]:
+            with pytest.raises(SystemExit):
+                run_in(tmp_path, self.xml_path, ["--watch"] + extra)
+
+
+class TestSepa:
+    xml_path = Path(__file__).parent / "rechnungen.xml"
+    ns = {"p": "urn:iso:std:iso:20022:tech:xsd:pain.008.001.02"}
+
+    @pytest.fixture
+    def eingabe(self, tmp_path):
+        root = ET.parse(self.xml_path).getroot()
+        lastschrift = ET.Element("lastschrift")
+        for feld, wert in [
+            ("name", "TC Süd & Partner"),
+            ("iban", "DE02 1203 0000 0000 2020 51"),
+            ("bic", "BYLADEM1001"),
+            ("glaeubiger_id", "DE98ZZZ09999999999"),
+            ("faelligkeit", "15-01-2025"),
+        ]:
+            ET.SubElement(lastschrift, feld).text = wert
+        root.insert(0, lastschrift)
+        rechnungen = root.findall("rechnung")
+        for rechnung, felder in [
+            (
+                rechnungen[0],
+                [
+                    ("iban", "de89 3704 0044 0532 0130 00"),
+                    ("bic", "COBADEFFXXX"),
+                    ("mandatsreferenz", "TCS-0001"),
+                    ("mandatsdatum", "01-03-2023"),
+                ],
+            ),
+            (
+                rechnungen[1],
+                [
+                    ("iban", "DE02120300000000202051"),
+                    ("mandatsreferenz", "TCS-0002"),
+                    ("mandatsdatum", "15-09-2024"),
+                    ("kontoinhaber", "Sabine <Krüger>"),
+                ],
+            ),
+        ]:
+            for feld, wert in felder:
+                ET.SubElement(rechnung, feld).text = wert
+        eingabe = tmp_path / "lastschrift.xml"
+        ET.ElementTree(root).write(eingabe, encoding="utf-8")
+        return eingabe
+
+    def buchungen(self, datei: Path) -> list[tuple[str | None, ...]]:
+        root = ET.parse(datei).getroot()
+        return [
+            tuple(
+                tx.findtext(pfad, namespaces=self.ns)
+                for pfad in [
+                    "p:PmtId/p:EndToEndId",
+                    "p:InstdAmt",
+                    "p:DrctDbtTx/p:MndtRltdInf/p:MndtId",
+                    "p:DrctDbtTx/p:MndtRltdInf/p:DtOfSgntr",
+                    "p:DbtrAgt/p:FinInstnId/p:BIC",
+                    "p:Dbtr/p:Nm",
+                    "p:DbtrAcct/p:Id/p:IBAN",
+                ]
+            )
+            for tx in root.iterfind(".//p:DrctDbtTxInf", self.ns)
+        ]
+
+    def test_sepa(self, tmp_path, eingabe):
+        run_in(tmp_path / "ref", eingabe)
+        run_in(tmp_path / "sepa", eingabe, ["--sepa", str(tmp_path / "lastschriften")])
+        assert_same_output(tmp_path / "ref", tmp_path / "sepa")
+
+        (datei,) = (tmp_path / "lastschriften").iterdir()
+        assert datei.name == "lastschriften_2024_10-12_001.xml"
+        jahr = str(datetime.date.today().year - 2000)
+        assert self.buchungen(datei) == [
+            (
+                jahr + "-0001",
+                "224.01",
+                "TCS-0001",
+                "2023-03-01",
+                "COBADEFFXXX",
+                "Familie Berger",
+                "DE89370400440532013000",
+            ),
+            (
+                jahr + "-0002",
+                "96.44",
+                "TCS-0002",
+                "2024-09-15",
+                None,
+                "Sabine <Krüger>",
+                "DE02120300000000202051",
+            ),
+        ]
+        root = ET.parse(datei).getroot()
+        for block in ["p:CstmrDrctDbtInitn/p:GrpHdr", ".//p:PmtInf"]:
+            assert root.findtext(block + "/p:NbOfTxs", namespaces=self.ns) == "2"
+            assert root.findtext(block + "/p:CtrlSum", namespaces=self.ns) == "320.45"
+        assert root.findtext(".//p:ReqdColltnDt", namespaces=self.ns) == "2025-01-15"
+        glaeubiger = root.findtext(".//p:Cdtr/p:Nm", namespaces=self.ns)
+        assert glaeubiger == "TC Süd & Partner"
+        assert (
+            root.findtext(".//p:RmtInf/p:Ustrd", namespaces=self.ns)
+            == f"Rechnung {jahr}/0001 Oktober bis Dezember 2024"
+        )
+
+    def test_chunks(self, tmp_path, eingabe):
+        ordner = tmp_path / "lastschriften"
+        run_in(tmp_path / "a", eingabe, ["--sepa", str(ordner), "--sepa-max", "1"])
+        dateien = sorted(ordner.iterdir())
+        assert [d.name[-7:] for d in dateien] == ["001.xml", "002.xml"]
+        assert [tcsrechnung.pruefe_sepa(str(d)) for d in dateien] == [
+            (1, 22401),
+            (1, 9644),
+        ]
+
+        # A second run for the same period replaces all files of the first one
+        run_in(tmp_path / "b", eingabe, ["--sepa", str(ordner), "--stream"])
+        assert [d.name[-7:] for d in ordner.iterdir()] == ["001.xml"]
+        assert tcsrechnung.pruefe_sepa(str(ordner / dateien[0].name)) == (2, 32045)
+
+    def test_unique_ids(self, tmp_path, eingabe):
+        kennungen = []
+        for ziel in ["a", "b"]:
+            ordner = tmp_path / ziel / "l"
+            run_in(tmp_path / ziel, eingabe, ["--sepa", str(ordner)])
+            (datei,) = ordner.iterdir()
+            root = ET.parse(datei).getroot()
+            kennung = root.findtext(".//p:GrpHdr/p:MsgId", namespaces=self.ns)
+            assert kennung is not None and len(kennung) <= 35
+            assert root.findtext(".//p:PmtInfId", namespaces=self.ns) == kennung
+            kennungen.append(kennung)
+            # Only characters of the SEPA character set in all identifiers
+            for elem in root.iter():
+                if elem.tag.split("}")[1] in ["MsgId", "PmtInfId", "EndToEndId"]:
+                    assert re.fullmatch(r"[A-Za-z0-9/?:().,'+ -]+", elem.text or "")
+        assert kennungen[0] != kennungen[1]
+
+    def test_only_invoices_with_mandate(self, tmp_path, eingabe):
+        root = ET.parse(eingabe).getroot()
+        zweite = root.findall("rechnung")[1]
+        for feld in ["iban", "mandatsreferenz", "mandatsdatum", "kontoinhaber"]:
+            zweite.remove(zweite.find(feld))
+        ET.ElementTree(root).write(eingabe, encoding="utf-8")
+        run_in(tmp_path / "out", eingabe, ["--sepa", str(tmp_path / "l")])
+        (datei,) = (tmp_path / "l").iterdir()
+        assert [b[0][-4:] for b in self.buchungen(datei)] == ["0001"]
+
+    def test_pruefe_sepa_mismatch(self, tmp_path, eingabe):
+        run_in(tmp_path / "out", eingabe, ["--sepa", str(tmp_path / "l")])
+        (datei,) = (tmp_path / "l").iterdir()
+        xml = datei.read_text(encoding="utf-8")
+        datei.write_text(
+            xml.replace("<CtrlSum>320.45</CtrlSum>", "<CtrlSum>320.46</CtrlSum>", 1),
+            encoding="utf-8",
+        )
+        with pytest.raises(TCSRechnungError, match="320.46 EUR an, enthalten sind 2"):
+            tcsrechnung.pruefe_sepa(str(datei))
+
+    def test_failed_run_keeps_files(self, tmp_path, eingabe):
+        ordner = tmp_path / "lastschriften"
+        run_in(tmp_path / "erst", eingabe, ["--sepa", str(ordner), "--sepa-max", "1"])
+        vorher = {d.name: d.read_bytes() for d in ordner.iterdir()}
+
+        # The second invoice fails after the first one was written
+        root = ET.parse(eingabe).getroot()
+        training = root.findall("rechnung")[1].find("kind").find("training")
+        training.find("foerderung").text = "ja"
+        training.find("foerderbetrag_gruppe").text = "100"
+        training.find("foerderkinder").text = "1"
+        ET.ElementTree(root).write(eingabe, encoding="utf-8")
+        with pytest.raises(TCSRechnungError, match="Herr Krüger"):
+            run_in(tmp_path / "zweit", eingabe, ["--sepa", str(ordner)])
+        assert {d.name: d.read_bytes() for d in ordner.iterdir()} == vorher
+
+    @pytest.mark.parametrize(
+        "feld, wert, meldung",
+        [
+            ("iban", "DE89370400440532013001", "keine gültige IBAN"),
+            ("bic", "COBA", "keine gültige BIC"),
+            ("mandatsreferenz", "TCS_0001", "ungültige Zeichen"),
+            ("mandatsdatum", "2023-03-01", "ungültiges Format"),
+        ],
+    )
+    def test_invalid_mandate(self, tmp_path, eingabe, capsys, feld, wert, meldung):
+        root = ET.parse(eingabe).getroot()
+        root.findall("rechnung")[0].find(feld).text = wert
+        ET.ElementTree(root).write(eingabe, encoding="utf-8")
+        with pytest.raises(TCSRechnungError, match=meldung):
+            run_in(tmp_path / "out", eingabe)
+        with pytest.raises(TCSRechnungError):
+            run(["--check", str(eingabe)])
+        assert meldung in capsys.readouterr().err
+
+    def test_glaeubiger(self, tmp_path, eingabe):
+        root = ET.parse(eingabe).getroot()
+        root.find("lastschrift").find("glaeubiger_id").text = "DE99ZZZ09999999999"
+        ET.ElementTree(root).write(eingabe, encoding="utf-8")
+        with pytest.raises(TCSRechnungError, match="Gläubiger-Identifikationsnummer"):
+            run_in(tmp_path / "a", eingabe, ["--sepa", str(tmp_path / "l")])
+        with pytest.raises(TCSRechnungError, match="<lastschrift> in <data> fehlt"):
+            run_in(tmp_path / "b", self.xml_path, ["--sepa", str(tmp_path / "l")])
+        # Both errors are found before any output folder is created
+        assert sorted(p.name for p in tmp_path.iterdir()) == ["lastschrift.xml"]
+
+
+class TestBericht:
+    xml_path = Path(__file__).parent / "rechnungen.xml"
+
+    def test_csv(self, tmp_path, capsys):
+        run_in(tmp_path / "out", self.xml_path, ["--report", str(tmp_path / "r.csv")])
+        assert (tmp_path / "r.csv").read_text().splitlines() == [
+            "Bereich;Schlüssel;Anzahl;Betrag",
+            "Umsatz;Netto 19%;;0,00",
+            "Umsatz;MwSt 19%;;0,00",
+            "Umsatz;Netto 7%;;299,51",
+            "Umsatz;MwSt 7%;;20,94",
+            "Umsatz;Brutto;2;320,45",
+            "Förderung;Dienstag 60 Minuten;3;363,03",
+            "Förderung;Mittwoch 60 Minuten;3;605,04",
+            "Halle;Dienstag;36;142,49",
+            "Halle;Mittwoch;12;157,02",
+            "Empfänger;Familie;1;224,01",
+            "Empfänger;Herr;1;96,44",
+        ]
+        assert (
+            "Bericht 2024_10-12: 2 Rechnungen, brutto 320,45 EUR"
+            in capsys.readouterr().err
+        )
+
+    @pytest.mark.parametrize(
+        "extra", [["-j", "2"], ["--stream"], ["--threads"], ["--incremental"]]
+    )
+    def test_json_same_for_all_modes(self, tmp_path, extra):
+        run_in(tmp_path / "a", self.xml_path, ["--report", str(tmp_path / "a.json")])
+        for _ in range(2 if "--incremental" in extra else 1):
+            run_in(
+                tmp_path / "b",
+                self.xml_path,
+                ["--report", str(tmp_path / "b.json")] + extra,
+            )
+        bericht = json.loads((tmp_path / "a.json").read_text())
+        assert json.loads((tmp_path / "b.json").read_text()) == bericht
+        assert bericht["umsatz"] == {
+            "netto_voll_cent": 0,
+            "mwst_voll_cent": 0,
+            "netto_erm_cent": 29951,
+            "mwst_erm_cent": 2094,
+            "brutto_cent": 32045,
+        }
+        assert bericht["halle"] == [
+            {"tag": "Dienstag", "einheiten": 36, "netto_cent": 14249},
+            {"tag": "Mittwoch", "einheiten": 12, "netto_cent": 15702},
+        ]
+
+    def test_sonstige_empfaenger(self, tmp_path):
+        root = ET.parse(self.xml_path).getroot()
+        root.findall("rechnung")[1].find("name").text = "Förderverein Süd"
+        eingabe = tmp_path / "rechnungen.xml"
+        ET.ElementTree(root).write(eingabe, encoding="utf-8")
+        run_in(tmp_path / "out", eingabe, ["--report", str(tmp_path / "r.json")])
+        bericht = json.loads((tmp_path / "r.json").read_text())
+        assert bericht["empfaenger"] == [
+            {"typ": "Familie", "rechnungen": 1, "brutto_cent": 22401},
+            {"typ": "Sonstige", "rechnungen": 1, "brutto_cent": 9644},
+        ]
+
+    def test_unknown_weekday(self, tmp_path):
+        # Hall units given explicitly allow days outside the weekday list
+        root = ET.parse(self.xml_path).getroot()
+        root.find("rechnung").find("kind").find("training").find("tag").text = "Mo"
+        eingabe = tmp_path / "rechnungen.xml"
+        ET.ElementTree(root).write(eingabe, encoding="utf-8")
+        run_in(tmp_path / "out", eingabe, ["--report", str(tmp_path / "r.csv")])
+        zeilen = (tmp_path / "r.csv").read_text().splitlines()
+        assert [z.split(";")[1] for z in zeilen if z.startswith("Halle")] == [
+            "Dienstag",
+            "Mittwoch",
+            "Mo",
+        ]
+
+    def test_no_report_on_error(self, tmp_path):
+        class Kaputt(Senke):
+            def eintragen(self, datensatz):
+                raise TCSRechnungError("Platte voll")
+
+        meta = tcsrechnung.Metadaten(ET.parse(self.xml_path).getroot())
+        bericht = tcsrechnung.BerichtSenke(str(tmp_path / "r.csv"), meta)
+        ergebnis = tcsrechnung.Ergebnis(1, "Familie Berger", None, [], "", None, 0.0)
+        summen = tcsrechnung.Summen(0, 0, 0, 0)
+        with pytest.raises(TCSRechnungError):
+            with Senken([bericht, Kaputt()]) as senken:
+                senken.eintragen(Datensatz(ergebnis, "1", "", True, [], summen))
+        assert not (tmp_path / "r.csv").exists()
+
+
+class TestWatch:
+    xml_path = Path(__file__).parent / "rechnungen.xml"
+
+    def create_beobachter(self, tmp_path: Path, **kwargs) -> Beobachter:
+        eingabe = tmp_path / "rechnungen.xml"
+        eingabe.write_bytes(self.xml_path.read_bytes())
+        return Beobachter(
+            str(eingabe),
+            str(tmp_path / "watch" / "tex"),
+            str(tmp_path / "watch" / "mails"),
+            **kwargs,
+        )
+
+    def aendere(self, beobachter: Beobachter, alt: str, neu: str) -> None:
+        eingabe = Path(beobachter.eingabedatei)
+        eingabe.write_text(eingabe.read_text().replace(alt, neu, 1))
+
+    def test_first_pass_matches_run(self, tmp_path):
+        beobachter = self.create_beobachter(tmp_path)
+        assert len(beobachter.aktualisiere()) == 2
+        assert beobachter.aktualisiere() == []
+
+        run_in(tmp_path / "normal", Path(beobachter.eingabedatei))
+        assert_same_output(tmp_path / "normal", tmp_path / "watch")
+
+    def test_only_changed_invoice_rendered(self, tmp_path):
+        beobachter = self.create_beobachter(tmp_path)
+        beobachter.aktualisiere()
+        tex = tmp_path / "watch" / "tex"
+        unveraendert = sorted(tex.glob("*_0001.tex"))[0]
+        os.utime(unveraendert, (0, 0))
+
+        self.aendere(beobachter, "Hauptstraße", "Nebenstraße")
+        neu = beobachter.aktualisiere()
+        assert [name[-4:] for name in neu] == ["0002"]
+        assert unveraendert.stat().st_mtime == 0
+
+        run_in(tmp_path / "normal", Path(beobachter.eingabedatei))
+        assert_same_output(tmp_path / "normal", tmp_path / "watch")
+
+    def test_removed_invoice_deleted(self, tmp_path):
+        beobachter = self.create_beobachter(tmp_path)
+        beobachter.aktualisiere()
+        root = ET.parse(beobachter.eingabedatei).getroot()
+        root.remove(root.findall("rechnung")[1])
+        ET.ElementTree(root).write(beobachter.eingabedatei, encoding="utf-8")
+
+        assert beobachter.aktualisiere() == []
+        tex = tmp_path / "watch" / "tex"
+        assert len([f for f in tex.glob("*.tex") if "rechnungen_" not in f.name]) == 1
+
+    def test_loop_survives_errors(self, tmp_path, monkeypatch, capsys):
+        monkeypatch.setattr(tcsrechnung.time, "sleep", lambda _: None)
+        beobachter = self.create_beobachter(tmp_path)
+        beobachte(beobachter, runden=2)
+        assert "2 von 2 Rechnungen neu erstellt" in capsys.readouterr().out
+
+        self.aendere(beobachter, "<dauer>60</dauer>", "<dauer>sechzig</dauer>")
+        beobachte(beobachter, runden=1)
+        assert "<dauer>='sechzig'" in capsys.readouterr().err
+
+        self.aendere(beobachter, "<von>Oktober</von>", "<von>Oktobr</von>")
+        beobachte(beobachter, runden=1)
+        assert "Ungültiger Monat <von>=Oktobr" in capsys.readouterr().err
+
+    def test_watch_not_with_stream(self, tmp_path):
+        with pytest.raises(SystemExit):
+            run_in(tmp_path, self.xml_path, ["--watch", "--stream"])
+
+    def test_only_changed_pdf_compiled(self, tmp_path, monkeypatch):
+        import tcscompile
+
+        script = tmp_path / "latexmk.py"
+        script.write_text(FAKE_LATEXMK)
+        monkeypatch.setattr(tcscompile, "LATEXMK", [sys.executable, str(script)])
+        beobachter = self.create_beobachter(
+            tmp_path, pdfdir=str(tmp_path / "pdf"), builddir=str(tmp_path / "tmp")
+        )
+        beobachter.aktualisiere()
+        assert len(list((tmp_path / "pdf").iterdir())) == 2
+
+        # PDFs are rebuilt if older than their tex file
+        for datei in (tmp_path / "watch" / "tex").iterdir():
+            os.utime(datei, (1000, 1000))
+        for datei in (tmp_path / "pdf").iterdir():
+            os.utime(datei, (2000, 2000))
+        (tmp_path / "latexmk.log").unlink()
+        self.aendere(beobachter, "Hauptstraße", "Nebenstraße")
+        beobachter.aktualisiere()
+        assert [n[-4:] for n in (tmp_path / "latexmk.log").read_text().split()] == [
+            "0002"
+        ]
+
 
 class TestMailHeader:
     def test_mail_header(self):
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+
+##########################################################################
+# test_tcsserver.py - Tests for tcsserver.py                             #
+#                                                                        #
+# This program is free software: you can redistribute it and/or modify   #
+# it under the terms of the GNU General Public License as published by   #
+# the Free Software Foundation, either version 3 of the License, or      #
+# (at your option) any later version.                                    #
+#                                                                        #
+# This program is distributed in the hope that it will be useful,        #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of         #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the          #
+# GNU General Public License for more details.                           #
+#                                                                        #
+# You should have received a copy of the GNU General Public License      #
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.  #
+##########################################################################
+
+
+import sys
+import os
+import datetime
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+import pytest
+import tcscompile
+import tcsrechnung
+import tcsserver
+from tcsserver import Mehrdeutig, NichtGefunden, Rechnungsdienst, erstelle_server
+
+# Prefix of the invoice numbers, taken from the current year
+JAHR = str(datetime.date.today().year - 2000)
+
+# Stand-in for latexmk: writes <outdir>/<name>.pdf and counts its runs
+FAKE_LATEXMK = """
+import sys, os
+outdir = [a for a in sys.argv if a.startswith("-outdir=")][0][len("-outdir="):]
+name = os.path.splitext(os.path.basename(sys.argv[-1]))[0]
+with open(os.path.join(outdir, name + ".pdf"), "w") as f:
+    f.write("pdf " + name)
+with open(os.path.join(os.path.dirname(__file__), "latexmk.log"), "a") as f:
+    f.write(name + "\\n")
+"""
+
+
+class TestRechnungsdienst:
+    xml_path = Path(__file__).parent / "rechnungen.xml"
+
+    def create_dienst(self, tmp_path: Path, **kwargs) -> Rechnungsdienst:
+        eingabe = tmp_path / "rechnungen.xml"
+        eingabe.write_bytes(self.xml_path.read_bytes())
+        return Rechnungsdienst(
+            str(eingabe), builddir=str(tmp_path / "tmp"), mit_format=False, **kwargs
+        )
+
+    def aendere(self, dienst: Rechnungsdienst, alt: str, neu: str) -> None:
+        eingabe = Path(dienst.eingabedatei)
+        eingabe.write_text(eingabe.read_text().replace(alt, neu))
+        # The modification time alone may not change within the same tick
+        os.utime(eingabe, ns=(0, (dienst.stand or (0, 0))[0] + 1))
+
+    def test_same_as_run(self, tmp_path):
+        tcsrechnung.run(
+            [
+                "-o",
+                str(tmp_path / "tex"),
+                "-m",
+                str(tmp_path / "mails"),
+                str(self.xml_path),
+            ]
+        )
+        dienst = self.create_dienst(tmp_path)
+        mails = (tmp_path / "mails" / "mails.csv").read_text().splitlines()
+        for nr in [1, 2]:
+            name = f"{JAHR}_{nr:04d}"
+            assert dienst.dokument(str(nr), "tex") == (
+                name,
+                (tmp_path / "tex" / (name + ".tex")).read_bytes(),
+            )
+            assert dienst.dokument(name, "mail")[1].decode().splitlines() == [
+                mails[0],
+                mails[nr],
+            ]
+
+    def test_schluessel(self, tmp_path):
+        dienst = self.create_dienst(tmp_path)
+        tex = dienst.dokument("2", "tex")[1]
+        assert dienst.dokument(f"{JAHR}_0002", "tex")[1] == tex
+        assert dienst.dokument(f"{JAHR}/0002", "tex")[1] == tex
+        assert dienst.dokument("herr krüger", "tex")[1] == tex
+        for schluessel in ["0", "3", "25_0002", "Herr Meier"]:
+            with pytest.raises(NichtGefunden):
+                dienst.dokument(schluessel, "tex")
+
+    def test_mehrdeutig(self, tmp_path):
+        dienst = self.create_dienst(tmp_path)
+        self.aendere(dienst, "Herr Krüger", "Familie Berger")
+        with pytest.raises(Mehrdeutig, match=f"{JAHR}_0001, {JAHR}_0002"):
+            dienst.dokument("Familie Berger", "tex")
+        assert dienst.dokument("2", "tex")[1]
+
+    def test_cache(self, tmp_path):
+        dienst = self.create_dienst(tmp_path, groesse=2)
+        erstes = dienst.dokument("1", "tex")[1]
+        assert dienst.dokument("1", "tex")[1] is erstes
+        assert (dienst.treffer, dienst.fehlgriffe) == (1, 1)
+
+        # Least recently used documents are dropped first
+        dienst.dokument("2", "tex")
+        dienst.dokument("1", "tex")
+        dienst.dokument("1", "mail")
+        assert [eintrag[1:] for eintrag in dienst.cache] == [(1, "tex"), (1, "mail")]
+
+    def test_aenderung(self, tmp_path):
+        dienst = self.create_dienst(tmp_path)
+        alt = dienst.dokument("2", "tex")[1]
+        dienst.dokument("1", "tex")
+
+        # Touching the file without changing it keeps the cache
+        os.utime(dienst.eingabedatei, ns=(0, (dienst.stand or (0, 0))[0] + 1))
+        assert dienst.dokument("1", "tex")[1]
+        assert len(dienst.cache) == 2
+
+        self.aendere(dienst, "Hauptstraße", "Nebenstraße")
+        neu = dienst.dokument("2", "tex")[1]
+        assert neu != alt
+        assert "Nebenstraße".encode() in neu
+        assert len(dienst.cache) == 1
+
+    def test_fehler(self, tmp_path):
+        dienst = self.create_dienst(tmp_path)
+        self.aendere(dienst, "<email>", "<keine_email>")
+        self.aendere(dienst, "</email>", "</keine_email>")
+        with pytest.raises(tcsrechnung.TCSRechnungError, match="<email>"):
+            dienst.dokument("1", "mail")
+
+    def test_fehler_nach_laden(self, tmp_path):
+        dienst = self.create_dienst(tmp_path)
+        assert dienst.dokument("1", "tex")[1]
+        # A broken input is reported on every request until it is fixed
+        self.aendere(dienst, "<jahr>2024</jahr>", "<jahr>zwei</jahr>")
+        for _ in range(2):
+            with pytest.raises(tcsrechnung.TCSRechnungError, match="jahr"):
+                dienst.dokument("1", "tex")
+        self.aendere(dienst, "<jahr>zwei</jahr>", "<jahr>2024</jahr>")
+        assert dienst.dokument("1", "tex")[1]
+
+    def test_pdf(self, tmp_path, monkeypatch):
+        script = tmp_path / "latexmk.py"
+        script.write_text(FAKE_LATEXMK)
+        monkeypatch.setattr(tcscompile, "LATEXMK", [sys.executable, str(script)])
+        dienst = self.create_dienst(tmp_path)
+
+        name = f"{JAHR}_0002"
+        assert dienst.dokument("2", "pdf") == (name, f"pdf {name}".encode())
+        assert dienst.dokument("2", "pdf") == (name, f"pdf {name}".encode())
+        assert (tmp_path / "latexmk.log").read_text().split() == [name]
+        assert (tmp_path / "tmp" / "tex" / (name + ".tex")).read_bytes() == (
+            dienst.dokument("2", "tex")[1]
+        )
+
+    def test_noformat(self, tmp_path, monkeypatch):
+        script = tmp_path / "latexmk.py"
+        script.write_text(FAKE_LATEXMK)
+        monkeypatch.setattr(tcscompile, "LATEXMK", [sys.executable, str(script)])
+
+        def erstelle_format(cache):
+            raise AssertionError("Format trotz --noformat erstellt")
+
+        monkeypatch.setattr(tcscompile, "erstelle_format", erstelle_format)
+
+        # Stops run() right after startup and keeps its service
+        dienste = []
+
+        class Server:
+            server_port = 0
+
+            def serve_forever(self):
+                raise KeyboardInterrupt
+
+            def server_close(self):
+                pass
+
+        def erstelle(dienst, host, port):
+            dienste.append(dienst)
+            return Server()
+
+        monkeypatch.setattr(tcsserver, "erstelle_server", erstelle)
+        tcsserver.run(["--noformat", "-b", str(tmp_path / "tmp"), str(self.xml_path)])
+        (dienst,) = dienste
+        name = f"{JAHR}_0002"
+        assert dienst.dokument("2", "pdf") == (name, f"pdf {name}".encode())
+        assert dienst.fmt is None
+
+
+class TestServer:
+    xml_path = Path(__file__).parent / "rechnungen.xml"
+
+    @pytest.fixture
+    def adresse(self, tmp_path):
+        dienst = Rechnungsdienst(str(self.xml_path), builddir=str(tmp_path / "tmp"))
+        server = erstelle_server(dienst, port=0)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        yield f"http://127.0.0.1:{server.server_port}"
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+    def hole(self, url: str) -> tuple[int, str, bytes]:
+        try:
+            with urllib.request.urlopen(url) as antwort:
+                return antwort.status, antwort.headers["Content-Type"], antwort.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.headers["Content-Type"], e.read()
+
+    def test_verzeichnis(self, adresse):
+        status, typ, inhalt = self.hole(adresse + "/")
+        assert (status, typ) == (200, "text/plain; charset=utf-8")
+        assert inhalt.decode().splitlines() == [
+            f"{JAHR}_0001;Familie Berger",
+            f"{JAHR}_0002;Herr Krüger",
+        ]
+
+    def test_tex(self, adresse):
+        name = urllib.parse.quote("Herr Krüger")
+        status, typ, inhalt = self.hole(f"{adresse}/tex/{name}")
+        assert (status, typ) == (200, "text/x-tex; charset=utf-8")
+        assert inhalt.startswith(tcsrechnung.DOKUMENT_ANFANG.encode())
+        assert self.hole(f"{adresse}/tex/{JAHR}_0002")[2] == inhalt
+
+    def test_fehler(self, adresse):
+        assert self.hole(adresse + "/tex/7")[0] == 404
+        assert self.hole(adresse + "/rechnung/1")[0] == 404
+        assert self.hole(adresse + "/tex/")[0] == 404
+
+    def test_unerwarteter_fehler(self, adresse, monkeypatch, capsys):
+        def kaputt(dienst, nr, art):
+            raise KeyError("Mo")
+
+        monkeypatch.setattr(Rechnungsdienst, "_erstelle", kaputt)
+        status, typ, inhalt = self.hole(adresse + "/tex/1")
+        assert (status, typ) == (500, "text/plain; charset=utf-8")
+        assert inhalt.decode() == "Interner Fehler: KeyError: 'Mo'"
+        assert "KeyError('Mo')" in capsys.readouterr().err
+        # The service keeps answering
+        assert self.hole(adresse + "/")[0] == 200